@@ -27,9 +27,12 @@
  """
  
 import time
+import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from labelMoCapDB import MoCapLabeledDB
+import renderer
+from frameViewer import FrameViewer
 import os
 
 # -------- GLOBAL PARAMETERS ----------#
@@ -52,10 +55,12 @@ class Take:
     # - the number is between 1-4 and increases from the MCP joint (1) to the fingertip (4)
     CHECK_HAND_SKELETON_HEURISTICS = 0
     
-    # if set to true, the child and parent markers must be defined in the skeleton module.
+    # if set to true, the child and parent markers must be defined in the skeleton file.
     # Then sets the child and parent markers for each marker and uses them for interpolating the 
     # position when marker is missing. Also plots lines from child to parent. 
     USE_SKELETON = 1
+    # json file with the bones of the skeleton (None: the hand skeleton of skeleton.json)
+    SKELETON_FILE = None
     
     # Prints the names of the relabeled markers when plotting data of a frame
     DEBUG = 1
@@ -73,16 +78,82 @@ class Take:
     FRAME_MARKER_NAMES = {}
     
     # hardcoded fallback frames which are labeled correctly (1st frame already implicitly included)
+    # "auto" searches the take for such frames (see anchorFrames.findAnchorFrames)
     FALLBACK_FRAMES = []
     
     #marker names that we are sure are correctly labeled throughout the whole take. Those will be assumed to be always correct.   
     LABELED_MARKER_NAMES = []  
     
+    # directory for caching parsed logfiles. If set, a logfile is parsed only once and loaded
+    # from the cache the next time (as long as the file and the ignored markers are unchanged)
+    CACHE_DIR = None
+
+    # if set to "npz" or "npy", the labeled data is also written in a binary format next to the
+    # labeled csv file, keeping the full precision: "npz" writes a single file, "npy" a directory
+    # of .npy files that can be memory mapped (see mocapReader.readLabeledBinary)
+    BINARY_FORMAT = None
+
+    # if set to 1, the labeled positions are stored as 32bit floats, which halves the memory needed
+    # for long takes (precision ~7 digits, i.e. well below a micrometer for positions in meters)
+    FLOAT32 = 0
+
+    # if > 0, all gaps of at least that many frames in which a marker was missing are listed
+    # in a "_gaps.csv" file next to the labeled csv file, for checking the labeling
+    GAP_TABLE_MIN_LENGTH = 0
+
+    # if set to 1, every relabel event (frame, marker, old and new logfile marker) is listed in
+    # a "_relabels.csv" file next to the labeled csv file, for checking the labeling
+    RELABEL_EVENTS = 0
+
+    # groups of marker names that move rigidly, e.g. rigidBody.HAND_CLUSTERS (None: off). After labeling,
+    # missing markers of a group are placed where the shape fitted to its visible markers (at least 3)
+    # puts them (see rigidBody.py)
+    RIGID_CLUSTERS = None
+
+    # how the gaps in which a marker was missing are filled after labeling (None: they stay extrapolated):
+    # "linear": on a straight line between the frames before and after the gap
+    # "cubic": on a cubic spline that continues the velocity at both ends
+    # "skeleton": moving with the parent marker of the skeleton (see gapFill.py)
+    GAP_FILLING = None
+
+    # only gaps of at most that many frames are filled by GAP_FILLING (None: all)
+    MAX_GAP_LENGTH = 240
+
+    # how the markers are assigned to the logfile markers of the next frame:
+    # "optimal": jointly, as many markers as possible within the distance thresholds, with minimal total distance
+    # "greedy": jointly, closest pairs first
+    # "nearest": every marker to its nearest neighbor, markers competing for the same neighbor are marked missing
+    ASSIGNMENT_METHOD = "optimal"
+
+    # if set to 1, the logfile columns are split into tracklets (runs without gaps or jumps) first. Markers
+    # are only assigned anew where a tracklet starts or ends, in between they keep following their column
+    USE_TRACKLETS = 0
+
+    # number of processes labeling the take in parallel (None: one per cpu). The take is split at the
+    # fallback frames at which all markers have data, the result is the same as labeling it sequentially
+    PROCESSES = 1
+
+    # if set to 1, the take is labeled while it is read and the labeled data is written as it goes, so that
+    # the memory needed does not grow with the length of the take. Plots are made while labeling.
+    # Works only for csv files and without binary_format, gap_table_min_length, relabel_events, rigid_clusters,
+    # gap_filling, use_tracklets, processes > 1 and automatic fallback frames (processes = None labels with one
+    # process while streaming).
+    STREAMING = 0
+
+    # if set to 1, streams the take (see STREAMING) with reading, labeling and writing running at the same
+    # time in their own threads. The labeled file grows block by block, and the share of the time each stage
+    # was busy is printed at the end
+    PIPELINED = 0
+
     # Limits of x, y, z axis for plotting the marker data
     PLOT_X_LIM = (-0.5,0.5)
     PLOT_Y_LIM = (-0.5,0.5)
-    PLOT_Z_LIM = (-0.5,0.5)      
-    
+    PLOT_Z_LIM = (-0.5,0.5)
+
+    # number of processes rendering the plots in parallel (None: one per cpu). While streaming, the
+    # plots are rendered by the labeling process
+    PLOT_PROCESSES = None
+
     def __init__(self, filename, 
                  marker_names = [],
                  frame_marker_names=[],
@@ -90,12 +161,27 @@ class Take:
                  labeled_marker_names=[], 
                  check_hand_skeleton_heuristics=0,
                  use_skeleton=1,
+                 skeleton_file=None,
                  debug =1,
                  ignore_marker_names=[],
                  plot_every_X_frames = 10000, 
                  plot_xlim = (-0.5,0.5), 
                  plot_ylim = (-0.5,0.5), 
-                 plot_zlim = (-0.5,0.5)):
+                 plot_zlim = (-0.5,0.5),
+                 plot_processes = None,
+                 cache_dir = None,
+                 binary_format = None,
+                 float32 = 0,
+                 gap_table_min_length = 0,
+                 relabel_events = 0,
+                 rigid_clusters = None,
+                 gap_filling = None,
+                 max_gap_length = 240,
+                 assignment_method = "optimal",
+                 use_tracklets = 0,
+                 processes = 1,
+                 streaming = 0,
+                 pipelined = 0):
         """
             filename: the path to the log file                     
         """  
@@ -108,23 +194,58 @@ class Take:
         self.LABELED_MARKER_NAMES = labeled_marker_names
         self.CHECK_HAND_SKELETON_HEURISTICS = check_hand_skeleton_heuristics
         self.USE_SKELETON = use_skeleton
+        self.SKELETON_FILE = skeleton_file
         self.DEBUG = debug
         self.IGNORED_MARKER_NAMES = ignore_marker_names
         self.PLOT_EVERY_X_FRAMES = plot_every_X_frames
         self.PLOT_X_LIM = plot_xlim
         self.PLOT_Y_LIM = plot_ylim
         self.PLOT_Z_LIM = plot_zlim
+        self.PLOT_PROCESSES = plot_processes
+        self.CACHE_DIR = cache_dir
+        self.BINARY_FORMAT = binary_format
+        self.FLOAT32 = float32
+        self.GAP_TABLE_MIN_LENGTH = gap_table_min_length
+        self.RELABEL_EVENTS = relabel_events
+        self.RIGID_CLUSTERS = rigid_clusters
+        self.GAP_FILLING = gap_filling
+        self.MAX_GAP_LENGTH = max_gap_length
+        self.ASSIGNMENT_METHOD = assignment_method
+        self.USE_TRACKLETS = use_tracklets
+        self.PROCESSES = processes
+        self.PIPELINED = pipelined
+        self.STREAMING = streaming or pipelined
+        if self.STREAMING and (self.file.lower().endswith(".c3d") or self.BINARY_FORMAT is not None or self.GAP_TABLE_MIN_LENGTH > 0 or
+                               self.RELABEL_EVENTS or self.RIGID_CLUSTERS is not None or self.GAP_FILLING is not None or
+                               self.USE_TRACKLETS or (self.PROCESSES is not None and self.PROCESSES > 1) or self.FALLBACK_FRAMES == "auto"):
+            raise ValueError("Streaming works only for csv files and not with binary_format, gap_table_min_length, relabel_events, "
+                             "rigid_clusters, gap_filling, use_tracklets, processes > 1 or fallback_frames = \"auto\"")
         
         if not os.path.exists("IMG"):
             os.makedirs("IMG")
     
-        self.readIn()
-        
-        #Write out the relabeled data
-        labeledName = self.file.split(".")[0] + "_labeled." + self.file.split('.')[1]
+        #Name of the relabeled data (c3d files are written as csv)
+        extension = self.file.split('.')[1]
+        if extension.lower() == "c3d":
+            extension = "csv"
+        labeledName = self.file.split(".")[0] + "_labeled." + extension
         directory = "/".join(labeledName.split("/")[0:len(labeledName.split("/"))-1]) + "/"
         labeledName = directory + labeledName.split("/")[-1]        
-        self.labeledDB.writeOutData(labeledName)
+        self.labeledName = labeledName
+
+        self.readIn()
+        
+        #Write out the relabeled data (already written while streaming)
+        if not self.STREAMING:
+            self.labeledDB.writeOutData(labeledName)
+        if self.BINARY_FORMAT == "npz":
+            self.labeledDB.writeOutBinary(labeledName.rsplit(".", 1)[0] + ".npz", "npz")
+        elif self.BINARY_FORMAT == "npy":
+            self.labeledDB.writeOutBinary(labeledName.rsplit(".", 1)[0], "npy")
+        if self.GAP_TABLE_MIN_LENGTH > 0:
+            self.labeledDB.writeGapTable(labeledName.rsplit(".", 1)[0] + "_gaps.csv", self.GAP_TABLE_MIN_LENGTH)
+        if self.RELABEL_EVENTS:
+            self.labeledDB.writeRelabelEvents(labeledName.rsplit(".", 1)[0] + "_relabels.csv")
         
         
         
@@ -147,7 +268,16 @@ class Take:
                                    labeled_marker_names=self.LABELED_MARKER_NAMES,
                                    check_hand_data = self.CHECK_HAND_SKELETON_HEURISTICS,
                                    ignored_markers = self.IGNORED_MARKER_NAMES,
-                                   use_skeleton = self.USE_SKELETON
+                                   use_skeleton = self.USE_SKELETON,
+                                   skeleton_file = self.SKELETON_FILE,
+                                   cache_dir = self.CACHE_DIR,
+                                   dtype = np.float32 if self.FLOAT32 else np.float64,
+                                   assignment_method = self.ASSIGNMENT_METHOD,
+                                   use_tracklets = self.USE_TRACKLETS,
+                                   processes = self.PROCESSES,
+                                   stream_to = self.labeledName if self.STREAMING else None,
+                                   on_flush = self._plotFlushedFrames if self.STREAMING and self.PLOT_EVERY_X_FRAMES > 0 else None,
+                                   pipelined = self.PIPELINED
                                    )
         
         
@@ -155,7 +285,11 @@ class Take:
         
         self.labeledDB = labeledDB
         self.markers = labeledDB.markers   
-        if self.PLOT_EVERY_X_FRAMES > 0:     
+        if self.RIGID_CLUSTERS is not None:
+            labeledDB.fitRigidClusters(self.RIGID_CLUSTERS)
+        if self.GAP_FILLING is not None:
+            labeledDB.fillGaps(self.GAP_FILLING, self.MAX_GAP_LENGTH)
+        if self.PLOT_EVERY_X_FRAMES > 0 and not self.STREAMING:     
             self.save_plots_everyXFrames(x_frames=self.PLOT_EVERY_X_FRAMES)
         
         print "DONE LABELING"
@@ -165,16 +299,31 @@ class Take:
     
     def save_plots_everyXFrames(self, x_frames=10000):
         #Save images every 10000 frames, start with first and end with last
-        frame=0 
-        while frame < int(self.labeledDB.frames-1):
-            plotName = "IMG/"+self.file.split("/")[-1].split(".")[0] + "_" + str(frame) + ".png"
-            self.plotAt(frame, filename=plotName)
-            frame+=x_frames
-                    
-        #also print last        
-        frame = int(self.labeledDB.frames-1)
-        plotName = "IMG/"+self.file.split("/")[-1].split(".")[0] + "_" + str(frame) + ".png"
-        self.plotAt(frame, filename=plotName)
+        frames = self.getPlotFrames(self.labeledDB.frames, x_frames)
+        renderer.renderSnapshots(self.labeledDB, frames, [self.getPlotName(frame) for frame in frames],
+                                 self.getPlotLimits(), self.DEBUG, self.PLOT_PROCESSES)
+
+    def getPlotFrames(self, frames, x_frames=10000):
+        """
+            Returns the frames that are plotted: every x_frames frames and the last one
+        """
+        return range(0, int(frames-1), x_frames) + [int(frames-1)]
+
+    def getPlotName(self, frame):
+        return "IMG/"+self.file.split("/")[-1].split(".")[0] + "_" + str(frame) + ".png"
+
+    def getPlotLimits(self):
+        return (self.PLOT_X_LIM, self.PLOT_Y_LIM, self.PLOT_Z_LIM)
+
+    def _plotFlushedFrames(self, labeledDB, begin, end):
+        """
+            Plots the frames begin <= frame < end while streaming, before they are dropped
+        """
+        self.markers = labeledDB.markers
+        frames = [frame for frame in self.getPlotFrames(labeledDB.frames, self.PLOT_EVERY_X_FRAMES) if begin <= frame < end]
+        #in this process, the reader and writer threads are running
+        renderer.renderSnapshots(labeledDB, frames, [self.getPlotName(frame) for frame in frames],
+                                 self.getPlotLimits(), self.DEBUG, processes=1)
         
     
     def plotAt(self, frame,
@@ -182,36 +331,21 @@ class Take:
         """
         plots the data of this study take at the  given frame
         """
-                  
-        fig = plt.figure(figsize=(18,12))            
-        ax = fig.add_subplot(111, projection='3d')
-        
-    
-        debugtext="Remaps: \n" 
-        for marker in self.markers:
-            debugtext = marker.plotAtFrame(ax, frame, debugtext, self.DEBUG) #actual plotting is done in marker object
-            
-        if self.DEBUG: 
-            mapping_text = ax.text2D(-0.1, 0.8, debugtext , transform=ax.transAxes, va = 'top')
-            
-                     
-        frame_text = ax.text2D(-0.1, 0.95, "Frame: " + str(frame), transform=ax.transAxes)
-        
-        #adjust limits of X, Y, and Z axis as you like 
-        ax.set_xlim3d(self.PLOT_X_LIM)
-        ax.set_ylim3d(self.PLOT_Y_LIM)
-        ax.set_zlim3d(self.PLOT_Z_LIM)
-        
-        ax.set_xlabel('X')
-        ax.set_ylabel('Z')
-        ax.set_zlabel('Y')
-        
-        ax.view_init(azim=90, elev=70) #takes car of the viewing angle
-        if filename == "":
-            plt.show()
-        else:
+        if filename != "":
             #Store it as an image
-            plt.savefig(filename, bbox_inches='tight')
-            
-            
-           
\ No newline at end of file
+            renderer.renderSnapshots(self.labeledDB, [frame], [filename], self.getPlotLimits(), self.DEBUG)
+            return
+
+        fig = plt.figure(figsize=renderer.FIGURE_SIZE)
+        text = renderer.getRelabelTexts(self.labeledDB, [frame])[frame] if self.DEBUG else None
+        renderer.drawFrame(fig, renderer.getFramePositions(self.labeledDB, frame),
+                           renderer.getBones(self.labeledDB.compiledSkeleton), frame, text, self.getPlotLimits())
+        plt.show()
+
+    def getViewer(self, headless=0):
+        """
+            Returns a FrameViewer for stepping through the frames of the labeled take
+        """
+        if self.STREAMING:
+            raise ValueError("The frames of a streamed take are not kept in memory")
+        return FrameViewer(self.labeledDB, self.getPlotLimits(), self.DEBUG, headless)
@@ -0,0 +1,195 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Finds frames of a take that can serve as fallback frames (anchors): frames at which the
+# logfile itself is labeled correctly, so that the labeling can restart from the logfile there.
+# A frame is a candidate if
+#   - every labeled marker has data in its own (named) column,
+#   - the distances between neighboring markers are close to those in the reference frame,
+#   - no other column has data inside the bounding box of the labeled markers (ghosts),
+#   - the named columns were present and did not jump for the preceding frames (no recent relabels).
+# The scan works on blocks of frames of the parsed (frames x columns x 3) array at once.
+# The returned frames can be passed as fallback_frames to Take or MoCapLabeledDB.
+
+import bisect
+import numpy as np
+
+from skeleton import HAND_SKELETON
+
+
+DISTANCE_TOLERANCE = 0.01   # meters, how much the distance between neighboring markers may differ from the reference frame
+BBOX_THRESH = 0.03          # meters, padding of the bounding box in which no other column may have data
+MAX_JUMP = 0.015            # meters, a named column moving further than this from one frame to the next was probably relabeled
+STABLE_FRAMES = 240         # the named columns must be present and not jump for that many frames before an anchor
+MIN_SPACING = 2400          # minimum number of frames between two returned anchors
+BLOCK_FRAMES = 65536        # number of frames scanned at once
+
+
+def getMarkerPairs(markerNames, referencePositions, skeleton=HAND_SKELETON):
+    """
+        Returns the (n x 2) indexes of the marker pairs whose distance is checked: the bones of the
+        skeleton, or if the markers are not named like the skeleton, every marker and its nearest
+        neighbor in the reference positions (markers x 3).
+    """
+    index = dict((name, i) for i, name in enumerate(markerNames))
+    pairs = [(i, index[skeleton.parents[name]]) for i, name in enumerate(markerNames) if skeleton.parents.get(name) in index]
+    if len(pairs) == 0 and len(markerNames) > 1:
+        diff = referencePositions[:, np.newaxis, :] - referencePositions[np.newaxis, :, :]
+        dist = np.einsum('ijk,ijk->ij', diff, diff)
+        np.fill_diagonal(dist, np.inf)
+        pairs = [(i, j) for i, j in enumerate(dist.argmin(axis=1)) if i < j or dist[j].argmin() != i]
+    return np.array(pairs, dtype=np.intp).reshape(-1, 2)
+
+
+def _scanBlock(positions, named, others, pairs, referenceDistances, previous, bboxThresh, maxJump):
+    """
+        Checks the frames of a block. previous are the positions of the named columns in the
+        frame before the block (NaN if there is none).
+        Returns whether the named columns are present without ghosts around them, whether they are
+        present and did not jump since the frame before (both bool arrays), and the largest deviation
+        from the reference distances (float array, inf where not all named columns are present).
+    """
+    #all further checks only for the frames in which all named columns are present
+    present = ~np.isnan(positions[:, named, 0]).any(axis=1)
+    frames = np.flatnonzero(present)
+    labeled = positions[frames[:, np.newaxis], named]
+    clean = np.zeros(len(positions), dtype=bool)
+    steady = np.zeros(len(positions), dtype=bool)
+    deviation = np.full(len(positions), np.inf)
+
+    #jumps of the named columns since the frame before
+    before = np.concatenate([previous[np.newaxis], labeled[:-1]])
+    step = labeled - before
+    with np.errstate(invalid="ignore"):
+        steady[frames] = (np.einsum('ijk,ijk->ij', step, step) <= maxJump**2).all(axis=1)
+    steady[frames[np.diff(np.r_[-1, frames]) > 1]] = False     # the frame before is not present
+
+    #distances between neighboring markers
+    diff = labeled[:, pairs[:, 0]] - labeled[:, pairs[:, 1]]
+    if len(pairs) > 0:
+        deviation[frames] = np.abs(np.sqrt(np.einsum('ijk,ijk->ij', diff, diff)) - referenceDistances).max(axis=1)
+    else:
+        deviation[frames] = 0
+
+    #other columns with data inside the padded bounding box
+    lower = labeled.min(axis=1) - bboxThresh
+    upper = labeled.max(axis=1) + bboxThresh
+    other = positions[frames[:, np.newaxis], others]
+    with np.errstate(invalid="ignore"):
+        ghosts = ((other >= lower[:, np.newaxis, :]) & (other <= upper[:, np.newaxis, :])).all(axis=2).any(axis=1)
+    clean[frames] = ~ghosts
+
+    return clean, steady, deviation
+
+
+def findAnchorFrames(rawData, markerNames,
+                     skeleton=HAND_SKELETON,
+                     referenceFrame=0,
+                     count=None,
+                     distanceTolerance=DISTANCE_TOLERANCE,
+                     bboxThresh=BBOX_THRESH,
+                     maxJump=MAX_JUMP,
+                     stableFrames=STABLE_FRAMES,
+                     minSpacing=MIN_SPACING,
+                     blockFrames=BLOCK_FRAMES):
+    """
+        Input:
+            rawData: MoCapRawData of the take
+            markerNames: names of the labeled markers, the columns they should be in at an anchor
+            skeleton: Skeleton whose bones are the marker pairs whose distances are checked
+            referenceFrame: frame at which the logfile is labeled correctly (the first frame by convention)
+            count: maximum number of returned anchors (None: all)
+        Output: int[]
+            Anchor frames, best first (smallest deviation from the reference distances), at least
+            minSpacing frames apart from each other.
+    """
+    columnIndex = dict((name, i) for i, name in enumerate(rawData.names))
+    missingNames = [name for name in markerNames if not name in columnIndex]
+    if missingNames:
+        raise ValueError("Markers not in the logfile: " + ", ".join(missingNames))
+    named = np.array([columnIndex[name] for name in markerNames], dtype=np.intp)
+    others = np.setdiff1d(np.arange(len(rawData.names)), named)
+    positions = rawData.positions
+    frames = positions.shape[0]
+
+    reference = positions[referenceFrame, named].astype(np.float64)
+    if np.isnan(reference).any():
+        raise ValueError("Not all markers have data at the reference frame " + str(referenceFrame))
+    pairs = getMarkerPairs(markerNames, reference, skeleton)
+    diff = reference[pairs[:, 0]] - reference[pairs[:, 1]]
+    referenceDistances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    candidate = np.zeros(frames, dtype=bool)
+    steady = np.zeros(frames, dtype=bool)
+    deviation = np.empty(frames)
+    previous = np.full((len(named), 3), np.nan)
+    for begin in range(0, frames, blockFrames):
+        end = min(frames, begin + blockFrames)
+        candidate[begin:end], steady[begin:end], deviation[begin:end] = \
+            _scanBlock(positions[begin:end], named, others, pairs, referenceDistances, previous, bboxThresh, maxJump)
+        previous = positions[end-1, named]
+
+    #number of steady frames up to every frame
+    frameIndexes = np.arange(frames)
+    lastUnsteady = np.maximum.accumulate(np.where(steady, -1, frameIndexes))
+    stable = frameIndexes - lastUnsteady >= stableFrames
+
+    candidate &= stable & (deviation <= distanceTolerance)
+    candidate[0:referenceFrame+1] = False
+    candidates = np.flatnonzero(candidate)
+    if len(candidates) == 0:
+        return []
+
+    #best candidate of every window of minSpacing frames, then best first as long as they are far enough apart
+    windows = candidates // max(minSpacing, 1)
+    order = np.lexsort((deviation[candidates], windows))
+    best = order[np.r_[True, windows[order][1:] != windows[order][:-1]]]
+    best = candidates[best[np.argsort(deviation[candidates[best]], kind="mergesort")]]
+    anchors = []
+    chosen = [referenceFrame]
+    for frame in best:
+        i = bisect.bisect(chosen, frame)
+        if (i > 0 and frame - chosen[i-1] < minSpacing) or (i < len(chosen) and chosen[i] - frame < minSpacing):
+            continue
+        chosen.insert(i, frame)
+        anchors.append(int(frame))
+        if count is not None and len(anchors) >= count:
+            break
+    return anchors
+
+
+if __name__ == "__main__":
+    import sys
+    from mocapReader import readMoCapCSV
+    if len(sys.argv) < 2:
+        print "Usage: python anchorFrames.py <logfile.csv> [marker names]"
+        sys.exit(1)
+    rawData = readMoCapCSV(sys.argv[1])
+    markerNames = sys.argv[2:] if len(sys.argv) > 2 else [n for n in rawData.names if not n.startswith("Marker")]
+    for frame in findAnchorFrames(rawData, markerNames):
+        print "Frame", frame, "time", rawData.times[frame]
@@ -0,0 +1,172 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Labels all takes of a session, several at once. Run as
+#     python batch.py <directory or glob> [options.json] [processes]
+# e.g. python batch.py "Logfiles/*.csv" Logfiles/options.json
+#
+# The options file is a json dictionary from the file name of a take to the arguments of
+# Take for that take (marker_names, ignore_marker_names, fallback_frames, ...). The entry
+# "default" applies to all takes, e.g.
+#     {"default": {"check_hand_skeleton_heuristics": 1, "ignore_marker_names": ["Hands_R_Cout"]},
+#      "take3.csv": {"fallback_frames": [5000, 120000]}}
+
+import os
+import sys
+import glob
+import json
+import time
+import traceback
+import multiprocessing
+
+from Take import Take
+
+
+# files written by Take next to the take, which are not labeled again
+OUTPUT_SUFFIXES = ("_labeled.csv", "_gaps.csv", "_relabels.csv")
+
+
+def findTakes(path):
+    """
+        Returns the csv and c3d files in the given directory or matching the given glob pattern,
+        without the files written by Take
+    """
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, "*.csv")) + glob.glob(os.path.join(path, "*.c3d"))
+    else:
+        files = glob.glob(path)
+    return sorted([f for f in files if not f.endswith(OUTPUT_SUFFIXES)])
+
+
+def readOptions(filename):
+    """
+        Reads the options file, see above. Returns a dictionary from file name to Take arguments
+    """
+    if filename is None:
+        return {}
+    with open(filename) as f:
+        options = json.load(f)
+    for takeOptions in options.values():
+        #json only has string keys
+        if "frame_marker_names" in takeOptions:
+            takeOptions["frame_marker_names"] = dict((int(frame), names) for frame, names in takeOptions["frame_marker_names"].items())
+    return options
+
+
+def getTakeOptions(options, filename):
+    """
+        Returns the Take arguments for the given take: the defaults updated by the ones of the take
+    """
+    takeOptions = dict(options.get("default", {}))
+    takeOptions.update(options.get(os.path.basename(filename), {}))
+    return dict((str(key), value) for key, value in takeOptions.items())
+
+
+def _labelTake(job):
+    """
+        Labels one take in a worker process. Returns a dictionary with the statistics of the summary table
+    """
+    filename, takeOptions = job
+    stats = {"take": filename, "frames": 0, "seconds": 0.0, "missing": 0.0, "relabels": 0, "error": None}
+    start_time = time.time()
+    try:
+        take = Take(filename, **takeOptions)
+        db = take.labeledDB
+        stats["frames"] = db.frames
+        if db.stream_to is not None:
+            stats["missing"] = float("nan")        # the missing frames are not kept while streaming
+        elif len(db.markers) > 0:
+            stats["missing"] = 100.0 * db.getMissingMask().mean()
+        stats["relabels"] = len(db.getRelabelEvents())
+    except Exception:
+        stats["error"] = traceback.format_exc().strip().split("\n")[-1]
+        traceback.print_exc()
+    stats["seconds"] = time.time() - start_time
+    return stats
+
+
+def printSummary(results):
+    """
+        Prints one line per take: wall time, frames per second, percentage of missing marker frames
+        and number of relabel events
+    """
+    width = max([len(os.path.basename(r["take"])) for r in results] + [4])
+    print "%-*s %10s %10s %10s %10s %10s" % (width, "take", "frames", "seconds", "frames/s", "missing %", "relabels")
+    for r in results:
+        name = os.path.basename(r["take"])
+        if r["error"] is not None:
+            print "%-*s FAILED: %s" % (width, name, r["error"])
+            continue
+        print "%-*s %10d %10.1f %10.0f %10.2f %10d" % (width, name, r["frames"], r["seconds"],
+                                                      r["frames"] / max(r["seconds"], 1e-9), r["missing"], r["relabels"])
+
+
+def labelTakes(files, options={}, processes=None):
+    """
+        Labels the given takes with the given options (see readOptions) in a pool of processes
+        (None: one per cpu), writes the labeled files and plots of every take and prints the summary.
+        Returns the statistics of every take.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(files)))
+    jobs = []
+    for filename in files:
+        takeOptions = getTakeOptions(options, filename)
+        if processes > 1:
+            #the workers of the pool cannot start processes themselves
+            takeOptions["processes"] = 1
+            takeOptions["plot_processes"] = 1
+        jobs.append((filename, takeOptions))
+
+    start_time = time.time()
+    if processes > 1:
+        #a fresh process for every take, so that the memory of a long take is freed
+        pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+        results = pool.map(_labelTake, jobs, 1)
+        pool.close()
+        pool.join()
+    else:
+        results = [_labelTake(job) for job in jobs]
+
+    print
+    print "Labeled", len(files), "takes with", processes, "processes in %.1f seconds" % (time.time() - start_time)
+    printSummary(results)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: python batch.py <directory or glob> [options.json] [processes]"
+        sys.exit(1)
+    files = findTakes(sys.argv[1])
+    if len(files) == 0:
+        print "No takes found:", sys.argv[1]
+        sys.exit(1)
+    options = readOptions(sys.argv[2] if len(sys.argv) > 2 else None)
+    labelTakes(files, options, int(sys.argv[3]) if len(sys.argv) > 3 else None)
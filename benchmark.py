@@ -0,0 +1,599 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Benchmarks for the labeling pipeline. Run as
+#     python benchmark.py <benchmark> [arguments]
+# e.g. python benchmark.py parsing Logfiles/test.csv
+
+import os
+import sys
+import time
+import struct
+import resource
+import multiprocessing
+import numpy as np
+
+from mocapReader import readMoCapCSV
+from mocapWriter import writeLabeledCSV
+from c3dReader import readC3D
+import helper
+import neighborSearch
+import renderer
+from frameViewer import FrameViewer
+import gapFill
+import rigidBody
+from skeleton import HAND_SKELETON
+from labelMoCapDB import MoCapLabeledDB
+
+
+def _timeit(function, repeat=3):
+    """
+        Returns the best wall time of repeat runs of the given function
+        (repeat may be a command line argument)
+    """
+    best = float("inf")
+    for _ in range(int(repeat)):
+        start_time = time.time()
+        function()
+        best = min(best, time.time() - start_time)
+    return best
+
+
+def _legacyParse(datafile, mirrorX=1):
+    """
+        The original line-by-line parser of MoCapLabeledDB (split and float() every cell,
+        one dictionary per frame), kept as a reference for the benchmarks.
+    """
+    f = open(datafile, 'r')
+    data_in = f.read().splitlines()
+    f.close()
+    items = data_in.pop(3).split(',')[2:]
+    names = items[0::3]
+    del data_in[0:6]
+    frames = []
+    for row in data_in:
+        all_rowdata = row.split(',')
+        if len(all_rowdata) < len(names):
+            all_rowdata = row.split('\t')
+        data = all_rowdata[2:]
+        rawdata = {}
+        index = 0
+        for n in range(0, len(data), 3):
+            if not data[n] == "":
+                if mirrorX:
+                    datapoint = [float(-1)*float(data[n]), float(data[n+1]), float(data[n+2])]
+                else:
+                    datapoint = [float(data[n]), float(data[n+1]), float(data[n+2])]
+            else:
+                datapoint = []
+            rawdata[names[index]] = datapoint
+            index += 1
+        frames.append(rawdata)
+    return frames
+
+
+def benchmarkParsing(datafile, repeat=3):
+    """
+        Compares the original per-frame parser with readMoCapCSV, both on their own
+        and including the per-frame dictionaries served to the labeler.
+    """
+    def bulk():
+        rawData = readMoCapCSV(datafile)
+        for frame in range(rawData.frames):
+            rawData.getFrame(frame)
+
+    legacy_time = _timeit(lambda: _legacyParse(datafile), repeat)
+    parse_time = _timeit(lambda: readMoCapCSV(datafile), repeat)
+    bulk_time = _timeit(bulk, repeat)
+    frames = readMoCapCSV(datafile).frames
+
+    print "Parsing", datafile, "(", frames, "frames )"
+    print "  legacy get_rawdata:          %.3f s" % legacy_time
+    print "  readMoCapCSV:                %.3f s (x%.1f)" % (parse_time, legacy_time/parse_time)
+    print "  readMoCapCSV + getFrame:     %.3f s (x%.1f)" % (bulk_time, legacy_time/bulk_time)
+
+
+def _legacyWrite(filename, datafile, names, markerData):
+    """
+        The original writeOutData: re-reads the logfile for Frame and Time and
+        concatenates every row cell by cell.
+    """
+    f_new = open(filename, 'w')
+    f_orig = open(datafile, 'r')
+    original = f_orig.readlines()
+    f_orig.close()
+    f_new.write(original[0] + "\n"+ "\n")
+    markerline = ","
+    columnline = "Frame, Time"
+    for n in names:
+        markerline = markerline + "," + n + "," + n + "," + n
+        columnline = columnline + ",X,Y,Z"
+    f_new.write(markerline + "\n")
+    f_new.write("\n\n")
+    f_new.write(columnline + "\n")
+    for i in range(0, len(markerData[0])):
+        orig_entry = original[i+7].split(",")
+        new_entry = orig_entry[0] + "," + orig_entry[1]
+        for data in markerData:
+            framedata = data[i]
+            if framedata == []:
+                new_entry = new_entry + ",,,"
+            else:
+                new_entry = new_entry + "," + "{:f}".format(framedata[0]) + "," + "{:f}".format(framedata[1]) + "," + "{:f}".format(framedata[2])
+        f_new.write(new_entry + "\n")
+    f_new.close()
+
+
+def benchmarkWriting(datafile, columns=50, repeat=3):
+    """
+        Compares the original writeOutData with writeLabeledCSV, writing the first
+        columns of the given logfile as labeled markers. Checks that the output is identical.
+    """
+    rawData = readMoCapCSV(datafile, mirrorX=0)
+    columns = min(int(columns), len(rawData.names))
+    names = rawData.names[0:columns]
+    markerData = [rawData.positions[:, i].copy() for i in range(columns)]
+    markerLists = [[[] if p[0] != p[0] else p for p in data.tolist()] for data in markerData]
+
+    legacy_time = _timeit(lambda: _legacyWrite("_benchmark_legacy.csv", datafile, names, markerLists), repeat)
+    write_time = _timeit(lambda: writeLabeledCSV("_benchmark_new.csv", rawData.headerLine, names,
+                                                 rawData.frameText, rawData.timeText, markerData), repeat)
+    identical = open("_benchmark_legacy.csv", 'rb').read() == open("_benchmark_new.csv", 'rb').read()
+    os.remove("_benchmark_legacy.csv")
+    os.remove("_benchmark_new.csv")
+
+    print "Writing", columns, "markers x", rawData.frames, "frames"
+    print "  legacy writeOutData:         %.3f s" % legacy_time
+    print "  writeLabeledCSV:             %.3f s (x%.1f)" % (write_time, legacy_time/write_time)
+    print "  identical output:           ", identical
+
+
+def _writeC3D(filename, rawData, frameRate=240.0):
+    """
+        Writes the given MoCapRawData as C3D file (Intel, float point data in mm, no analog data).
+    """
+    points = len(rawData.names)
+    frames = rawData.frames
+    length = max([len(n) for n in rawData.names] + [1])
+
+    def record(identifier, name, body, last=0):
+        return struct.pack('bb', len(name), identifier) + name + struct.pack('<h', 0 if last else len(body) + 2) + body
+
+    def parameter(group, name, dataType, dimensions, data, last=0):
+        return record(group, name, struct.pack('bb', dataType, len(dimensions)) +
+                      struct.pack('%dB' % len(dimensions), *dimensions) + data + '\0', last)
+
+    def parameterSection(dataStart):
+        records = [record(-1, "POINT", '\0'),
+                   record(-2, "ANALOG", '\0'),
+                   record(-3, "TRIAL", '\0'),
+                   parameter(1, "USED", 2, [], struct.pack('<h', points)),
+                   parameter(1, "SCALE", 4, [], struct.pack('<f', -1.0)),
+                   parameter(1, "RATE", 4, [], struct.pack('<f', frameRate)),
+                   parameter(1, "FRAMES", 2, [], struct.pack('<H', min(frames, 65535))),
+                   parameter(1, "UNITS", -1, [2], "mm"),
+                   parameter(1, "DATA_START", 2, [], struct.pack('<h', dataStart)),
+                   parameter(2, "USED", 2, [], struct.pack('<h', 0)),
+                   parameter(3, "ACTUAL_START_FIELD", 2, [2], struct.pack('<HH', 1, 0))]
+        #at most 255 labels per parameter
+        for i in range(0, points, 255):
+            names = rawData.names[i:i+255]
+            records.append(parameter(1, "LABELS" if i == 0 else "LABELS%d" % (i // 255 + 1), -1,
+                                     [length, len(names)], "".join([n.ljust(length) for n in names])))
+        records.append(parameter(3, "ACTUAL_END_FIELD", 2, [2], struct.pack('<HH', frames % 65536, frames // 65536), last=1))
+        return "".join(records)
+
+    parameterBlocks = (4 + len(parameterSection(0))) // 512 + 1
+    dataStart = 2 + parameterBlocks
+    header = struct.pack('<BBHHHHHfHHf', 2, 0x50, points, 0, 1, min(frames, 65535), 0, -1.0, dataStart, 0, frameRate)
+    pointData = np.zeros((frames, points, 4), dtype='<f4')
+    pointData[:, :, 0:3] = np.nan_to_num(rawData.positions) * 1000.0
+    pointData[:, :, 3] = np.where(np.isnan(rawData.positions[:, :, 0]), -1.0, 1.0)
+
+    f = open(filename, 'wb')
+    f.write(header.ljust(512, '\0'))
+    f.write((struct.pack('BBBB', 1, 0x50, parameterBlocks, 84) + parameterSection(dataStart)).ljust(512*parameterBlocks, '\0'))
+    f.write(pointData.tostring())
+    f.close()
+
+
+def benchmarkC3D(datafile, repeat=3):
+    """
+        Converts the given csv logfile to C3D and compares the parse time of both formats.
+    """
+    rawData = readMoCapCSV(datafile, mirrorX=0)
+    _writeC3D("_benchmark.c3d", rawData)
+    c3dData = readC3D("_benchmark.c3d", mirrorX=0)
+    identical = c3dData.names == rawData.names and \
+                np.array_equal(np.isnan(c3dData.positions), np.isnan(rawData.positions)) and \
+                np.allclose(np.nan_to_num(c3dData.positions), np.nan_to_num(rawData.positions), atol=1e-6)
+
+    csv_time = _timeit(lambda: readMoCapCSV(datafile), repeat)
+    c3d_time = _timeit(lambda: readC3D("_benchmark.c3d"), repeat)
+    c3d_size = os.path.getsize("_benchmark.c3d")
+    os.remove("_benchmark.c3d")
+
+    print "Parsing", rawData.frames, "frames x", len(rawData.names), "markers"
+    print "  readMoCapCSV: %.3f s (%.1f MB)" % (csv_time, os.path.getsize(datafile)/1e6)
+    print "  readC3D:      %.3f s (%.1f MB, x%.1f)" % (c3d_time, c3d_size/1e6, csv_time/c3d_time)
+    print "  same data:   ", identical
+
+
+def _randomFrames(markers, candidates, frames, seed=0):
+    """
+        Random marker positions in a hand sized volume and, for every frame, candidate
+        points: the moved markers (some of them missing) plus random extra points.
+    """
+    rng = np.random.RandomState(seed)
+    previous = rng.uniform(-0.1, 0.1, size=(frames, markers, 3))
+    moved = previous + rng.normal(0, 0.003, size=previous.shape)
+    points = np.concatenate([moved, rng.uniform(-0.1, 0.1, size=(frames, max(candidates - markers, 0), 3))], axis=1)
+    points = points[:, 0:candidates]
+    for frame in range(frames):
+        rng.shuffle(points[frame])
+    return previous, points
+
+
+def benchmarkAssignment(markers=40, candidates=60, frames=1000):
+    """
+        Per-frame cost of assigning the markers to the candidate points of a frame:
+        the original helper.nearestNeighbor and helper.assignMarkers with both methods.
+    """
+    markers, candidates, frames = int(markers), int(candidates), int(frames)
+    previous, points = _randomFrames(markers, candidates, frames)
+    markerNames = ["M%d" % i for i in range(markers)]
+    pointNames = ["P%d" % i for i in range(candidates)]
+    lastData = [dict(zip(markerNames, previous[frame].tolist())) for frame in range(frames)]
+    pointData = [dict(zip(pointNames, points[frame].tolist())) for frame in range(frames)]
+    gates = np.full(markers, 0.015)
+
+    def legacy():
+        for frame in range(frames):
+            helper.nearestNeighbor(lastData[frame], pointData[frame], None, frame)
+
+    def assign(method):
+        for frame in range(frames):
+            helper.assignMarkers(previous[frame], points[frame], gates, method)
+
+    legacy_time = _timeit(legacy, 1)
+    print "Assigning", markers, "markers to", candidates, "points,", frames, "frames"
+    print "  nearestNeighbor:        %.1f us/frame" % (1e6*legacy_time/frames)
+    for method in helper.ASSIGNMENT_METHODS:
+        assign_time = _timeit(lambda: assign(method), 1)
+        print "  assignMarkers %-8s  %.1f us/frame (x%.1f)" % (method + ":", 1e6*assign_time/frames, legacy_time/assign_time)
+
+
+def benchmarkNeighbors(repeat=3):
+    """
+        Builds each neighbor search backend and queries the nearest neighbor of every point,
+        for different numbers of neighbors and points, and shows which backend "auto" selects.
+    """
+    rng = np.random.RandomState(0)
+    sizes = [(40, 40), (40, 60), (100, 100), (1000, 10), (1000, 1000),
+             (10000, 100), (10000, 1000), (100000, 100), (100000, 10000)]
+    backends = sorted(neighborSearch.BACKENDS.keys())
+    print "%9s %8s" % ("neighbors", "points") + "".join(["%12s" % b for b in backends]) + "    auto"
+    for numNeighbors, numPoints in sizes:
+        neighbors = rng.uniform(0, 1, size=(numNeighbors, 3))
+        points = neighbors[rng.randint(numNeighbors, size=numPoints)] + rng.normal(0, 0.001, size=(numPoints, 3))
+        line = "%9d %8d" % (numNeighbors, numPoints)
+        for backend in backends:
+            if backend == "brute" and numNeighbors * numPoints > 1e7:
+                line += "%12s" % "-"
+                continue
+            search = neighborSearch.BACKENDS[backend]
+            line += "%10.0fus" % (1e6*_timeit(lambda: search(neighbors).query(points), repeat))
+        print line + "    " + neighborSearch.selectBackend(numNeighbors, numPoints)
+
+
+def _syntheticHandTake(frames, seed=0):
+    """
+        Marker names and (frames x markers x 3) positions of both hands at 240 Hz that follow
+        the hand skeleton: the roots move slowly, 3 cm apart, every child is at 2-4 cm from its
+        parent on a bone that swings back and forth in the plane of its root. The bones of the back
+        of the hand and the wrist are fixed, so that those markers move rigidly (up to 0.2 mm noise).
+    """
+    rng = np.random.RandomState(seed)
+    names = sorted(set(HAND_SKELETON.parents.keys()) | set(HAND_SKELETON.children.keys()))
+    skeleton = HAND_SKELETON.compile(names)
+    t = np.arange(frames)[:, np.newaxis] / 240.0
+    positions = np.empty((frames, len(names), 3))
+    phases = {1: rng.uniform(0, 2*np.pi, 3), -1: rng.uniform(0, 2*np.pi, 3)}
+    roots = 0
+    for i in skeleton.order:
+        if skeleton.parents[i] < 0:
+            #the roots of a hand next to each other, moving together
+            side = 1 if "_R_" in names[i] else -1
+            positions[:, i] = [side * (0.1 + 0.03*(roots % 8)), 0.02*(roots % 2), 0.0]
+            positions[:, i] += 0.03 * np.sin(2*np.pi*np.array([0.3, 0.2, 0.1])*t + phases[side])
+            roots += 1
+        else:
+            direction = np.array([0, 0.3, 1.0]) + [0, rng.normal(0, 0.1), rng.normal(0, 0.1)]
+            direction /= np.linalg.norm(direction)
+            swing = np.cross(direction, [1.0, 0, 0])
+            swing /= np.linalg.norm(swing)
+            angle = 0.4 * np.sin(2*np.pi*rng.uniform(0.5, 2.0)*t + rng.uniform(0, 2*np.pi))
+            if not names[i][-1].isdigit():
+                angle[:] = 0.0
+            bone = rng.uniform(0.02, 0.04) * (np.cos(angle)*direction + np.sin(angle)*swing)
+            positions[:, i] = positions[:, skeleton.parents[i]] + bone
+    #measurement noise
+    positions += rng.normal(0, 0.0002, positions.shape)
+    return names, positions
+
+
+def _labelOccludedTake(frames, occlusion, meanGap):
+    """
+        Labels a synthetic hand take (see _syntheticHandTake) in which about the given share of the
+        frames of every marker is occluded, in gaps of meanGap frames on average.
+        Returns the marker names, true positions, MoCapLabeledDB and time for labeling.
+    """
+    names, truth = _syntheticHandTake(frames)
+    rng = np.random.RandomState(1)
+    occluded = truth.copy()
+    for i in range(len(names)):
+        gaps = int(occlusion * frames / meanGap)
+        for first, length in zip(rng.randint(1, frames - 1, gaps), rng.geometric(1.0/meanGap, gaps)):
+            occluded[first:min(first + length, frames - 1), i] = np.nan
+    writeLabeledCSV("_benchmark_gaps.csv", "Format Version,1.21,Take Name,synthetic,Capture Frame Rate,240.000000\n",
+                    names, [str(f) for f in range(frames)], ["%f" % (f/240.0) for f in range(frames)],
+                    [occluded[:, i] for i in range(len(names))])
+    start_time = time.time()
+    db = MoCapLabeledDB("_benchmark_gaps.csv", mirrorX=0, marker_names=names, check_hand_data=0)
+    label_time = time.time() - start_time
+    os.remove("_benchmark_gaps.csv")
+    return names, truth, db, label_time
+
+
+def benchmarkGapFilling(frames=6000, occlusion=0.3, meanGap=60, repeat=3):
+    """
+        Labels a synthetic hand take in which about the given share of the frames of every marker
+        is occluded, in gaps of meanGap frames on average, and compares the error and time of the
+        frame-by-frame extrapolation while labeling with each method of gapFill.fillGaps.
+    """
+    names, truth, db, label_time = _labelOccludedTake(int(frames), float(occlusion), float(meanGap))
+    labeled = db.getPositions()
+    missing = db.getMissingMask()
+    #compare all methods at the frames of the gaps they fill
+    reference = labeled.copy()
+    gaps, filledFrames = gapFill.fillGaps(reference, missing, "linear", gapFill.MAX_GAP)
+    filled = missing & (reference != labeled).any(axis=2)
+
+    def error(positions):
+        distances = 1000 * np.sqrt(((positions[filled] - truth[filled])**2).sum(axis=1))
+        return "%7.2f mm %7.2f mm" % (distances.mean(), np.percentile(distances, 95))
+
+    print "Filling gaps of", len(names), "markers x", len(truth), "frames, %.0f%% missing" % (100.0*missing.mean())
+    print "  %d gaps of at most %d frames (%d frames)" % (gaps, gapFill.MAX_GAP, filledFrames)
+    print "%-14s %10s %10s %10s" % ("", "time", "mean", "95%")
+    print "%-14s %8.3f s %s" % ("labeling", label_time, error(labeled))
+    for method in gapFill.METHODS:
+        positions = labeled.copy()
+        def fill():
+            positions[:] = labeled
+            gapFill.fillGaps(positions, missing, method, gapFill.MAX_GAP, db.compiledSkeleton)
+        fill_time = _timeit(fill, int(repeat))
+        print "%-14s %8.3f s %s" % (method, fill_time, error(positions))
+
+
+def benchmarkRigidFitting(frames=6000, occlusion=0.3, meanGap=60, repeat=3):
+    """
+        Labels a synthetic hand take with occlusions (see benchmarkGapFilling) and recovers the missing
+        markers of rigidBody.HAND_CLUSTERS, with one batched fit over all frames and frame by frame.
+        Compares the error of the recovered positions with the extrapolation while labeling.
+    """
+    names, truth, db, label_time = _labelOccludedTake(int(frames), float(occlusion), float(meanGap))
+    labeled = db.getPositions()
+    missing = db.getMissingMask()
+    clusters = [[names.index(name) for name in cluster] for cluster in rigidBody.HAND_CLUSTERS]
+    positions = labeled.copy()
+
+    def batched():
+        positions[:] = labeled
+        return rigidBody.fitRigidClusters(positions, missing, clusters)
+
+    def perFrame():
+        positions[:] = labeled
+        for cluster in clusters:
+            visible = ~missing[:, cluster]
+            reference = rigidBody.estimateReference(labeled[visible.all(axis=1)][:, cluster])
+            for frame in np.flatnonzero(~visible.all(axis=1) & (visible.sum(axis=1) >= rigidBody.MIN_VISIBLE)):
+                rotation, translation = rigidBody.kabsch(reference, labeled[frame:frame+1, cluster], visible[frame:frame+1].astype(float))
+                fitted = reference.dot(rotation[0].T) + translation[0]
+                positions[frame, np.array(cluster)[~visible[frame]]] = fitted[~visible[frame]]
+
+    loop_time = _timeit(perFrame, 1)
+    batch_time = _timeit(batched, int(repeat))
+    recovered = batched()
+
+    def error(positions):
+        distances = 1000 * np.sqrt(((positions[recovered] - truth[recovered])**2).sum(axis=1))
+        return "%7.2f mm %7.2f mm" % (distances.mean(), np.percentile(distances, 95))
+
+    print "Fitting", len(clusters), "rigid clusters of", len(clusters[0]), "markers x", len(truth), "frames"
+    print "  %d of %d missing positions recovered" % (recovered.sum(), missing[:, np.concatenate(clusters)].sum())
+    print "%-14s %10s %10s %10s" % ("", "time", "mean", "95%")
+    print "%-14s %8.3f s %s" % ("labeling", label_time, error(labeled))
+    print "%-14s %8.3f s" % ("per frame", loop_time)
+    print "%-14s %8.3f s %s (x%.0f)" % ("batched", batch_time, error(positions), loop_time/batch_time)
+
+
+def _legacyPlot(db, frame, filename):
+    """
+        The original Take.plotAt: a pyplot figure that is not closed, with a plot call per bone
+        and a scatter call per marker (see MoCapMarker.plotAtFrame)
+    """
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=(18,12))
+    ax = fig.add_subplot(111, projection='3d')
+    debugtext = "Remaps: \n"
+    for marker in db.markers:
+        debugtext = marker.plotAtFrame(ax, frame, debugtext, 1)
+    ax.text2D(-0.1, 0.8, debugtext, transform=ax.transAxes, va='top')
+    ax.text2D(-0.1, 0.95, "Frame: " + str(frame), transform=ax.transAxes)
+    ax.set_xlim3d((-0.5, 0.5))
+    ax.set_ylim3d((-0.5, 0.5))
+    ax.set_zlim3d((-0.5, 0.5))
+    ax.set_xlabel('X')
+    ax.set_ylabel('Z')
+    ax.set_zlabel('Y')
+    ax.view_init(azim=90, elev=70)
+    plt.savefig(filename, bbox_inches='tight')
+
+
+def benchmarkRendering(datafile, plots=50, processes=None):
+    """
+        Labels the given logfile and renders plots of evenly spaced frames, with the original
+        plotAt and with renderer.renderSnapshots in one and in the given number of processes.
+        Prints the time and the growth of the peak memory of this process.
+    """
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+    db = MoCapLabeledDB(datafile)
+    frames = np.linspace(0, db.frames - 1, int(plots)).astype(int).tolist()
+    filenames = ["_benchmark_plot_%d.png" % i for i in range(len(frames))]
+    processes = int(processes) if processes is not None else multiprocessing.cpu_count()
+
+    def run(function):
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        seconds = _timeit(function, 1)
+        return seconds, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory) / 1024.0
+
+    renderer_time, renderer_memory = run(lambda: renderer.renderSnapshots(db, frames, filenames, processes=1))
+    parallel_time, _ = run(lambda: renderer.renderSnapshots(db, frames, filenames, processes=processes))
+    legacy_time, legacy_memory = run(lambda: [_legacyPlot(db, frame, filename) for frame, filename in zip(frames, filenames)])
+    for filename in filenames:
+        os.remove(filename)
+
+    print "Rendering", len(frames), "plots of", len(db.markers), "markers"
+    print "  legacy plotAt:                   %.2f s, +%.0f MB" % (legacy_time, legacy_memory)
+    print "  renderSnapshots:                 %.2f s, +%.0f MB (x%.1f)" % (renderer_time, renderer_memory, legacy_time/renderer_time)
+    print "  renderSnapshots, %2d processes:   %.2f s (x%.1f)" % (processes, parallel_time, legacy_time/parallel_time)
+
+
+def benchmarkViewer(datafile, frames=100):
+    """
+        Time per frame for stepping through the given number of frames of the labeled logfile
+        without a window: a new figure per frame (as Take.plotAt) and FrameViewer.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    db = MoCapLabeledDB(datafile)
+    frames = range(min(int(frames), db.frames))
+    bones = renderer.getBones(db.compiledSkeleton)
+
+    def rebuild():
+        for frame in frames:
+            fig = Figure(figsize=renderer.FIGURE_SIZE)
+            FigureCanvasAgg(fig)
+            text = renderer.getRelabelTexts(db, [frame])[frame]
+            renderer.drawFrame(fig, renderer.getFramePositions(db, frame), bones, frame, text)
+            fig.canvas.draw()
+
+    start_time = time.time()
+    viewer = FrameViewer(db, headless=1)
+    setup_time = time.time() - start_time
+    rebuild_time = _timeit(rebuild, 1) / len(frames)
+    viewer_time = _timeit(lambda: viewer.play(frames[0], frames[-1] + 1), 1) / len(frames)
+
+    print "Showing", len(frames), "frames of", len(db.markers), "markers"
+    print "  new figure per frame:  %.1f ms/frame" % (1000*rebuild_time)
+    print "  FrameViewer:           %.1f ms/frame (x%.1f), %.2f s to set up" % (1000*viewer_time, rebuild_time/viewer_time, setup_time)
+
+
+def _bonePairs(pairs, seed=0):
+    """
+        Random bone pairs (4 x pairs x 3) in a hand sized volume, a third of them close to crossing,
+        parallel or with a bone of length 0, as the hand heuristics see them
+    """
+    rng = np.random.RandomState(seed)
+    p0, p1, q0, q1 = rng.uniform(-0.05, 0.05, size=(4, pairs, 3))
+    near = rng.rand(pairs) < 0.1
+    q0[near] = p0[near] + rng.normal(0, 0.003, size=(near.sum(), 3))
+    q1[near] = p1[near] + rng.normal(0, 0.003, size=(near.sum(), 3))
+    parallel = rng.rand(pairs) < 0.1
+    q1[parallel] = q0[parallel] + (p1 - p0)[parallel] * rng.uniform(-2, 2, size=(parallel.sum(), 1))
+    degenerate = rng.rand(pairs) < 0.1
+    p1[degenerate] = p0[degenerate]
+    return p0, p1, q0, q1
+
+
+def benchmarkHeuristics(pairs=20000):
+    """
+        Regression check of the batched bone distances and angles of the hand heuristics
+        (helper.closest3dBatch, helper.angleBetweenBatch) against closest3d and angle_between of
+        single bones: the largest difference and the number of different decisions at the
+        thresholds of MoCapLabeledDB, and the time per bone pair. Both round differently, so values
+        exactly at a threshold may be decided differently. (Nearly) parallel bones and bones of length 0
+        are counted separately, both computations fall back to 1000000 / 0 / pi there depending on rounding.
+    """
+    p0, p1, q0, q1 = _bonePairs(int(pairs))
+    u, v = p1 - p0, q1 - q0
+    uu, vv, uv = (u*u).sum(axis=1), (v*v).sum(axis=1), (u*v).sum(axis=1)
+    parallel = np.abs(uu*vv - uv*uv) <= 1e-12*uu*vv
+    distanceThresh = MoCapLabeledDB.CROSSOVER_THRESH
+    angleThresh = MoCapLabeledDB.BACKWARDS_TIP_THRESH
+
+    start_time = time.time()
+    distances = np.array([helper.closest3d(a, b, c, d) for a, b, c, d in zip(p0, p1, q0, q1)])
+    angles = np.array([helper.angle_between(a, b) for a, b in zip(p1 - p0, q1 - q0)])
+    single_time = time.time() - start_time
+    start_time = time.time()
+    batchDistances = helper.closest3dBatch(p0, p1, q0, q1)
+    batchAngles = helper.angleBetweenBatch(p1 - p0, q1 - q0)
+    batch_time = time.time() - start_time
+
+    distanceDiffs = (batchDistances <= distanceThresh) != (distances <= distanceThresh)
+    angleDiffs = (batchAngles >= angleThresh) != (angles >= angleThresh)
+    print "Checking", len(p0), "bone pairs,", parallel.sum(), "of them (nearly) parallel or of length 0"
+    print "  distances: max difference %.2e m, %d different decisions (%d at parallel bones)" % (
+        np.abs(batchDistances - distances)[~parallel].max(), distanceDiffs[~parallel].sum(), distanceDiffs[parallel].sum())
+    print "  angles:    max difference %.2e rad, %d different decisions (%d at parallel bones)" % (
+        np.abs(batchAngles - angles)[~parallel].max(), angleDiffs[~parallel].sum(), angleDiffs[parallel].sum())
+    print "  single bones: %.1f us/pair, batched: %.2f us/pair" % (1e6*single_time/len(p0), 1e6*batch_time/len(p0))
+
+
+BENCHMARKS = {
+    "parsing": benchmarkParsing,
+    "writing": benchmarkWriting,
+    "c3d": benchmarkC3D,
+    "assignment": benchmarkAssignment,
+    "neighbors": benchmarkNeighbors,
+    "heuristics": benchmarkHeuristics,
+    "gapfilling": benchmarkGapFilling,
+    "rigid": benchmarkRigidFitting,
+    "rendering": benchmarkRendering,
+    "viewer": benchmarkViewer,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or not sys.argv[1] in BENCHMARKS:
+        print "Usage: python benchmark.py <benchmark> [arguments]"
+        print "Benchmarks:", ", ".join(sorted(BENCHMARKS.keys()))
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,208 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Reads C3D files (https://www.c3d.org) into the same MoCapRawData as the csv parser.
+
+import os
+import struct
+import numpy as np
+
+from mocapReader import MoCapRawData
+
+BLOCK = 512                                     # C3D files are organised in blocks of 512 bytes
+PROCESSORS = {84: "intel", 85: "dec", 86: "mips"}
+UNITS = {"mm": 0.001, "cm": 0.01, "m": 1.0}     # conversion to meters
+
+
+class C3DParameters:
+    """
+        The parameter section of a C3D file: {group name: {parameter name: value}}
+    """
+    def __init__(self, data, processor):
+        self.processor = processor
+        self.endian = '>' if processor == "mips" else '<'
+        self.groups = {}
+        self._parse(data)
+
+    def get(self, group, name, default=None):
+        return self.groups.get(group, {}).get(name, default)
+
+    def _parse(self, data):
+        groupNames = {}
+        parameters = []
+        offset = 4          #skip the parameter section header
+        while offset + 2 <= len(data):
+            nameLength, identifier = struct.unpack('bb', data[offset:offset+2])
+            nameLength = abs(nameLength)    #negative if locked
+            if nameLength == 0 or identifier == 0:
+                break
+            name = data[offset+2:offset+2+nameLength].upper()
+            pointer = offset + 2 + nameLength
+            nextOffset, = struct.unpack(self.endian + 'h', data[pointer:pointer+2])
+            if identifier < 0:
+                groupNames[-identifier] = name
+            else:
+                parameters.append((identifier, name, pointer + 2))
+            if nextOffset == 0:
+                break
+            offset = pointer + nextOffset
+
+        for identifier, name, pointer in parameters:
+            group = groupNames.get(identifier, str(identifier))
+            self.groups.setdefault(group, {})[name] = self._parseValue(data, pointer)
+
+    def _parseValue(self, data, pointer):
+        """
+            Returns the value of the parameter stored at pointer:
+            a string (list of strings) for characters, else a number or an np.array
+        """
+        dataType, dimensions = struct.unpack('bb', data[pointer:pointer+2])
+        shape = list(struct.unpack('%dB' % dimensions, data[pointer+2:pointer+2+dimensions]))
+        pointer += 2 + dimensions
+        count = int(np.prod(shape)) if dimensions > 0 else 1
+        size = abs(dataType)
+        raw = data[pointer:pointer + count*size]
+        if count == 0:
+            return "" if dataType == -1 else np.array([])
+        if dataType == -1:
+            if dimensions <= 1:
+                return raw.strip()
+            #column major: the first dimension is the string length
+            length = shape[0]
+            return [raw[i:i+length].strip() for i in range(0, len(raw), length)]
+        elif dataType == 1:
+            values = np.frombuffer(raw, dtype=np.uint8)
+        elif dataType == 2:
+            values = np.frombuffer(raw, dtype=self.endian + 'i2')
+        else:
+            values = _toFloat(raw, self.processor)
+        if dimensions == 0 or count == 1:
+            return values[0]
+        return values.reshape(shape[::-1])
+
+
+def _toFloat(raw, processor):
+    """
+        Converts the bytes of 32bit floats of the given processor type to an np.array
+    """
+    if processor == "mips":
+        return np.frombuffer(raw, dtype='>f4')
+    if processor == "dec":
+        #DEC floats: swap the two 16bit words and correct the exponent bias
+        words = np.frombuffer(raw, dtype=np.uint8).reshape((-1, 4))[:, [2, 3, 0, 1]]
+        return np.ascontiguousarray(words).view('<f4').ravel() / 4.0
+    return np.frombuffer(raw, dtype='<f4')
+
+
+def readC3D(datafile, mirrorX=1, ignoredMarkers=[]):
+    """
+        Reads the 3D point data of the given C3D file into a MoCapRawData object.
+        The point block is read in one go. Points with a negative residual are missing (NaN).
+        Positions are converted to meters, x is mirrored if requested.
+        Columns of ignored markers are dropped.
+    """
+    f = open(datafile, 'rb')
+    header = f.read(BLOCK)
+    parameterBlock = ord(header[0])
+    f.seek((parameterBlock - 1)*BLOCK)
+    parameterHeader = f.read(4)
+    processor = PROCESSORS.get(ord(parameterHeader[3]), "intel")
+    f.seek((parameterBlock - 1)*BLOCK)
+    parameters = C3DParameters(f.read(ord(parameterHeader[2])*BLOCK), processor)
+    endian = parameters.endian
+
+    #header: point count, analog values per frame, first and last frame, scale, data start, rate
+    words = struct.unpack(endian + '5H', header[2:12])
+    points, analogValues, firstFrame, lastFrame = words[0], words[1], words[2], words[3]
+    scale = float(_toFloat(header[12:16], processor)[0])
+    dataStart, = struct.unpack(endian + 'H', header[16:18])
+    frameRate = float(_toFloat(header[20:24], processor)[0])
+
+    points = int(parameters.get("POINT", "USED", points))
+    scale = float(parameters.get("POINT", "SCALE", scale))
+    frameRate = float(parameters.get("POINT", "RATE", frameRate))
+    dataStart = int(parameters.get("POINT", "DATA_START", dataStart)) & 0xffff
+    frames = lastFrame - firstFrame + 1
+    actualEnd = parameters.get("TRIAL", "ACTUAL_END_FIELD")
+    actualStart = parameters.get("TRIAL", "ACTUAL_START_FIELD")
+    if actualEnd is not None and actualStart is not None:
+        #frame numbers beyond 65535 are stored in two 16bit words
+        actualEnd = np.asarray(actualEnd).astype(np.uint16).ravel()
+        actualStart = np.asarray(actualStart).astype(np.uint16).ravel()
+        firstFrame = int(actualStart[0]) + 65536*int(actualStart[-1]) if len(actualStart) > 1 else int(actualStart[0])
+        frames = (int(actualEnd[0]) + 65536*int(actualEnd[-1]) if len(actualEnd) > 1 else int(actualEnd[0])) - firstFrame + 1
+
+    labels = []
+    for name in ["LABELS", "LABELS2", "LABELS3", "LABELS4"]:
+        value = parameters.get("POINT", name, [])
+        labels.extend([value] if isinstance(value, str) else value)
+    labels = labels[0:points]
+    labels.extend(["Marker_%d" % i for i in range(len(labels), points)])
+    unit = parameters.get("POINT", "UNITS", "mm")
+    unitScale = UNITS.get(unit.strip().lower() if isinstance(unit, str) else "mm", 0.001)
+
+    #point block: per frame 4 values (x, y, z, residual) per point followed by the analog samples
+    isFloat = scale < 0
+    valueSize = 4 if isFloat else 2
+    frameValues = 4*points + analogValues
+    f.seek((dataStart - 1)*BLOCK)
+    raw = f.read(frames*frameValues*valueSize)
+    f.close()
+    frames = min(frames, len(raw) // (frameValues*valueSize))
+    raw = raw[0:frames*frameValues*valueSize]
+
+    if isFloat:
+        values = _toFloat(raw, processor).reshape((frames, frameValues))
+        pointValues = values[:, 0:4*points].reshape((frames, points, 4))
+        #sign of the float itself, converting to int first would truncate e.g. -0.5 to 0 (valid)
+        missing = pointValues[:, :, 3] < 0
+        positions = pointValues[:, :, 0:3].astype(np.float64)
+    else:
+        values = np.frombuffer(raw, dtype=endian + 'i2').reshape((frames, frameValues))
+        pointValues = values[:, 0:4*points].reshape((frames, points, 4))
+        missing = pointValues[:, :, 3] < 0
+        positions = pointValues[:, :, 0:3] * abs(scale)
+    positions *= unitScale
+    positions[missing] = np.nan
+
+    keep = [i for i in range(points) if not labels[i] in ignoredMarkers]
+    if len(keep) < points:
+        positions = positions[:, keep]
+    if mirrorX:
+        positions[:, :, 0] *= -1
+
+    frameNumbers = np.arange(firstFrame, firstFrame + frames)
+    rawData = MoCapRawData([labels[i] for i in keep],
+                           positions,
+                           frameNumbers,
+                           np.arange(frames) / frameRate,
+                           labels,
+                           headerLine="Format Version,C3D,Take Name,%s,Capture Frame Rate,%f\n" %
+                                      (os.path.basename(datafile).rsplit(".", 1)[0], frameRate),
+                           frameRate=frameRate)
+    return rawData
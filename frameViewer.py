@@ -0,0 +1,164 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Steps through the frames of a labeled take in a single plot, e.g. in a notebook around a suspected swap:
+#     viewer = FrameViewer(labeledDB)       # or take.getViewer()
+#     viewer.show(2219)                     # jump to a frame
+#     viewer.step(); viewer.step(-10)       # step forward or back
+#     viewer.play(2200, 2300)               # play a range of frames
+# The axes, the line collection of the bones, the scatter of the markers and the texts are created once,
+# showing a frame only updates their data from the position array of the take and draws them onto the
+# saved background of the axes (blitting). The relabel texts of all frames are collected from the relabel
+# history beforehand. With headless=1 the plot is drawn on an Agg
+# canvas without a window, e.g. for measuring the update time (see benchmark.py viewer).
+
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+
+import renderer
+
+
+class FrameViewer:
+    """
+        A plot of a labeled take (MoCapLabeledDB with all frames) that is built once and updated for every frame
+    """
+    PLAY_FPS = 30       # frames shown per second while playing
+
+    def __init__(self, db, limits=renderer.LIMITS, debug=1, headless=0):
+        self.positions = db.getPositions()                                      # (frames x markers x 3)
+        self.frames = len(self.positions)
+        self.bones = renderer.getBones(db.compiledSkeleton)
+        self.texts = renderer.getRelabelTexts(db) if debug else None            # {frame: text} of the frames with relabel events
+        self.headless = headless
+        self.frame = 0
+        self.latency = 0.0                                                      # seconds for updating and drawing the last frame
+
+        if headless:
+            self.figure = Figure(figsize=renderer.FIGURE_SIZE)
+            FigureCanvasAgg(self.figure)
+        else:
+            self.figure = plt.figure(figsize=renderer.FIGURE_SIZE)
+        self.ax = renderer.createAxes(self.figure, limits)
+        self.lines = Line3DCollection([], colors=renderer.BONE_COLOR, linewidths=renderer.BONE_WIDTH)
+        self.ax.add_collection3d(self.lines)
+        self.points = self.ax.scatter([], [], [], edgecolor=renderer.MARKER_EDGE_COLOR, c=renderer.MARKER_COLOR,
+                                      marker='o', depthshade=False)
+        self.relabelText = self.ax.text2D(-0.1, 0.8, "", transform=self.ax.transAxes, va='top')
+        self.frameText = self.ax.text2D(-0.1, 0.95, "", transform=self.ax.transAxes)
+        #drawn on top of the background, which is saved after every full draw (e.g. after resizing the window)
+        self.artists = [self.lines, self.points, self.relabelText, self.frameText]
+        for artist in self.artists:
+            artist.set_animated(True)
+        self.background = None
+        self.figure.canvas.mpl_connect('draw_event', self._onDraw)
+        self.show(0)
+
+    def _onDraw(self, event):
+        if not self.lines.get_animated():
+            #saving, the artists are drawn with the rest
+            return
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        self._drawArtists()
+
+    def _drawArtists(self):
+        canvasRenderer = self.figure.canvas.get_renderer()
+        #the projection of the last full draw. NOTE: relies on a private detail of mplot3d in matplotlib 2.x:
+        #Axes3D.draw stores the projection matrix as ax.M and hands it to the 3d collections as renderer.M,
+        #which do_3d_projection reads (check this when upgrading matplotlib)
+        canvasRenderer.M = self.ax.M
+        for collection in (self.lines, self.points):
+            collection.do_3d_projection(canvasRenderer)
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+
+    def update(self, frame):
+        """
+            Sets the data of the artists to the given frame, without drawing
+        """
+        points = renderer.getPlotPoints(self.positions[frame])
+        visible = ~np.isnan(points[:, 0])
+        bones = self.bones[visible[self.bones].all(axis=1)]
+        self.lines.set_segments(points[bones])
+        self.points.set_offsets(points[visible, 0:2])
+        self.points.set_3d_properties(points[visible, 2], 'z')
+        if self.texts is not None:
+            self.relabelText.set_text(self.texts.get(frame, "Remaps: \n"))
+        self.frameText.set_text("Frame: " + str(frame))
+
+    def show(self, frame):
+        """
+            Shows the given frame (limited to the frames of the take)
+        """
+        start_time = time.time()
+        self.frame = min(max(int(frame), 0), self.frames - 1)
+        self.update(self.frame)
+        if self.background is None:
+            self.figure.canvas.draw()
+        else:
+            self.figure.canvas.restore_region(self.background)
+            self._drawArtists()
+        if not self.headless:
+            self.figure.canvas.blit(self.figure.bbox)
+            self.figure.canvas.flush_events()
+        self.latency = time.time() - start_time
+        return self
+
+    def step(self, count=1):
+        """
+            Shows the frame count frames after (or before, if negative) the current one
+        """
+        return self.show(self.frame + count)
+
+    def play(self, begin, end, step=1, fps=PLAY_FPS):
+        """
+            Shows the frames begin <= frame < end one after the other, at most fps frames per second
+            (as fast as possible if headless). Returns the mean seconds per frame.
+        """
+        frames = range(begin, end, step)
+        start_time = time.time()
+        for frame in frames:
+            self.show(frame)
+            if not self.headless:
+                plt.pause(max(1.0/fps - self.latency, 0.001))
+        return (time.time() - start_time) / max(len(frames), 1)
+
+    def save(self, filename):
+        """
+            Saves the current frame as image
+        """
+        for artist in self.artists:
+            artist.set_animated(False)
+        self.figure.savefig(filename, bbox_inches='tight')
+        for artist in self.artists:
+            artist.set_animated(True)
+        #the background of the saved figure
+        self.figure.canvas.draw()
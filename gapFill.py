@@ -0,0 +1,154 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Gap filling after labeling. While a marker is missing, the labeler extrapolates it frame by frame
+# from the previous frame, so the error grows over long gaps. Knowing the whole take, the gaps can be
+# filled from the frames before and after them instead, for all gaps of all markers at once:
+#     gaps, frames = fillGaps(positions, missing, method="cubic", maxGap=240)
+# with the (frames x markers x 3) labeled positions (filled in place) and the (frames x markers)
+# missing flags. The filled frames stay marked as missing.
+# Methods:
+#     "linear"    straight line between the last position before and the first after the gap
+#     "cubic"     cubic Hermite spline that also continues the velocity at both ends
+#     "skeleton"  moves with the parent marker (or the child, if there is no parent) and interpolates
+#                 the vector to it linearly, parents are filled before their children. Needs the
+#                 skeleton.CompiledSkeleton of the markers, markers without parent and child are filled linearly.
+
+import numpy as np
+
+
+METHODS = ("linear", "cubic", "skeleton")
+MAX_GAP = 240       # frames, longer gaps keep their extrapolated positions (None: no limit)
+VELOCITY_FRAMES = 10    # the velocity at the ends of a gap is taken over that many frames (less sensitive to noise)
+
+
+def findGaps(missing):
+    """
+        Returns the markers, first frames and end frames (exclusive) of all runs of missing frames
+        in the (frames x markers) bool array, as arrays ordered by marker and frame
+    """
+    padded = np.zeros((missing.shape[1], missing.shape[0] + 2), dtype=np.int8)
+    padded[:, 1:-1] = missing.T
+    changes = np.diff(padded, axis=1)
+    markers, firsts = np.nonzero(changes == 1)
+    ends = np.nonzero(changes == -1)[1]
+    return markers, firsts, ends
+
+
+def _gapFrames(firsts, ends):
+    """
+        Returns for every frame of the given gaps the index of its gap and the frame
+    """
+    lengths = ends - firsts
+    gaps = np.repeat(np.arange(len(firsts)), lengths)
+    frames = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(firsts, lengths)
+    return gaps, frames
+
+
+def _linear(positions, markers, firsts, ends, gaps, frames):
+    """
+        Positions at the given frames of the gaps on the line between the frames before and after them
+    """
+    t = ((frames - firsts[gaps] + 1) / (ends - firsts + 1.0)[gaps])[:, np.newaxis]
+    before = positions[firsts - 1, markers][gaps]
+    after = positions[ends, markers][gaps]
+    return before + (after - before) * t
+
+
+def _cubic(positions, missing, markers, firsts, ends, gaps, frames):
+    """
+        Positions at the given frames of the gaps on a cubic Hermite spline between the frames before and
+        after them, with the velocities at both ends (the secant where the frame VELOCITY_FRAMES before or after is missing)
+    """
+    span = (ends - firsts + 1.0)[:, np.newaxis]
+    before = positions[firsts - 1, markers]
+    after = positions[ends, markers]
+    secant = (after - before) / span
+    previous = np.maximum(firsts - 1 - VELOCITY_FRAMES, 0)
+    velocityBefore = np.where(((firsts - 1 - VELOCITY_FRAMES >= 0) & ~missing[previous, markers])[:, np.newaxis],
+                              (before - positions[previous, markers]) / VELOCITY_FRAMES, secant)
+    following = np.minimum(ends + VELOCITY_FRAMES, len(positions) - 1)
+    velocityAfter = np.where(((ends + VELOCITY_FRAMES < len(positions)) & ~missing[following, markers])[:, np.newaxis],
+                             (positions[following, markers] - after) / VELOCITY_FRAMES, secant)
+    velocityBefore = np.where(np.isnan(velocityBefore), secant, velocityBefore)
+    velocityAfter = np.where(np.isnan(velocityAfter), secant, velocityAfter)
+
+    t = ((frames - firsts[gaps] + 1) / span[gaps, 0])[:, np.newaxis]
+    t2 = t * t
+    t3 = t2 * t
+    return (2*t3 - 3*t2 + 1) * before[gaps] + (t3 - 2*t2 + t) * (span * velocityBefore)[gaps] + \
+           (3*t2 - 2*t3) * after[gaps] + (t3 - t2) * (span * velocityAfter)[gaps]
+
+
+def _skeletonRelative(positions, markers, firsts, ends, gaps, frames, references):
+    """
+        Positions at the given frames of the gaps relative to the reference markers, with the vector from
+        the reference interpolated linearly between the frames before and after the gaps. NaN where the
+        reference has no data.
+    """
+    t = ((frames - firsts[gaps] + 1) / (ends - firsts + 1.0)[gaps])[:, np.newaxis]
+    before = (positions[firsts - 1, markers] - positions[firsts - 1, references])[gaps]
+    after = (positions[ends, markers] - positions[ends, references])[gaps]
+    return positions[frames, references[gaps]] + before + (after - before) * t
+
+
+def fillGaps(positions, missing, method="linear", maxGap=MAX_GAP, skeleton=None):
+    """
+        Fills the gaps of at most maxGap frames in the (frames x markers x 3) positions in place, see above.
+        Gaps at the start or end of the take are not filled.
+        Returns the number of filled gaps and frames.
+    """
+    if not method in METHODS:
+        raise ValueError("Unknown gap filling method: " + str(method))
+    if method == "skeleton" and skeleton is None:
+        raise ValueError("Gap filling relative to the skeleton needs the skeleton of the markers")
+    markers, firsts, ends = findGaps(missing)
+    #only gaps in between two frames with data
+    fillable = (firsts > 0) & (ends < len(positions))
+    if maxGap is not None:
+        fillable &= ends - firsts <= maxGap
+    markers, firsts, ends = markers[fillable], firsts[fillable], ends[fillable]
+    fillable = ~np.isnan(positions[firsts - 1, markers, 0]) & ~np.isnan(positions[ends, markers, 0])
+    markers, firsts, ends = markers[fillable], firsts[fillable], ends[fillable]
+
+    if method == "linear":
+        gaps, frames = _gapFrames(firsts, ends)
+        positions[frames, markers[gaps]] = _linear(positions, markers, firsts, ends, gaps, frames)
+    elif method == "cubic":
+        gaps, frames = _gapFrames(firsts, ends)
+        positions[frames, markers[gaps]] = _cubic(positions, missing, markers, firsts, ends, gaps, frames)
+    else:
+        #level by level, so that the parents are filled first
+        references = np.where(skeleton.parents[markers] >= 0, skeleton.parents[markers], skeleton.children[markers])
+        for rows in skeleton.levels(markers):
+            gaps, frames = _gapFrames(firsts[rows], ends[rows])
+            linear = _linear(positions, markers[rows], firsts[rows], ends[rows], gaps, frames)
+            relative = _skeletonRelative(positions, markers[rows], firsts[rows], ends[rows], gaps, frames, references[rows])
+            useLinear = (references[rows] < 0)[gaps] | np.isnan(relative[:, 0])
+            positions[frames, markers[rows][gaps]] = np.where(useLinear[:, np.newaxis], linear, relative)
+    return len(markers), int((ends - firsts).sum())
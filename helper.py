@@ -29,7 +29,12 @@
 
 import numpy as np
 import scipy.spatial
+import scipy.optimize
 import datetime
+from neighborSearch import createNeighborSearch
+
+# backend for the nearest neighbor search: "auto", "brute", "kdtree" or "grid" (see neighborSearch.py)
+NEIGHBOR_SEARCH = "auto"
 
 def closest3d(p0, p1, q0, q1, infinite=0):
     """
@@ -60,6 +65,43 @@ def closest3d(p0, p1, q0, q1, infinite=0):
         
     return 1000000
 
+def _rowDots(a, b):
+    """
+        Dot product of every row of the (n x 3) arrays a and b. May round differently than np.dot on
+        single vectors, so a value exactly at a threshold may be decided differently than with closest3d
+        or angle_between (see benchmark.py heuristics).
+    """
+    return np.einsum('ij,ij->i', a, b)
+
+def closest3dBatch(p0, p1, q0, q1):
+    """
+        closest3d (infinite=0) for (n x 3) arrays of segments p0-p1 and q0-q1 at once, up to rounding.
+        Segments with a missing point (NaN): 1000000 if all four points are missing
+        (as closest3d with four []), else NaN (closest3d raises an error then).
+    """
+    u = p1-p0
+    v = q1-q0
+    w0 = p0-q0
+    a = _rowDots(u,u)
+    b = _rowDots(u,v)
+    c = _rowDots(v,v)
+    d = _rowDots(u, w0)
+    e = _rowDots(v,w0)
+
+    denom = a*c - (b*b)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = (b*e-c*d)/denom
+        t = (a*e-b*d)/denom
+        closest = w0 + s[:,np.newaxis]*u - t[:,np.newaxis]*v
+        dist = np.sqrt(_rowDots(closest, closest))
+        inside = (denom != 0) & (s >= 0) & (s <= 1) & (t >= 0) & (t <= 1)
+    dist = np.where(inside, dist, 1000000.0)
+
+    missing = np.isnan(p0[:,0]).astype(int) + np.isnan(p1[:,0]) + np.isnan(q0[:,0]) + np.isnan(q1[:,0])
+    dist[missing == 4] = 1000000.0
+    dist[(missing > 0) & (missing < 4)] = np.nan
+    return dist
+
 def lineIntersectOnce(a1,a2,b1,b2):    
     """
         Check is two line segments intersect at one (!) point. 
@@ -167,6 +209,21 @@ def angle_between(v1, v2):
             return np.pi
     return angle
 
+def angleBetweenBatch(v1, v2):
+    """
+        angle_between for (n x 3) arrays of vectors at once, up to rounding
+    """
+    def unitVectors(vectors):
+        norms = np.sqrt(_rowDots(vectors, vectors))
+        return np.where((norms == 0)[:,np.newaxis], vectors, vectors / np.where(norms == 0, 1, norms)[:,np.newaxis])
+    v1_u = unitVectors(v1)
+    v2_u = unitVectors(v2)
+    with np.errstate(invalid="ignore"):
+        angle = np.arccos(_rowDots(v1_u, v2_u))
+    undefined = np.isnan(angle)
+    angle[undefined] = np.where((v1_u == v2_u).all(axis=1), 0.0, np.pi)[undefined]
+    return angle
+
 def projectToPlane(v1,v2, M):
     """
         Given vectors v1 and v2 defining a plane and project the given points onto that plane.
@@ -236,21 +293,8 @@ def smooth(data, window_len=5):
 
 
 def _do_kdtree(neighbors,points, k_neighbors):
-    mytree = scipy.spatial.cKDTree(neighbors)    
-    dist = []
-    indexes = []
-    try:
-        dist, indexes = mytree.query(points, k=k_neighbors)
-    except Exception:
-        for i in range(0,len(points)):
-            print i
-            p = points[i]
-            d, ix = mytree.query(p, k=k_neighbors)
-            dist.append(d)
-            indexes.append(ix)
-        
-     
-    return dist, indexes
+    search = createNeighborSearch(neighbors, len(points), NEIGHBOR_SEARCH)
+    return search.query(points, k=k_neighbors)
 
 def _computeNearestNeighbor(neighbors, points, k_neighbors):
     """
@@ -287,14 +331,18 @@ def nearestNeighbor(lastLabeledData, db_unlabeledData, db, frame):
     k_neighbors = 1 #k = 2 does not work (yet!?)
     
     neighbors = np.array(db_unlabeledData.values())
-    points = np.array(lastLabeledData.values())    
+    #markers without previous position (NaN) get no neighbor
+    points = np.array([p if len(p) > 0 else [np.nan]*3 for p in lastLabeledData.values()])
     dist, indexes = _computeNearestNeighbor(neighbors, points, k_neighbors)    
     takenindexes = [] #keep track of taken elements in case several markers have the same distance
     mapDict = {}
     for i in range(0,len(lastLabeledData.keys())):
         name =  lastLabeledData.keys()[i]   
         index = indexes[i]
-        if index not in takenindexes:
+        if index == len(neighbors):
+            #no neighbor found
+            mapDict[name] = []
+        elif index not in takenindexes:
             double = np.where(indexes==index)[0]
             if(len(double)>1):
                 #there are more markers that should be mapped to that index
@@ -317,6 +365,74 @@ def nearestNeighbor(lastLabeledData, db_unlabeledData, db, frame):
             mapDict[name] = []     
     return mapDict
 
+ASSIGNMENT_METHODS = ["optimal", "greedy"]
+
+def assignMarkers(previous, candidates, gates, method="optimal"):
+    """
+        Assigns the previous positions of the markers to the candidate points of this frame
+        in one step, each candidate to at most one marker.
+        Input:
+            previous: (markers x 3) np.array, NaN if a marker has no previous position
+            candidates: (points x 3) np.array
+            gates: (markers) np.array, a marker is only assigned to points closer than its gate
+            method: "optimal": as many markers as possible are assigned, with minimal sum of distances
+                    "greedy": the closest pair is assigned first, then the next closest, ...
+        Output:
+            (markers) int np.array with the index of the assigned point, -1 if none,
+            (markers) np.array with the distance to the assigned point, NaN if none
+    """
+    previous = np.asarray(previous, dtype=np.float64).reshape(-1, 3)
+    candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 3)
+    assignment = np.full(len(previous), -1, dtype=np.intp)
+    distances = np.full(len(previous), np.nan)
+    if len(previous) == 0 or len(candidates) == 0:
+        return assignment, distances
+
+    diff = previous[:, np.newaxis, :] - candidates[np.newaxis, :, :]
+    dist = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+    with np.errstate(invalid='ignore'):
+        valid = dist < np.asarray(gates, dtype=np.float64)[:, np.newaxis]
+    if not valid.any():
+        return assignment, distances
+
+    if method == "optimal":
+        #a marker whose points are in no other gate gets the closest of them directly,
+        #only the remaining conflicts are solved as assignment problem
+        shared = valid & (valid.sum(axis=0) > 1)[np.newaxis, :]
+        hasValid = valid.any(axis=1)
+        independent = hasValid & ~shared.any(axis=1)
+        rows = np.flatnonzero(independent)
+        cols = np.argmin(np.where(valid[rows], dist[rows], np.inf), axis=1)
+        conflictRows = np.flatnonzero(hasValid & ~independent)
+        if len(conflictRows) > 0:
+            conflictCols = np.flatnonzero(valid[conflictRows].any(axis=0))
+            subValid = valid[np.ix_(conflictRows, conflictCols)]
+            #pairs outside the gate get a cost higher than any sum of valid distances,
+            #so the number of valid pairs is maximized first
+            cost = np.where(subValid, dist[np.ix_(conflictRows, conflictCols)], 0.0)
+            cost[~subValid] = cost.sum() + 1.0
+            subRows, subCols = scipy.optimize.linear_sum_assignment(cost)
+            keep = subValid[subRows, subCols]
+            rows = np.concatenate([rows, conflictRows[subRows[keep]]])
+            cols = np.concatenate([cols, conflictCols[subCols[keep]]])
+    elif method == "greedy":
+        candidateRows, candidateCols = np.nonzero(valid)
+        order = np.argsort(dist[candidateRows, candidateCols], kind="mergesort")
+        rowTaken = np.zeros(len(previous), dtype=bool)
+        colTaken = np.zeros(len(candidates), dtype=bool)
+        rows = []
+        cols = []
+        for r, c in zip(candidateRows[order].tolist(), candidateCols[order].tolist()):
+            if not rowTaken[r] and not colTaken[c]:
+                rowTaken[r] = colTaken[c] = True
+                rows.append(r)
+                cols.append(c)
+    else:
+        raise ValueError("Unknown assignment method: " + str(method))
+    assignment[rows] = cols
+    distances[rows] = dist[rows, cols]
+    return assignment, distances
+
 def _hasSmallestAngleChange(double, i, db, marker_name, db_unlabeledData, lastLabeledData, index, dist, frame):    
     
     marker = db.getMarkerByName(marker_name)
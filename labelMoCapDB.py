@@ -28,9 +28,21 @@
 from mocapMarker import *
 from  helper import *
 from skeleton import *
-from Take import *
+from mocapReader import readMoCapCSV, MoCapStreamReader
+from c3dReader import readC3D
+from mocapCache import RawDataCache
+from tracklets import findTracklets
+from anchorFrames import findAnchorFrames
+from mocapWriter import writeLabeledCSV, writeLabeledBinary, writeGapTable, writeRelabelEvents, LabeledCSVWriter
+from pipeline import Stage, printUtilization
+import gapFill
+import rigidBody
 
 import re
+import time
+import Queue
+import bisect
+import multiprocessing
 import numpy as np
 
 
@@ -46,9 +58,33 @@ class MoCapLabeledDB:
     MARKER_DIST_THRESH = 0.015 #threshold distance how far the marker is allowed to move from one frame to another
     MARKER_DIST_MISSING_THRESH = 0.03 #threshold distance how far the marker is allowed to move when it disappeared
     
+    # Streaming (see stream_to)
+    STREAM_WINDOW = 1000 #number of labeled frames kept in memory when streaming, the heuristics look back at most that far
+    STREAM_BLOCK_SIZE = 1000 #number of frames of the logfile read at once when streaming
+
+    # Pipeline (see pipelined)
+    PIPELINE_QUEUE_SIZE = 4 #number of blocks that may wait between two stages of the pipeline
+
     # For skeleton heuristics  
     CROSSOVER_THRESH = 0.005 #threshold distance for detecting if two bones are crossed (should be "close enough" because the lines never really cross in 3D space)
     BACKWARDS_TIP_THRESH = 2.0 #threshold for detecting backwards tip. min angle in rad 
+    FINGER_PAIRS = [('R_T','L_T'), ('R_L','R_R'), ('L_R','L_L') , ('R_R','R_M'), ('L_M','L_R'), ('R_M','R_I'), ('L_I','L_M')] #neighboring fingers checked for crossed bones
+    FINGER_TIPS = ['R_T', 'R_I', 'R_M', 'R_R', 'R_L', 'L_T', 'L_I', 'L_M', 'L_R', 'L_I'] #fingers checked for backwards tips
+    # bone pairs of the crossover check as marker positions (0-3: R_1-R_4, 4-7: L_1-L_4) of a finger pair, see check_fingerCrossover
+    CROSSOVER_SEGMENTS = [(2,3,6,7),    # R3-R4 / L3-L4
+                          (1,2,5,6),    # R2-R3 / L2-L3
+                          (1,6,5,2),    # R2-L3 / L2-R3
+                          (6,3,2,7),    # L3-R4 / R3-L4
+                          (2,7,6,3),    # R3-L4 / L3-R4
+                          (0,1,4,5),    # R1-R2 / L1-L2
+                          (6,7,1,2),    # L3-L4 / R2-R3
+                          (6,2,1,7),    # L3-R3 / R2-L4
+                          (5,6,2,3),    # L2-L3 / R3-R4
+                          (5,3,2,6)]    # L2-R4 / R3-L3
+    PREFILTER_SEGMENTS = [0, 1, 5, 6, 8] #the CROSSOVER_SEGMENTS the crossover check tests first, it swaps nothing if none of them is crossed
+    PREFILTER_DISTANCE_MARGIN = 0.0001 #meters, added to CROSSOVER_THRESH in the prefilter against rounding errors
+    PREFILTER_ANGLE_MARGIN = 0.01 #added to the cosine of BACKWARDS_TIP_THRESH in the prefilter against rounding errors
+    PREFILTER_BLOCK = 10000 #number of frames of a tracklet block prefiltered at once
     
                            
 
@@ -60,39 +96,61 @@ class MoCapLabeledDB:
                  labeled_marker_names=[],
                  check_hand_data = 1,
                  ignored_markers = [],
-                 use_skeleton=1):
+                 use_skeleton=1,
+                 skeleton_file=None,
+                 cache_dir=None,
+                 dtype=np.float64,
+                 assignment_method="optimal",
+                 use_tracklets=0,
+                 processes=1,
+                 stream_to=None,
+                 on_flush=None,
+                 pipelined=0):
         
         self.datafile = datafile
         self.frame_marker_names = frame_marker_names                            #{int:{string:string}} for a certain frame fix to-be-labeled names on marker names
         self.fallback_frames = fallback_frames  
         self.ignoredMarkerNames = ignored_markers
         self.mirrorX = mirrorX        
-        self.fixedLabeledMarkers = labeled_marker_names
-        self.lastbbox = []                                                      # Akku variable to store last proper bounding box in case there is a frame without any data
-        self.check_hand_data = check_hand_data   
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()  # segments between fallback frames are labeled in parallel if > 1
+        if stream_to is not None and processes is None:
+            self.processes = 1                                                  # streaming labels one block after another
       
-        #get the mocap lines
-        f = open(datafile, 'r')
-        data_in = f.read().splitlines()        
-        f.close()
-        
-        # Get the names of the markers from the fourth line of text.        
-        text = data_in.pop(3)
-        items = text.split(',')[2:]    #the first two columns are Frame and Time
-        self.allOriginalNames = []
-        for n in range(0, len(items), 3):
-            self.allOriginalNames.append(items[n]) 
-        
-        self.markers = []           # Instances of mocapMarker
+        self.stream_to = stream_to                                              # if set, the labeled data is written to this file while the take is read
+        self.on_flush = on_flush                                                # called as on_flush(db, begin, end) before streamed frames are dropped
+        self.pipelined = pipelined                                              # if set, streaming reads and writes in their own threads
+        self.stageTimes = []                                                    # (stage, busy seconds) of the last pipelined run, and "wall"
+
+        #parse the mocap file (csv or c3d), or load it from the cache of parsed takes
+        reader = readC3D if datafile.lower().endswith(".c3d") else readMoCapCSV
+        if stream_to is not None:
+            if reader != readMoCapCSV or use_tracklets or self.processes > 1 or fallback_frames == "auto":
+                raise ValueError("Streaming works only for csv files, without tracklets, parallel labeling and automatic fallback frames")
+            #only one block of the logfile is in memory at a time
+            self.reader = MoCapStreamReader(datafile, mirrorX, ignored_markers, self.STREAM_BLOCK_SIZE)
+            self.rawData = self.reader.readBlock()
+        elif cache_dir is not None:
+            self.rawData = RawDataCache(cache_dir).read(datafile, mirrorX, ignored_markers, reader)
+        else:
+            self.rawData = reader(datafile, mirrorX, ignored_markers)
+        self.allOriginalNames = self.rawData.allNames
+
         self.bbox_width = 0         # x axis
         self.bbox_height = 0        # y axis
         self.bbox_length = 0        # z axis
-                
-        del data_in[0:6]
-        self.frames = len(data_in) #TODO: check that deleting the first 6 lines is actually correct after popping 3 already
-        self.firstFrame = int(data_in[0].split(',')[0])  
-        self.lastFrame =  self.firstFrame + len(data_in)      
-                
+
+        self.frames = self.rawData.frames if stream_to is None else self.reader.frames
+        storedFrames = self.frames if stream_to is None else min(self.frames, self.STREAM_WINDOW + self.reader.blockSize + 1)
+        self.firstFrame = int(self.rawData.frameNumbers[0])
+        self.lastFrame =  self.firstFrame + self.frames
+
+        # Split the logfile columns into tracklets, in between their starts and ends markers follow their column
+        self.tracklets = None
+        if use_tracklets:
+            self.tracklets = findTracklets(self.rawData.positions, self.MARKER_DIST_THRESH)
+            print "Found", len(self.tracklets), "tracklets,", len(self.tracklets.eventFrames), "frames with tracklet starts or ends"
+        self.columnIndex = dict((name, i) for i, name in enumerate(self.rawData.names))
+
         # Get the labeled names and create marker objects
         names = self.allOriginalNames
         self.allNames= [l for l in names  if not l in self.ignoredMarkerNames]       # String[]: all valid marker names, labeled or automatically created
@@ -103,78 +161,333 @@ class MoCapLabeledDB:
         else:
             labeledNames = marker_names    
             
-        # Initialize markers
-        for name in labeledNames:
-            self.markers.append(MoCapMarker(name, self.firstFrame, self.lastFrame, name))        
-        self.names = [l.name for l in self.markers]                             # String[]: initially labeled names. Those we try to fill.    
+        # Initialize markers with data from first frame, the skeleton and the bounding boxes
+        self._initLabelingState(labeledNames, self.allOriginalNames, self.firstFrame, storedFrames, self.get_rawdata(0),
+                                labeled_marker_names, check_hand_data, assignment_method, use_skeleton, skeleton_file, dtype)
+
+        # Find fallback frames in which the logfile is labeled correctly
+        if fallback_frames == "auto":
+            self.fallback_frames = findAnchorFrames(self.rawData, self.names, self.skeleton)
+            print "Found", len(self.fallback_frames), "anchor frames:", sorted(self.fallback_frames)
+        self.specialFrames = sorted(set(self.fallback_frames) | set(frame_marker_names))  # frames that are always labeled one by one
         
-        #Init with data from first frame.
-        firstFrameData = self.get_rawdata(data_in, 0, mirrorX)
+        self.getdata()
+
+    def _initLabelingState(self, names, tableNames, firstFrame, capacity, firstFrameData,
+                           labeled_marker_names, check_hand_data, assignment_method, use_skeleton, skeleton_file, dtype):
+        """
+            Sets up the labeling state shared with OnlineLabeler: the markers (names) with room for capacity frames
+            from firstFrame on, filled with firstFrameData ({name: [x, y, z]}), the skeleton and the bounding boxes.
+            tableNames are the logfile marker names the markers can be labeled with.
+        """
+        self.fixedLabeledMarkers = labeled_marker_names
+        self.lastbbox = []                                                      # Akku variable to store last proper bounding box in case there is a frame without any data
+        self.check_hand_data = check_hand_data   
+        self.assignment_method = assignment_method                              # "optimal", "greedy" (see helper.assignMarkers) or "nearest" (helper.nearestNeighbor)
+        self.skippedHandChecks = 0                                              # number of frames the hand heuristics were skipped at (see flagHandCheckFrames)
+        self._followedColumns = None                                            # (frame, columns) of the last getFollowedColumns
+        self._handTopology = None                                               # see getHandTopology
+
+        self._bboxes = np.empty((capacity, 6))                                 # bounding box of every finalized frame
+        self._paddedBboxes = np.empty((capacity, 6))                           # same plus BBOX_THRESH
+        self._bboxCached = np.zeros(capacity, dtype=bool)                      # True for finalized frames
+        self._bboxOffset = 0                                                   # frame of the first row of the bbox arrays
+
+        # Initialize markers, the names they are labeled with are stored as codes into one shared table
+        self.labelTable = MoCapLabelTable(tableNames)
+        self.markers = [MoCapMarker(name, firstFrame, firstFrame + capacity, name, self.labelTable, dtype) for name in names]  # Instances of mocapMarker
+        self.names = [l.name for l in self.markers]                             # String[]: initially labeled names. Those we try to fill.    
         for m in self.markers:
             m.append(firstFrameData[m.name])
-                    
+
         # set parent-child relations for skeleton tree
+        self.skeleton = loadSkeleton(skeleton_file) if skeleton_file is not None else HAND_SKELETON
+        self.compiledSkeleton = Skeleton([]).compile(self.names)               # no relations without skeleton, see initSkeleton
         if use_skeleton:
             self.initSkeleton()        
-        
-        self.getdata(data_in)
+        self.cacheBbox(0)
                  
 
-    def get_rawdata(self, data_in, frame, mirrorX):        
+    def get_rawdata(self, frame):
         """
-            Input: 
-            data_in: the original data line by line from the logfile
-            frame: the line to be looked at
-            
+            Input:
+            frame: the frame to be looked at
+
             Output: {String:[array]}
-            Dictionary from marker name to position at given frame. Only those markers that have a position.
-            Mirrors x component if requested.
-        """
-        rawdata = {}
-               
-        row = data_in[frame]
-        all_rowdata = row.split(',')
-        if len(all_rowdata)<len(self.names):
-            all_rowdata = row.split('\t')
-            
-        data = all_rowdata[2:] # Ignore the values of Field & Time
-        index = 0          
-        for n in range(0, len(data), 3):                
-            if not data[n] == "":                
-                if self.mirrorX:
-                    datapoint = [float(-1)*float(data[n]), float(data[n+1]), float(data[n+2])]                    
-                else:
-                    datapoint = [float(data[n]), float(data[n+1]), float(data[n+2])]
-                    
-            else: 
-                datapoint = []
-            n = self.allOriginalNames[index]
-            if not n in self.ignoredMarkerNames:
-                rawdata[n] = datapoint 
-                           
-            index += 1
-            
-        
-        return rawdata
-                
- 
+            Dictionary from marker name to position at given frame, [] if the marker has no data.
+            Ignored markers are not included, x component is already mirrored if requested.
+        """
+        return self.rawData.getFrame(frame)
+
+
 
-    def getdata(self, data_in):
+    def getdata(self):
         """
             Fills the markers with data. At every frame relabels ALL data points according to nearest neighbor
         """
+        if self.stream_to is not None:
+            self.streamFrames()
+        else:
+            segments = self.getSegments()
+            if self.processes > 1 and len(segments) > 1:
+                self.labelSegmentsParallel(segments)
+            else:
+                self.labelFrames(1, self.frames)
+        if self.check_hand_data and "Hands_R_T4" in self.names:
+            print "Hand heuristics skipped at", self.skippedHandChecks, "of", self.frames - 1, "frames"
+
+    def getSegments(self):
+        """
+            Splits the take at the fallback frames at which all markers have data. Those frames
+            are labeled from the logfile, so the segments in between can be labeled independently.
+            Returns a list of (first frame, frame after the last frame).
+        """
+        anchors = []
+        positions = self.rawData.positions
+        for frame in sorted(set(self.fallback_frames)):
+            if 1 < frame < self.frames:
+                columns = [self.columnIndex.get(m.name, -1) for m in self.markers]
+                if not -1 in columns and not np.isnan(positions[frame, columns, 0]).any():
+                    anchors.append(frame)
+        starts = [1] + anchors
+        return zip(starts, starts[1:] + [self.frames])
+
+    def labelSegmentsParallel(self, segments):
+        """
+            Labels the given segments (see getSegments) in a process pool and stitches the results together
+        """
+        global _segmentDB
+        print "Labeling", len(segments), "segments with", self.processes, "processes"
+        _segmentDB = self
+        pool = multiprocessing.Pool(min(self.processes, len(segments)))
+        results = pool.map(_labelSegment, segments, 1)
+        pool.close()
+        pool.join()
+        _segmentDB = None
+
+        for (begin, end), (markerResults, bboxes, lastbbox, skippedHandChecks) in zip(segments, results):
+            for m, (data, labels, missing, currentName) in zip(self.markers, markerResults):
+                for first, last, name in labels:
+                    m.currentName = name
+                    m.appendBlock(data[first-begin:last+1-begin])
+                for frame in missing:
+                    m.addMissingFrame(frame)
+                m.currentName = currentName
+            self._bboxes[begin:end] = bboxes
+            self._paddedBboxes[begin:end] = bboxes + ([-self.BBOX_THRESH]*3 + [self.BBOX_THRESH]*3)
+            self._bboxCached[begin:end] = True
+            self.lastbbox = lastbbox
+            self.skippedHandChecks += skippedHandChecks
+        self._followedColumns = None
+
+    def streamFrames(self):
+        """
+            Labels the take block by block while reading it (see MoCapStreamReader) and writes the
+            labeled frames to stream_to once they are STREAM_WINDOW frames behind. Written frames
+            are dropped, so the memory needed does not grow with the length of the take.
+            If pipelined, the next blocks are read and the finished blocks are written in their own
+            threads while labeling, and the utilization of every stage is printed at the end.
+        """
+        start_time = time.time()
+        self.writer = LabeledCSVWriter(self.stream_to, self.rawData.headerLine, self.names)
+        self._written = 0                                                       # frames written so far
+        self._frameText = self.rawData.frameText                                # Frame and Time column of the frames not written yet
+        self._timeText = self.rawData.timeText
+        if self.pipelined:
+            blocks = Queue.Queue(self.PIPELINE_QUEUE_SIZE)
+            self._finishedRows = Queue.Queue(self.PIPELINE_QUEUE_SIZE)
+            readingStage = Stage("reading", self.reader.readBlock, outbox=blocks)
+            writingStage = Stage("writing", self._writeRows, inbox=self._finishedRows)
+            readingStage.start()
+            writingStage.start()
+        labeling = 0.0
+        frame = 1
+        while True:
+            labeling_start = time.time()
+            end = self.rawData.offset + self.rawData.frames
+            self.labelFrames(frame, end)
+            frame = end
+            self.flushFrames(frame - self.STREAM_WINDOW)
+            labeling += time.time() - labeling_start
+            block = blocks.get() if self.pipelined else self.reader.readBlock()
+            if block is None:
+                break
+            self.rawData = block
+            self._frameText = np.concatenate([self._frameText, block.frameText])
+            self._timeText = np.concatenate([self._timeText, block.timeText])
+        self.flushFrames(self.frames)
+
+        if self.pipelined:
+            self._finishedRows.put(None)
+            readingStage.finish()
+            writingStage.finish()
+            self.stageTimes = [("reading", readingStage.busy), ("labeling", labeling), ("writing", writingStage.busy)]
+            printUtilization(self.stageTimes, time.time() - start_time)
+        self.writer.close()
+        self.reader.close()
+
+    def _writeRows(self, rows):
+        """
+            Writes a block of finished rows (frameText, timeText, markerData) and flushes the file,
+            so that the block can be read right away
+        """
+        self.writer.writeRows(*rows)
+        self.writer.flush()
+
+    def flushFrames(self, end):
+        """
+            Writes the labeled frames up to end (exclusive) that were not written yet and drops them
+        """
+        begin = self._written
+        if end <= begin:
+            return
+        if self.on_flush is not None:
+            self.on_flush(self, begin, end)
+        count = end - begin
+        if self.pipelined:
+            #the marker arrays are reused after trimming, the writing thread gets a copy
+            self._finishedRows.put((self._frameText[0:count], self._timeText[0:count],
+                                    [m.getDataArray()[0:count].copy() for m in self.markers]))
+        else:
+            self.writer.writeRows(self._frameText[0:count], self._timeText[0:count],
+                                  [m.getDataArray()[0:count] for m in self.markers])
+        self._frameText = self._frameText[count:]
+        self._timeText = self._timeText[count:]
+        self.dropFrames(end)
+        self._written = end
+
+    def dropFrames(self, end):
+        """
+            Drops the positions, missing flags and bounding boxes of the frames before end
+            (see MoCapMarker.trim). Names and gaps are kept.
+        """
+        for m in self.markers:
+            m.trim(end)
+        count = min(end - self._bboxOffset, len(self._bboxCached))
+        if count <= 0:
+            return
+        rows = len(self._bboxCached)
+        self._bboxes[0:rows-count] = self._bboxes[count:]
+        self._paddedBboxes[0:rows-count] = self._paddedBboxes[count:]
+        self._bboxCached[0:rows-count] = self._bboxCached[count:]
+        self._bboxCached[rows-count:] = False
+        self._bboxOffset = end
+
+    def labelFrames(self, begin, end):
+        """
+            Labels the frames begin <= frame < end, the frames before have to be labeled already
+        """
         #in every frame get the original data and remap the whole point cloud.    
-        for frame in range(1,self.frames):
+        handChecks = self.check_hand_data and "Hands_R_T4" in self.names #just checking one random name to see if it has the right naming convention 
+        frame = begin
+        while frame < end:
+            #in between tracklet starts and ends, the markers keep following their columns
+            if self.tracklets is not None:
+                followed = self.followTracklets(frame, limit=end, handChecks=handChecks)
+                if followed > frame + 1:
+                    for f in range((frame+999)//1000*1000, followed, 1000):
+                        print "Frame", f, "/", self.frames
+                    if handChecks:
+                        self.skippedHandChecks += followed - frame
+                    frame = followed
+                    continue
+            else:
+                followed = frame
+
             if ((frame%1000)==0):
                 print "Frame", frame, "/", self.frames
-            #get the data from that frame and relabel
-            logdata = self.get_rawdata(data_in, frame, self.mirrorX)
-            self.relabelAllMarkers(frame, logdata)
+            if followed == frame:
+                #get the data from that frame and relabel
+                logdata = self.get_rawdata(frame)
+                self.relabelAllMarkers(frame, logdata)
                         
             #some heuristics for better labeling if this is mocap data from hands and labeled correctly
-            if self.check_hand_data and "Hands_R_T4" in self.names: #just checking one random name to see if it has the right naming convention 
-                self.check_fingerCrossover(frame)
-                self.check_backwardsTip(frame)
+            if handChecks:
+                if self.needsHandChecks(frame):
+                    self.check_fingerCrossover(frame)
+                    self.check_backwardsTip(frame)
+                else:
+                    self.skippedHandChecks += 1
+
+            #the data of this frame does not change anymore
+            self.cacheBbox(frame)
+            frame += 1
+
+    def getFollowedColumns(self, frame):
+        """
+            Returns for every marker the logfile column its data at the given frame was taken from
+            (the column of its current name, if the data is identical), -1 if the marker was missing
+            or is not following a column.
+        """
+        if self._followedColumns is not None and self._followedColumns[0] == frame:
+            return self._followedColumns[1]
+        positions = self.rawData.positions[frame]
+        columns = []
+        for m in self.markers:
+            column = self.columnIndex.get(m.currentName, -1)
+            if column >= 0 and (m.isMissingFrame(frame) or not np.array_equal(m.getDataArray()[frame], positions[column])):
+                column = -1
+            columns.append(column)
+        return columns
+
+    def followTracklets(self, frame, block=1, limit=None, handChecks=0):
+        """
+            If no tracklet starts or ends at the given frame, the markers that followed a column in
+            the previous frame keep following it. Markers that did not are marked as missing, as long as
+            no column is left for them. If block is set, all frames up to the next tracklet start or end
+            (at most up to limit) are filled at once. With handChecks, the block also ends before the
+            next frame that needs the hand heuristics (see getHandCheckEnd), which have to run on every
+            frame before the next one is labeled.
+            Returns the frame after the last filled frame, the given frame if nothing was filled.
+        """
+        if self.tracklets.isEvent(frame):
+            return frame
+        i = bisect.bisect_left(self.specialFrames, frame)
+        if i < len(self.specialFrames) and self.specialFrames[i] == frame:
+            return frame
+        columns = self.getFollowedColumns(frame-1)
+        followed = [c for c in columns if c >= 0]
+        if len(set(followed)) != len(followed):
+            return frame
+        present = np.flatnonzero(~np.isnan(self.rawData.positions[frame, :, 0]))
+        if len(followed) < len(columns) and len(present) > len(followed):
+            #a not followed column could be taken by one of the other markers
+            return frame
+
+        missing = [m for m, column in zip(self.markers, columns) if column < 0]
+        if block:
+            end = self.tracklets.nextEvent(frame)
+            if i < len(self.specialFrames):
+                end = min(end, self.specialFrames[i])
+            if limit is not None:
+                end = min(end, limit)
+            if handChecks:
+                end = self.getHandCheckEnd(frame, end, columns)
+            for m, column in zip(self.markers, columns):
+                if column >= 0:
+                    m.appendBlock(self.rawData.positions[frame:end, column])
+            #the others are extrapolated frame by frame from the followed markers
+            if missing != []:
+                for f in range(frame, end):
+                    self.markAsMissing(missing, f)
+            #bounding boxes of the filled frames, markers without data are left out
+            data = np.stack([m.getDataArray()[frame:end] for m in self.markers], axis=1)
+            self._bboxes[frame:end, 0:3] = np.fmin.reduce(data, axis=1)
+            self._bboxes[frame:end, 3:6] = np.fmax.reduce(data, axis=1)
+            empty = np.isnan(self._bboxes[frame:end, 0])
+            self._bboxes[frame:end][empty] = [MoCapMarker.MIN]*3 + [MoCapMarker.MAX]*3
+            self._paddedBboxes[frame:end] = self._bboxes[frame:end] + ([-self.BBOX_THRESH]*3 + [self.BBOX_THRESH]*3)
+            self._bboxCached[frame:end] = True
+        else:
+            end = frame + 1
+            positions = self.rawData.positions[frame].tolist()
+            for m, column in zip(self.markers, columns):
+                if column >= 0:
+                    m.append(positions[column])
+            if missing != []:
+                self.markAsMissing(missing, frame)
+        self._followedColumns = (end-1, columns)
+        return end
                             
 
     
@@ -190,6 +503,7 @@ class MoCapLabeledDB:
         if frame in self.fallback_frames:            
             for marker in self.markers:
                 if logdata[marker.name] != []:
+                    marker.setCurrentName(marker.name, frame)
                     marker.append(logdata[marker.name])
                 else:                    
                     not_remappedMarkers.append(marker)
@@ -229,17 +543,7 @@ class MoCapLabeledDB:
         #bounding box of last frame + thresh
         db_unlabeledMarkers = {}
 
-        bbox = self.getBbox(frame-1)
-        if(bbox[0] > 100000):
-            bbox = self.lastbbox
-
-        bbox = [bbox[0]-self.BBOX_THRESH, \
-                bbox[1]-self.BBOX_THRESH, \
-                bbox[2]-self.BBOX_THRESH, \
-                bbox[3]+self.BBOX_THRESH, \
-                bbox[4]+self.BBOX_THRESH, \
-                bbox[5]+self.BBOX_THRESH]
-        self.lastbbox = bbox
+        bbox = self.getPaddedBbox(frame-1)
 
 
         for n, db_data in logdata.iteritems():            
@@ -255,7 +559,10 @@ class MoCapLabeledDB:
         
         not_remappedMarkers = []
         if db_unlabeledMarkers!= {}:
-            nearestNeighborMapping = helper.nearestNeighbor(lastMarkerData, db_unlabeledMarkers, self, frame)
+            if self.assignment_method == "nearest":
+                nearestNeighborMapping = helper.nearestNeighbor(lastMarkerData, db_unlabeledMarkers, self, frame)
+            else:
+                nearestNeighborMapping = self.assignNearestNeighbors(frame, lastMarkerData, db_unlabeledMarkers, alreadyLabeled, checkPosition)
 
             for marker in self.markers:
                 if marker.name in alreadyLabeled:
@@ -311,6 +618,31 @@ class MoCapLabeledDB:
         return distance
         
     
+    def assignNearestNeighbors(self, frame, lastMarkerData, db_unlabeledMarkers, alreadyLabeled=[], checkPosition=1):
+        """
+            Assigns all markers that are not already labeled to the unlabeled markers of this frame
+            in one step (see helper.assignMarkers), only within MARKER_DIST_THRESH of the last position
+            (MARKER_DIST_MISSING_THRESH if the marker was missing) if checkPosition is set.
+            Returns the same mapping as helper.nearestNeighbor: {marker name:[new marker name, distance] or []}
+        """
+        markers = [m for m in self.markers if not m.name in alreadyLabeled]
+        previous = np.array([lastMarkerData[m.name] if lastMarkerData[m.name] != [] else [np.nan]*3 for m in markers])
+        candidateNames = db_unlabeledMarkers.keys()
+        candidates = np.array([db_unlabeledMarkers[n] for n in candidateNames])
+        if checkPosition:
+            gates = np.array([self.MARKER_DIST_MISSING_THRESH if m.isMissingFrame(frame-1) else self.MARKER_DIST_THRESH for m in markers])
+        else:
+            gates = np.full(len(markers), np.inf)
+
+        assignment, distances = helper.assignMarkers(previous, candidates, gates, self.assignment_method)
+        mapping = {}
+        for i in range(len(markers)):
+            if assignment[i] >= 0:
+                mapping[markers[i].name] = [candidateNames[assignment[i]], distances[i]]
+            else:
+                mapping[markers[i].name] = []
+        return mapping
+
     def checkNewPosition(self, marker, frame, old, new):
         """
             Checks the new position for the given marker at the given frame.
@@ -320,17 +652,7 @@ class MoCapLabeledDB:
         """
         validity = 1
         #(1)
-        bbox = self.getBbox(frame-1)
-        if(bbox[0] > 100000):
-            bbox = self.lastbbox
-
-        bbox = [bbox[0]-self.BBOX_THRESH, \
-                bbox[1]-self.BBOX_THRESH, \
-                bbox[2]-self.BBOX_THRESH, \
-                bbox[3]+self.BBOX_THRESH, \
-                bbox[4]+self.BBOX_THRESH, \
-                bbox[5]+self.BBOX_THRESH]
-        self.lastbbox = bbox
+        bbox = self.getPaddedBbox(frame-1)
 
         if not helper.insideBoundingBox(new, bbox):
             validity = 0
@@ -361,63 +683,44 @@ class MoCapLabeledDB:
 
     
     def markAsMissing(self, markers, frame, refFrame=-1):
-        
-        if refFrame == -1:
-            refFrame = frame-1
-            
-        distance = 0
-        #sort markers to have parents before children.
-        markers = sorted(markers, key=lambda x: x.name)
-        for marker in markers:
-            #marker.append(marker.getdata(frame-1))
-            self.extrapolateMarker(marker, frame, refFrame)
-            marker.addMissingFrame(frame)
-            distance += np.linalg.norm(np.array(marker.getdata(frame))-np.array(marker.getdata(refFrame)))
-        return distance
-
-    def extrapolateMarker(self, marker, frame, refFrame=-1):
         """
-            Extrapolates the marker based on the parent and child markers. 
-            Takes the vector of the previous frame from parent and child marker to this marker
-            and computes the new position based on the new position of parent and child marker
-            + the vector from last frame. 
-            If both, parent and child marker are missing as well, it appends the 
-            position from last frame.  
+            Extrapolates the given markers at the frame and marks them as missing. Every marker keeps the
+            vectors from its parent and child marker at refFrame (the mean of both if both are available,
+            the position of the last frame if none is). The markers are extrapolated level by level of the
+            skeleton, parents before children, all markers of a level at once. Missing children are not used,
+            missing parents with their extrapolated position.
+            Returns the summed distance of the extrapolated positions to the positions at refFrame.
         """
         if refFrame == -1:
             refFrame = frame-1
-            
-        parentMarker = marker.getParentMarker()
-        childMarker = marker.getChildMarker()
-        
-        parentVector = marker.getParentVector(refFrame)
-        childVector = marker.getChildVector(refFrame)
-        
-        extr_pos = []
-        if parentVector != []: 
-            parentPos = parentMarker.getdata(frame)
-            if parentPos != []:
-                extr_pos = np.array(parentPos) + parentVector
-        
-        if childVector != []:
-            childPos = childMarker.getdata(frame)
-            if childPos != []:
-                extr_pos_child = np.array(childPos) + childVector
-                if extr_pos != []:
-                    extr_pos = np.mean([extr_pos_child, extr_pos], 0)
-                else:
-                    extr_pos = extr_pos_child
-        
-        
-        if extr_pos == []:
-            #has no child nor parent marker or both are missing.  
-            extr_pos = marker.getdata(frame-1)
-        #else:
-            #print "Marker", marker.name , "extrapolated at frame", str(frame)
-        extr_pos = [extr_pos[0], extr_pos[1], extr_pos[2]]     #fram np.array -> array
-        marker.append(extr_pos)
-        
-    
+        if len(markers) == 0:
+            return 0
+        skeleton = self.compiledSkeleton
+        missing = np.array([skeleton.index[m.name] for m in markers])
+        parents = skeleton.parents[missing]
+        children = skeleton.children[missing]
+        neighbors = [i for i in parents.tolist() + children.tolist() if i >= 0]
+        current = self._markerPositions(frame, neighbors)
+        reference = self._markerPositions(refFrame, missing.tolist() + neighbors)
+        previous = reference[missing] if refFrame == frame-1 else self._markerPositions(frame-1, missing)[missing]
+
+        #vectors from parent and child to the marker at the reference frame
+        parentVectors = reference[missing] - reference[parents]
+        childVectors = reference[missing] - reference[children]
+        for rows in skeleton.levels(missing):
+            fromParent = current[parents[rows]] + parentVectors[rows]
+            fromChild = current[children[rows]] + childVectors[rows]
+            #mean of both if available (NaN if not)
+            positions = np.where(np.isnan(fromChild), fromParent, np.where(np.isnan(fromParent), fromChild, (fromChild + fromParent) / 2))
+            #has no child nor parent marker or both are missing: position from last frame
+            current[missing[rows]] = np.where(np.isnan(positions), previous[rows], positions)
+
+        for i, marker in zip(missing, markers):
+            marker.append(current[i].tolist())
+            marker.addMissingFrame(frame)
+        difference = current[missing] - reference[missing]
+        #markers without data at refFrame count 0
+        return np.fmax(np.sqrt(np.einsum('ij,ij->i', difference, difference)), 0).sum()
 
     def getBboxPlusThresh(self, frame):
         bbox = self.getBbox()
@@ -433,6 +736,38 @@ class MoCapLabeledDB:
             self.lastbbox = bbox
         return bbox
 
+    def cacheBbox(self, frame):
+        """
+            Stores the bounding box of the given frame and its padded version. Call once the
+            data of all markers at that frame is final, i.e. after all checks of that frame.
+        """
+        row = frame - self._bboxOffset
+        self._bboxes[row] = self.getBbox(frame)
+        self._paddedBboxes[row] = self._bboxes[row] + ([-self.BBOX_THRESH]*3 + [self.BBOX_THRESH]*3)
+        self._bboxCached[row] = True
+
+    def getPaddedBbox(self, frame):
+        """
+            Returns the bounding box of the given frame plus BBOX_THRESH.
+            If no marker has data at that frame, the last returned box is padded again.
+        """
+        row = frame - self._bboxOffset
+        if 0 <= row < len(self._bboxCached) and self._bboxCached[row] and self._bboxes[row, 0] <= 100000:
+            bbox = self._paddedBboxes[row].tolist()
+        else:
+            bbox = self.getBbox(frame)
+            if(bbox[0] > 100000):
+                bbox = self.lastbbox
+
+            bbox = [bbox[0]-self.BBOX_THRESH, \
+                    bbox[1]-self.BBOX_THRESH, \
+                    bbox[2]-self.BBOX_THRESH, \
+                    bbox[3]+self.BBOX_THRESH, \
+                    bbox[4]+self.BBOX_THRESH, \
+                    bbox[5]+self.BBOX_THRESH]
+        self.lastbbox = bbox
+        return bbox
+
     def getBbox(self, frame=-1):
         """
             Computes the bounding box around the whole marker space
@@ -453,6 +788,12 @@ class MoCapLabeledDB:
             self.bbox_height = abs(maxy - miny)
             self.bbox_length = abs(maxz - minz)
             return [minx,miny,minz,maxx,maxy,maxz]
+        elif 0 <= frame - self._bboxOffset < len(self._bboxCached) and self._bboxCached[frame - self._bboxOffset]:
+            bbox = self._bboxes[frame - self._bboxOffset].tolist()
+            self.bbox_width =  abs(bbox[3] - bbox[0])
+            self.bbox_height = abs(bbox[4] - bbox[1])
+            self.bbox_length = abs(bbox[5] - bbox[2])
+            return bbox
         else:
             #return bounding box for given frame
             minx = miny = minz = MoCapMarker.MIN
@@ -472,43 +813,131 @@ class MoCapLabeledDB:
             return [minx,miny,minz,maxx,maxy,maxz]
 
     def writeOutData(self, filename, orig=0):
+        if self.stream_to is not None:
+            raise ValueError("The data can not be written again after streaming, it is already written to " + self.stream_to)
         print "WRITING DATA"
-        datafile = self.datafile
         newFilename = filename
         if orig:
             newFilename = filename+"_orig"
-        f_new = open(newFilename, 'w')
-
-        #get old data
-        f_orig = open(datafile, 'r')
-        original = f_orig.readlines()
-        f_orig.close
-
-        #Write data
-        #Header from original file and marker names
-        f_new.write(original[0] + "\n"+ "\n")
-        markerline = ","
-        columnline = "Frame, Time"
-        for n in self.names:
-            markerline = markerline + "," + n + "," + n + "," + n
-            columnline = columnline + ",X,Y,Z"
-        f_new.write(markerline + "\n")
-        f_new.write("\n\n")
-        f_new.write(columnline + "\n")
-
-        #Entries
-        for i in range(0,self.frames):
-            line_i = i+7
-            #Frame and time from original file
-            orig_entry = original[line_i].split(",")
-            new_entry = orig_entry[0] + "," + orig_entry[1] #frame and time
-            for m in self.markers:
-                new_entry = new_entry + m.getDataToString(i, sep=",")
-            f_new.write(new_entry + "\n")
 
-        f_new.close()
+        #Frame and time as well as the header are taken from the original file
+        writeLabeledCSV(newFilename,
+                        self.rawData.headerLine,
+                        self.names,
+                        self.rawData.frameText,
+                        self.rawData.timeText,
+                        [m.getDataArray() for m in self.markers])
         print "DONE"
 
+    def writeOutBinary(self, filename, fmt="npy"):
+        """
+            Writes positions, missing frames, source labels, marker names and frame/time
+            in a binary format, see mocapWriter.writeLabeledBinary
+        """
+        print "WRITING BINARY DATA"
+        sources, sourceNames = self.getSourceLabels()
+        writeLabeledBinary(filename, self.names,
+                           self.getPositions(),
+                           self.getMissingMask(),
+                           sources, sourceNames,
+                           self.rawData.frameNumbers,
+                           self.rawData.times,
+                           fmt)
+        print "DONE"
+
+    def getGaps(self, minLength=1):
+        """
+            Returns all gaps of at least minLength frames in which a marker was missing
+            as list of (marker name, first frame, number of frames), ordered by marker
+        """
+        return [(m.name, start, length) for m in self.markers for start, length in m.getGaps(minLength)]
+
+    def writeGapTable(self, filename, minLength=1):
+        """
+            Writes all gaps of at least minLength missing frames to a csv file, see mocapWriter.writeGapTable
+        """
+        print "WRITING GAP TABLE"
+        writeGapTable(filename, self.getGaps(minLength), self.rawData.frameNumbers, self.rawData.times)
+        print "DONE"
+
+    def fillGaps(self, method="linear", maxGap=gapFill.MAX_GAP):
+        """
+            Replaces the extrapolated positions of all gaps of at most maxGap frames by interpolating
+            between the frames before and after them, see gapFill.fillGaps. Needs the whole take,
+            the filled frames stay marked as missing.
+        """
+        if self.stream_to is not None:
+            raise ValueError("Gaps can not be filled while streaming, the frames before the gaps are already written")
+        positions = self.getPositions()
+        gaps, frames = gapFill.fillGaps(positions, self.getMissingMask(), method, maxGap, self.compiledSkeleton)
+        for i in range(len(self.markers)):
+            self.markers[i].getDataArray()[:] = positions[:, i]
+        print "Filled", gaps, "gaps (", frames, "frames ) by", method, "interpolation"
+        return gaps, frames
+
+    def fitRigidClusters(self, clusters):
+        """
+            Recovers the missing markers of rigid clusters (lists of marker names) from the visible
+            markers of each cluster, see rigidBody.fitRigidClusters. Needs the whole take, the recovered
+            frames are no longer marked as missing. Returns the number of recovered positions.
+        """
+        if self.stream_to is not None:
+            raise ValueError("Rigid clusters can not be fitted while streaming, the frames are already written")
+        indexes = [[self.names.index(name) for name in cluster if name in self.names] for cluster in clusters]
+        positions = self.getPositions()
+        recovered = rigidBody.fitRigidClusters(positions, self.getMissingMask(), indexes)
+        for i in np.flatnonzero(recovered.any(axis=0)):
+            frames = np.flatnonzero(recovered[:, i])
+            self.markers[i].getDataArray()[frames] = positions[frames, i]
+            self.markers[i].removeMissingFrames(frames)
+        print "Recovered", recovered.sum(), "missing positions of", len(clusters), "rigid clusters"
+        return int(recovered.sum())
+
+    def getRelabelEvents(self, begin=0, end=-1):
+        """
+            Returns all relabel events at frames begin <= frame <= end (end=-1: until the last frame)
+            as list of (frame, marker name, old name, new name), ordered by frame
+        """
+        events = [(frame, m.name, old, new) for m in self.markers for frame, old, new in m.getRelabelEvents(begin, end)]
+        events.sort(key=lambda e: e[0])
+        return events
+
+    def writeRelabelEvents(self, filename):
+        """
+            Writes all relabel events to a csv file, see mocapWriter.writeRelabelEvents
+        """
+        print "WRITING RELABEL EVENTS"
+        writeRelabelEvents(filename, self.getRelabelEvents(), self.rawData.frameNumbers, self.rawData.times)
+        print "DONE"
+
+    def getPositions(self):
+        """
+            Returns the labeled data as (frames x markers x 3) np.array, NaN if no data
+        """
+        if self.stream_to is not None:
+            raise ValueError("The positions are not kept after streaming, only the last frames are in memory")
+        return np.stack([m.getDataArray() for m in self.markers], axis=1)
+
+    def getMissingMask(self):
+        """
+            Returns a (frames x markers) np.array that is True where a marker was missing
+        """
+        if self.stream_to is not None:
+            raise ValueError("The missing frames are not kept after streaming, only the last frames are in memory")
+        missing = np.zeros((self.frames, len(self.markers)), dtype=bool)
+        for i in range(len(self.markers)):
+            markerMissing = self.markers[i].getMissingArray()[0:self.frames]
+            missing[0:len(markerMissing), i] = markerMissing
+        return missing
+
+    def getSourceLabels(self):
+        """
+            Returns a (frames x markers) np.array with the index of the logfile marker
+            each marker was labeled from at each frame, and the list of those names
+        """
+        sources = np.stack([m.getLabelCodes() for m in self.markers], axis=1)
+        return sources, list(self.labelTable.names)
+
     def getMarkerData(self, index, begin, end, step):
         """
             Given the index of a marker, getMarkerData() returns a list of
@@ -546,12 +975,12 @@ class MoCapLabeledDB:
 
     def initSkeleton(self):
         """
-            sets the neighbor relations of the hand skeleton within the marker
+            sets the neighbor relations of the skeleton within the marker and compiles it for the markers
         """
         for marker in self.markers:
             name = marker.getname()
             #child
-            childname = childLookup(name)
+            childname = self.skeleton.children.get(name, -1)
             if childname != -1:
                 try:
                     childmarker = self.getMarkerByName(childname)
@@ -562,7 +991,7 @@ class MoCapLabeledDB:
                 marker.setChildMarker(childmarker)
 
             #parent
-            parentname = parentLookup(name)
+            parentname = self.skeleton.parents.get(name, -1)
             if parentname != -1:                
                 try:
                     parentmarker = self.getMarkerByName(parentname)
@@ -571,6 +1000,7 @@ class MoCapLabeledDB:
                     print "Marker not in list", parentname
                     parentmarker = 0
                 marker.setParentMarker(parentmarker)
+        self.compiledSkeleton = self.skeleton.compile(self.names)
 
     def getMarkers(self):
         return self.markers
@@ -590,77 +1020,239 @@ class MoCapLabeledDB:
 # Otherwise gives a warning
 #------------------------------------------------------------------------------
 
+    def getHandTopology(self):
+        """
+            Returns the hand markers of the finger pairs and tips checked by check_fingerCrossover and
+            check_backwardsTip, compiled once into index arrays:
+            "thumb": whether Hands_R_T3 exists (the checks do nothing otherwise),
+            "pairs": (pairs x 8) marker indexes R_1-R_4, L_1-L_4 per finger pair (R_2/L_2 if there are no 1 markers),
+            "knuckles": whether the pair has 1 markers, "segments": the pairs' CROSSOVER_SEGMENTS,
+            "tips": (tips x 3) marker indexes 2-4 per finger tip, "markers": the indexes of all of them.
+            The lists stop before the first pair (tip) with a marker that does not exist, "pairsComplete" and
+            "tipsComplete" tell whether they did.
+        """
+        if self._handTopology is not None:
+            return self._handTopology
+        index = dict((name, i) for i, name in enumerate(self.names))
+        def lookup(names):
+            if not all(name in index for name in names):
+                return None
+            return [index[name] for name in names]
+
+        pairs = []
+        knuckles = []
+        for (i1,i2) in self.FINGER_PAIRS:
+            pair = lookup(["Hands_"+i1+"2", "Hands_"+i1+"3", "Hands_"+i1+"4", "Hands_"+i2+"2", "Hands_"+i2+"3", "Hands_"+i2+"4"])
+            if pair is None:
+                break
+            knuckle = lookup(["Hands_"+i1+"1", "Hands_"+i2+"1"])
+            knuckles.append(knuckle is not None)
+            if knuckle is None:
+                knuckle = [pair[0], pair[3]]
+            pairs.append([knuckle[0]] + pair[0:3] + [knuckle[1]] + pair[3:6])
+        tips = []
+        for f in self.FINGER_TIPS:
+            tip = lookup(['Hands_'+f+'2', 'Hands_'+f+'3', 'Hands_'+f+'4'])
+            if tip is None:
+                break
+            tips.append(tip)
+
+        pairs = np.array(pairs, dtype=int).reshape(-1, 8)
+        self._handTopology = {"thumb": 'Hands_R_T3' in index,
+                              "pairs": pairs,
+                              "knuckles": knuckles,
+                              "segments": pairs[:, self.CROSSOVER_SEGMENTS],
+                              "pairsComplete": len(pairs) == len(self.FINGER_PAIRS),
+                              "tips": np.array(tips, dtype=int).reshape(-1, 3),
+                              "tipsComplete": len(tips) == len(self.FINGER_TIPS),
+                              "markers": np.union1d(pairs.ravel(), np.ravel(tips)).astype(int)}
+        return self._handTopology
+
+    def _markerPositions(self, frame, indexes):
+        """
+            (markers+1 x 3) positions at the frame of the markers with the given indexes, NaN for the others,
+            if there is no data and in the last row (index -1: no marker)
+        """
+        positions = np.full((len(self.markers) + 1, 3), np.nan)
+        for i in indexes:
+            data = self.markers[i].getdata(frame)
+            if data:
+                positions[i] = data
+        return positions
+
+    def getCrossoverDistances(self, frame):
+        """
+            Closest distances of the CROSSOVER_SEGMENTS bone pairs of all finger pairs at the frame as
+            (pairs x segments) array, computed in one batch. NaN where a bone pair is only partly missing.
+        """
+        topology = self.getHandTopology()
+        segments = topology["segments"]
+        positions = self._markerPositions(frame, topology["markers"])
+        points = positions[segments.reshape(-1, 4)]
+        distances = helper.closest3dBatch(points[:,0], points[:,1], points[:,2], points[:,3])
+        return distances.reshape(segments.shape[0:2])
+
+    def getTipAngles(self, frame):
+        """
+            Angles between the 2-3 and 3-4 bones and between the 2-4 and 4-3 bones (3 and 4 swapped) of all
+            finger tips at the frame as (tips x 2) array, computed in one batch. NaN where a tip is only partly missing.
+        """
+        topology = self.getHandTopology()
+        tips = topology["tips"]
+        positions = self._markerPositions(frame, topology["markers"])
+        M2 = positions[tips[:,0]]
+        M3 = positions[tips[:,1]]
+        M4 = positions[tips[:,2]]
+        angles = np.column_stack([helper.angleBetweenBatch(M3 - M2, M4 - M3),
+                                  helper.angleBetweenBatch(M4 - M2, M3 - M4)])
+        missing = np.isnan(M2[:,0]).astype(int) + np.isnan(M3[:,0]) + np.isnan(M4[:,0])
+        angles[missing == 3] = np.arccos(0.0)
+        angles[(missing > 0) & (missing < 3)] = np.nan
+        return angles
+
+    def flagHandCheckFrames(self, positions):
+        """
+            Prefilter for check_fingerCrossover and check_backwardsTip, for many frames at once.
+            Input: (frames x markers x 3) positions in the order of self.markers
+            Output: bool array, True at the frames at which the checks may swap markers or fail:
+                    a hand marker is missing, the bounding boxes of two bones that the crossover check tests first
+                    (PREFILTER_SEGMENTS) are closer than CROSSOVER_THRESH, or the bones at a finger tip
+                    may be at an angle of BACKWARDS_TIP_THRESH or more.
+            The distance of the bounding boxes is a lower bound of the distance of the bones.
+        """
+        topology = self.getHandTopology()
+        flags = np.zeros(len(positions), dtype=bool)
+        if not topology["thumb"]:
+            #the checks do nothing
+            return flags
+        if not (topology["pairsComplete"] and topology["tipsComplete"]):
+            #the checks warn at every frame
+            flags[:] = True
+            return flags
+
+        #bones that may be crossed
+        segments = topology["segments"][:, self.PREFILTER_SEGMENTS]
+        p0 = positions[:, segments[..., 0]]
+        p1 = positions[:, segments[..., 1]]
+        q0 = positions[:, segments[..., 2]]
+        q1 = positions[:, segments[..., 3]]
+        gap = np.maximum(np.minimum(q0, q1) - np.maximum(p0, p1), np.minimum(p0, p1) - np.maximum(q0, q1))
+        gap = np.maximum(gap, 0)
+        distances = np.sqrt(np.einsum('fsij,fsij->fsi', gap, gap))
+        #the 1-2 bones are only tested if there are 1 markers
+        distances[:, np.logical_not(topology["knuckles"]), self.PREFILTER_SEGMENTS.index(5)] = np.inf
+        flags |= (distances <= self.CROSSOVER_THRESH + self.PREFILTER_DISTANCE_MARGIN).any(axis=(1, 2))
+
+        #steep angles at the finger tips
+        tips = topology["tips"]
+        b23 = positions[:, tips[:, 1]] - positions[:, tips[:, 0]]
+        b34 = positions[:, tips[:, 2]] - positions[:, tips[:, 1]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosines = np.einsum('fti,fti->ft', b23, b34) / np.sqrt(np.einsum('fti,fti->ft', b23, b23) * np.einsum('fti,fti->ft', b34, b34))
+        flags |= ~(cosines > np.cos(self.BACKWARDS_TIP_THRESH) + self.PREFILTER_ANGLE_MARGIN).all(axis=1)
+
+        #missing markers (the checks may fail)
+        flags |= np.isnan(positions[:, topology["markers"], 0]).any(axis=1)
+        return flags
+
+    def needsHandChecks(self, frame):
+        """
+            Whether check_fingerCrossover and check_backwardsTip may change anything at the labeled frame,
+            see flagHandCheckFrames
+        """
+        positions = self._markerPositions(frame, self.getHandTopology()["markers"])
+        return self.flagHandCheckFrames(positions[np.newaxis])[0]
+
+    def getHandCheckEnd(self, begin, end, columns):
+        """
+            Returns the first frame begin < frame < end that needs the hand heuristics (see flagHandCheckFrames)
+            if the markers follow the given columns from begin on, end if there is none. Returns begin+1 if it is
+            not known without labeling (a hand marker does not follow a column), or if begin needs them.
+        """
+        indexes = self.getHandTopology()["markers"]
+        if any(columns[i] < 0 for i in indexes):
+            return begin + 1
+        for blockBegin in range(begin, end, self.PREFILTER_BLOCK):
+            blockEnd = min(blockBegin + self.PREFILTER_BLOCK, end)
+            positions = np.full((blockEnd - blockBegin, len(self.markers), 3), np.nan)
+            for i in indexes:
+                positions[:, i] = self.rawData.positions[blockBegin:blockEnd, columns[i]]
+            flagged = np.flatnonzero(self.flagHandCheckFrames(positions))
+            if len(flagged) > 0:
+                return max(blockBegin + flagged[0], begin + 1)
+        return end
+
     def check_fingerCrossover(self, frame):
         """
             Checks if the markers of 2 neighboring fingers are switched:
             If t3-t4 bones are crossed, switch t4 marker data
             If t3-t4 AND t3-t2 are crossed, switch t3 data
+            The distances of all bones are computed at once and again after a swap.
         """
+        topology = self.getHandTopology()
+        if not topology["thumb"]:
+            return
         #check if the names follow our naming convention: 
         try:
-            fingerpairs = [('R_T','L_T'), ('R_L','R_R'), ('L_R','L_L') , ('R_R','R_M'), ('L_M','L_R'), ('R_M','R_I'), ('L_I','L_M')]
-            for (i1,i2) in fingerpairs:
-                if i1=='R_T':
-                    if not 'Hands_R_T3' in [m.name for m in self.markers]:
-                        return
-                if "Hands_"+i1+"1" in self.names and "Hands_"+i2+"1" in self.names:  
-                    L_1 = self.getMarkerByName("Hands_"+i2+"1")
-                    R_1 = self.getMarkerByName("Hands_"+i1+"1")   
-                R_2 = self.getMarkerByName("Hands_"+i1+"2")
-                R_3 = self.getMarkerByName("Hands_"+i1+"3")
-                R_4 = self.getMarkerByName("Hands_"+i1+"4")
-                
-                L_2 = self.getMarkerByName("Hands_"+i2+"2")
-                L_3 = self.getMarkerByName("Hands_"+i2+"3")
-                L_4 = self.getMarkerByName("Hands_"+i2+"4")
-                
+            distances = None
+            for p in range(len(topology["pairs"])):
+                R_1, R_2, R_3, R_4, L_1, L_2, L_3, L_4 = [self.markers[i] for i in topology["pairs"][p]]
+                if distances is None:
+                    distances = self.getCrossoverDistances(frame)
+                d = distances[p]
+
                 #check if they are close enough
-                if helper.closest3d(R_3.getdata(frame), R_4.getdata(frame),  L_3.getdata(frame), L_4.getdata(frame), infinite=0)<= self.CROSSOVER_THRESH:
-                    if helper.closest3d(R_2.getdata(frame), R_3.getdata(frame),  L_2.getdata(frame), L_3.getdata(frame), infinite=0)<= self.CROSSOVER_THRESH:
+                if _checked(d[0]) <= self.CROSSOVER_THRESH:
+                    if _checked(d[1]) <= self.CROSSOVER_THRESH:
                         #switch t3 data oNLY if it would help
-                        if helper.closest3d(R_2.getdata(frame), L_3.getdata(frame),  L_2.getdata(frame), R_3.getdata(frame), infinite=0)> self.CROSSOVER_THRESH and\
-                        helper.closest3d(L_3.getdata(frame), R_4.getdata(frame),  R_3.getdata(frame), L_4.getdata(frame), infinite=0)> self.CROSSOVER_THRESH:
+                        if _checked(d[2]) > self.CROSSOVER_THRESH and _checked(d[3]) > self.CROSSOVER_THRESH:
                             self._swapMarkerData(frame, R_3, L_3)
+                            distances = None
                             print "Swapped",  R_3.name, "and", L_3.name, "at frame ", str(frame)
                     else:
                         #switch t4 data ONLY If it would help
-                        if helper.closest3d(R_3.getdata(frame), L_4.getdata(frame),  L_3.getdata(frame), R_4.getdata(frame), infinite=0)> self.CROSSOVER_THRESH:
+                        if _checked(d[4]) > self.CROSSOVER_THRESH:
                             self._swapMarkerData(frame, R_4, L_4)
+                            distances = None
                             print "Swapped",  R_4.name, "and", L_4.name, "at frame ", str(frame)  
-                elif helper.closest3d(R_2.getdata(frame), R_3.getdata(frame),  L_2.getdata(frame), L_3.getdata(frame), infinite=0)<= self.CROSSOVER_THRESH:
-                    if helper.closest3d(R_2.getdata(frame), L_3.getdata(frame),  L_2.getdata(frame), R_3.getdata(frame), infinite=0)> self.CROSSOVER_THRESH:                
+                elif _checked(d[1]) <= self.CROSSOVER_THRESH:
+                    if _checked(d[2]) > self.CROSSOVER_THRESH:
                         #switch both t4 and t3 data ONLY if it would help
                         self._swapMarkerData(frame, R_3, L_3)
                         self._swapMarkerData(frame, R_4, L_4)
+                        distances = None
                 #only 1-2 bones are crossed. find out what to switch            
-                elif "Hands_"+i1+"1" in self.names and "Hands_"+i2+"1" in self.names: 
-                    if helper.closest3d(R_1.getdata(frame), R_2.getdata(frame),  L_1.getdata(frame), L_2.getdata(frame), infinite=0)<= self.CROSSOVER_THRESH:
+                elif topology["knuckles"][p]:
+                    if _checked(d[5]) <= self.CROSSOVER_THRESH:
                         #if the 2, 3, and 4 markers of the finger on the rigth (first one) are not on the right, switch all those. else do nothing, only the knuckle markers are somehow wrong            
                         if R_2.getdata(frame)[0] < L_2.getdata(frame)[0] and R_3.getdata(frame)[0] < L_3.getdata(frame)[0] and R_4.getdata(frame)[0] < L_4.getdata(frame)[0]:
                             #switch both t4 and t3 and t2 data ONLY if it would help
                             self._swapMarkerData(frame, R_2, L_2)
                             self._swapMarkerData(frame, R_3, L_3)
                         self._swapMarkerData(frame, R_4, L_4)
-            
-            for (i1,i2) in fingerpairs:
-                R_2 = self.getMarkerByName("Hands_"+i1+"2")
-                R_3 = self.getMarkerByName("Hands_"+i1+"3")
-                R_4 = self.getMarkerByName("Hands_"+i1+"4")
-                L_2 = self.getMarkerByName("Hands_"+i2+"2")
-                L_3 = self.getMarkerByName("Hands_"+i2+"3")
-                L_4 = self.getMarkerByName("Hands_"+i2+"4")
-                
+                        distances = None
+            if not topology["pairsComplete"]:
+                raise ValueError("Finger pair " + str(self.FINGER_PAIRS[len(topology["pairs"])]) + " not in the markers")
+
+            for p in range(len(topology["pairs"])):
+                R_1, R_2, R_3, R_4, L_1, L_2, L_3, L_4 = [self.markers[i] for i in topology["pairs"][p]]
+                if distances is None:
+                    distances = self.getCrossoverDistances(frame)
+                d = distances[p]
+
                 #L4-3 and R2-3, check if they are close enough
-                if helper.closest3d(L_3.getdata(frame), L_4.getdata(frame),  R_2.getdata(frame), R_3.getdata(frame))<= self.CROSSOVER_THRESH:
+                if _checked(d[6]) <= self.CROSSOVER_THRESH:
                     #switch L4, R3 data ONLY if it would help
-                    if helper.closest3d(L_3.getdata(frame), R_3.getdata(frame),  R_2.getdata(frame), L_4.getdata(frame))> self.CROSSOVER_THRESH:
+                    if _checked(d[7]) > self.CROSSOVER_THRESH:
                         self._swapMarkerData(frame, R_3, L_4)
+                        distances = None
                         print "Swapped",  R_3.name, "and", L_4.name, "at frame ", str(frame)
                 #L2-3 and R3-4, check if they are close enough
-                elif helper.closest3d(L_2.getdata(frame), L_3.getdata(frame),  R_3.getdata(frame), R_4.getdata(frame))<= self.CROSSOVER_THRESH:                            
+                elif _checked(d[8]) <= self.CROSSOVER_THRESH:
                     #switch R4, L3 data, ONLY if it would help!
-                    if helper.closest3d(L_2.getdata(frame), R_4.getdata(frame),  R_3.getdata(frame), L_3.getdata(frame))> self.CROSSOVER_THRESH:
+                    if _checked(d[9]) > self.CROSSOVER_THRESH:
                         self._swapMarkerData(frame, L_3, R_4) 
+                        distances = None
                         print "Swapped",  L_3.name, "and", R_4.name, "at frame ", str(frame)
             
         except Exception:
@@ -670,49 +1262,79 @@ class MoCapLabeledDB:
         """
             Check if there is this steep angle between at the fingertip where the fingertip points backwards.
             If so, switch 3 and 4 marker.
+            The angles of all tips are computed at once and again after a swap.
         """
+        topology = self.getHandTopology()
+        if not topology["thumb"]:
+            return
         try:
-            fingertips = ['R_T', 'R_I', 'R_M', 'R_R', 'R_L', 'L_T', 'L_I', 'L_M', 'L_R', 'L_I']
-            for f in fingertips:
-                if f=='R_T':
-                    if not 'Hands_R_T3' in [m.name for m in self.markers]:
-                        return
-                    
-                M2 = self.getMarkerByName('Hands_'+f+'2')
-                M3 = self.getMarkerByName('Hands_'+f+'3')
-                M4 = self.getMarkerByName('Hands_'+f+'4')
-                
-                b23 = np.array(M3.getdata(frame)) - np.array(M2.getdata(frame))
-                b34 = np.array(M4.getdata(frame)) - np.array(M3.getdata(frame))
-                
-                #swapped
-                b24 = np.array(M4.getdata(frame)) - np.array(M2.getdata(frame))
-                b43 = np.array(M3.getdata(frame)) - np.array(M4.getdata(frame))
-                
-                if helper.angle_between(b23, b34) >= self.BACKWARDS_TIP_THRESH:
+            angles = None
+            for t in range(len(topology["tips"])):
+                M2, M3, M4 = [self.markers[i] for i in topology["tips"][t]]
+                if angles is None:
+                    angles = self.getTipAngles(frame)
+
+                if _checked(angles[t,0]) >= self.BACKWARDS_TIP_THRESH:
                     #switch 3 and 4 data, ONLUY if it would help
-                    if helper.angle_between(b24, b43) < self.BACKWARDS_TIP_THRESH:
+                    if _checked(angles[t,1]) < self.BACKWARDS_TIP_THRESH:
                         self._swapMarkerData(frame, M3, M4)
+                        angles = None
+            if not topology["tipsComplete"]:
+                raise ValueError("Finger tip " + self.FINGER_TIPS[len(topology["tips"])] + " not in the markers")
                     
         except Exception:
             print ("WARNING:backwards tip check not possible, marker names not recognized.")
                 
     def _swapMarkerData(self, frame, M3, M4):        
-        tmp = M3.data[frame]
+        self._followedColumns = None
+        tmp = M3.getdata(frame)
         tmp_name = M3.currentName
         
-        M3.data[frame] = M4.data[frame]                
+        M3.setdata(frame, M4.getdata(frame))
         M3.currentName = M4.currentName
-        M3.markerRelabeledTo[frame] = M3.currentName
+        M3.setNameAtFrame(frame, M3.currentName)
         
-        M4.data[frame]= tmp
+        M4.setdata(frame, tmp)
         M4.currentName = tmp_name
-        M4.markerRelabeledTo[frame] = M3.currentName
+        M4.setNameAtFrame(frame, M4.currentName)
         
         if M3.isMissingFrame(frame):
-            M4.missingFrames.append(frame)
+            M4.addMissingFrame(frame)
         if M4.isMissingFrame(frame):
-            M3.missingFrames.append(frame)
-            
+            M3.addMissingFrame(frame)
+
+
+def _checked(value):
+    """
+        Returns a distance or angle of the batched hand checks. NaN means that markers are partly missing
+        and the check of the single bones would fail, raise then.
+    """
+    if value != value:
+        raise ValueError("Missing marker data")
+    return value
+
+
+# the MoCapLabeledDB whose segments are labeled, inherited by the forked worker processes
+_segmentDB = None
+
+def _labelSegment(segment):
+    """
+        Labels the frames begin <= frame < end of _segmentDB in a worker process. Returns for every marker
+        the positions, the labels as list of (first frame, last frame, name), the missing frames and the
+        current name at the end, as well as the bounding boxes of the frames, the last padded one and
+        the number of frames the hand heuristics were skipped at.
+    """
+    db = _segmentDB
+    begin, end = segment
+    #the frames before are not needed, the segment starts at a fallback frame
+    for m in db.markers:
+        m.appendBlock(np.full((begin - m.getDataArray().shape[0], 3), np.nan))
+    skippedHandChecks = db.skippedHandChecks
+    db.labelFrames(begin, end)
 
-    
\ No newline at end of file
+    markerResults = []
+    for m in db.markers:
+        labels = [(max(first, begin), last, name) for first, last, name in m.getAllLabels() if last >= begin]
+        missing = (np.flatnonzero(m.getMissingArray()[begin:end]) + begin).tolist()
+        markerResults.append((m.getDataArray()[begin:end].copy(), labels, missing, m.currentName))
+    return markerResults, db._bboxes[begin:end].copy(), db.lastbbox, db.skippedHandChecks - skippedHandChecks
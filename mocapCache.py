@@ -0,0 +1,222 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+from mocapReader import MoCapRawData, readMoCapCSV
+
+
+class RawDataCache:
+    """
+        A directory of parsed takes, stored as .npy files that are memory mapped when loaded.
+        Entries are keyed on the content of the logfile and the parse options, so a changed
+        logfile is parsed again. The least recently used entries are removed when the
+        cache grows beyond maxSize bytes.
+    """
+    VERSION = 3                             # change when the layout of the entries changes
+    MAX_SIZE = 4*1024*1024*1024             # default size limit, unit: bytes
+    ARRAYS = ["positions", "frameNumbers", "times", "names", "allNames", "frameText", "timeText", "headerLine", "frameRate"]
+
+    def __init__(self, directory, maxSize=MAX_SIZE):
+        self.directory = directory
+        self.maxSize = maxSize
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def read(self, datafile, mirrorX=1, ignoredMarkers=[], reader=readMoCapCSV):
+        """
+            Returns the MoCapRawData of the given logfile from the cache.
+            If it is not cached yet, it is parsed with the given reader and stored.
+        """
+        key = self.key(datafile, mirrorX, ignoredMarkers)
+        rawData = self.load(key)
+        if rawData is None:
+            rawData = reader(datafile, mirrorX, ignoredMarkers)
+            self.store(key, rawData, datafile)
+        return rawData
+
+    def key(self, datafile, mirrorX=1, ignoredMarkers=[]):
+        """
+            The cache key: hash of the file content and the parse options
+        """
+        options = repr((self.VERSION, int(mirrorX), sorted(ignoredMarkers)))
+        return hashlib.sha1(self._contentHash(datafile) + options).hexdigest()
+
+    def load(self, key):
+        """
+            Returns the cached MoCapRawData for the given key, or None.
+            The arrays are memory mapped read-only.
+        """
+        entry = os.path.join(self.directory, key)
+        if not os.path.exists(os.path.join(entry, "info.json")):
+            return None
+        arrays = {}
+        for name in self.ARRAYS:
+            arrays[name] = np.load(os.path.join(entry, name + ".npy"), mmap_mode='r')
+        os.utime(os.path.join(entry, "info.json"), None)     #mark as recently used
+        frameRate = float(arrays["frameRate"][0])
+        return MoCapRawData(arrays["names"].tolist(),
+                            arrays["positions"],
+                            arrays["frameNumbers"],
+                            arrays["times"],
+                            arrays["allNames"].tolist(),
+                            arrays["frameText"],
+                            arrays["timeText"],
+                            str(arrays["headerLine"][0]),
+                            frameRate if frameRate == frameRate else None)
+
+    def store(self, key, rawData, datafile=""):
+        """
+            Stores the given MoCapRawData under key and evicts old entries if needed.
+        """
+        entry = os.path.join(self.directory, key)
+        tmp = entry + ".tmp%d" % os.getpid()
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "positions.npy"), np.ascontiguousarray(rawData.positions))
+        np.save(os.path.join(tmp, "frameNumbers.npy"), rawData.frameNumbers)
+        np.save(os.path.join(tmp, "times.npy"), rawData.times)
+        np.save(os.path.join(tmp, "names.npy"), np.array(rawData.names))
+        np.save(os.path.join(tmp, "allNames.npy"), np.array(rawData.allNames))
+        np.save(os.path.join(tmp, "frameText.npy"), rawData.frameText)
+        np.save(os.path.join(tmp, "timeText.npy"), rawData.timeText)
+        np.save(os.path.join(tmp, "headerLine.npy"), np.array([rawData.headerLine]))
+        np.save(os.path.join(tmp, "frameRate.npy"), np.array([rawData.frameRate or np.nan], dtype=float))
+        info = {"source": os.path.abspath(datafile) if datafile else "",
+                "size": self._entrySize(tmp),
+                "created": time.time()}
+        f = open(os.path.join(tmp, "info.json"), 'w')
+        json.dump(info, f)
+        f.close()
+
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.rename(tmp, entry)
+        self.evict(keep=key)
+
+    def invalidate(self, datafile=None):
+        """
+            Removes all entries of the given logfile (for all parse options),
+            or the whole cache if no logfile is given.
+        """
+        source = os.path.abspath(datafile) if datafile else None
+        for key, info in self.entries():
+            if source is None or info["source"] == source:
+                shutil.rmtree(os.path.join(self.directory, key))
+        index = self._readIndex()
+        if source is None:
+            index = {}
+        else:
+            index.pop(source, None)
+        self._writeIndex(index)
+
+    def evict(self, keep=None):
+        """
+            Removes least recently used entries until the cache is smaller than maxSize.
+        """
+        entries = self.entries()
+        total = sum(info["size"] for _, info in entries)
+        for key, info in entries:
+            if total <= self.maxSize:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key))
+            total -= info["size"]
+
+    def entries(self):
+        """
+            Returns a list of (key, info) of all cached takes, least recently used first
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            infofile = os.path.join(self.directory, key, "info.json")
+            if ".tmp" in key or not os.path.exists(infofile):
+                continue
+            f = open(infofile, 'r')
+            info = json.load(f)
+            f.close()
+            entries.append((os.path.getmtime(infofile), key, info))
+        entries.sort()
+        return [(key, info) for _, key, info in entries]
+
+    def size(self):
+        return sum(info["size"] for _, info in self.entries())
+
+    def _contentHash(self, datafile):
+        """
+            SHA-1 of the file content. Remembered per file (path, size, modification time)
+            so that unchanged files are not hashed again.
+        """
+        source = os.path.abspath(datafile)
+        stat = os.stat(datafile)
+        signature = [stat.st_size, stat.st_mtime]
+        index = self._readIndex()
+        if source in index and index[source][0:2] == signature:
+            return str(index[source][2])
+
+        sha = hashlib.sha1()
+        f = open(datafile, 'rb')
+        chunk = f.read(1 << 20)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(1 << 20)
+        f.close()
+        contentHash = sha.hexdigest()
+
+        index[source] = signature + [contentHash]
+        self._writeIndex(index)
+        return contentHash
+
+    def _readIndex(self):
+        indexfile = os.path.join(self.directory, "index.json")
+        if not os.path.exists(indexfile):
+            return {}
+        f = open(indexfile, 'r')
+        try:
+            index = json.load(f)
+        except ValueError:
+            index = {}
+        f.close()
+        return index
+
+    def _writeIndex(self, index):
+        indexfile = os.path.join(self.directory, "index.json")
+        f = open(indexfile + ".tmp%d" % os.getpid(), 'w')
+        json.dump(index, f)
+        f.close()
+        os.rename(indexfile + ".tmp%d" % os.getpid(), indexfile)
+
+    def _entrySize(self, entry):
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
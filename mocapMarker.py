@@ -26,38 +26,201 @@
  OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
  """
 import types
+import bisect
 import numpy as np
 import helper
 from array import array
 from numpy.f2py.auxfuncs import throw_error
 
-class MoCapMarker:
+class MoCapLabelTable(object):
+    """
+        Table of marker names shared by all markers, so that the name a marker was
+        labeled with at every frame can be stored as an integer code.
+    """
+    def __init__(self, names=[]):
+        self.names = []     # String[]: name of every code
+        self.codes = {}     # {String:int}
+        for name in names:
+            self.code(name)
+
+    def code(self, name):
+        """
+            Returns the code of the given name, adds it to the table if it is new
+        """
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.codes[name] = code
+            self.names.append(name)
+        return code
+
+    def name(self, code):
+        return self.names[code]
+
+
+class RelabelHistory(object):
+    """
+        The label (code into a MoCapLabelTable) of a marker at every frame, stored run-length
+        encoded: interval i covers the frames [starts[i], starts[i+1]) (the last one up to
+        the number of frames) and has the label codes[i]. Neighboring intervals always have
+        different labels, so every interval but the first starts with a relabel event.
+    """
+    def __init__(self):
+        self.starts = []    # int[]: first frame of every interval
+        self.codes = []     # int[]: label of every interval
+        self.length = 0     # number of frames
+
+    def append(self, code):
+        """
+            Adds a frame with the given label
+        """
+        if not self.codes or self.codes[-1] != code:
+            self.starts.append(self.length)
+            self.codes.append(code)
+        self.length += 1
+
+    def extend(self, code, count):
+        """
+            Adds count frames with the given label
+        """
+        if count <= 0:
+            return
+        if not self.codes or self.codes[-1] != code:
+            self.starts.append(self.length)
+            self.codes.append(code)
+        self.length += count
+
+    def pop(self):
+        """
+            Removes the last frame
+        """
+        self.length -= 1
+        if self.starts[-1] == self.length:
+            del self.starts[-1]
+            del self.codes[-1]
+
+    def _index(self, frame):
+        """
+            index of the interval containing the frame, negative frames count from the end
+        """
+        if frame < 0:
+            frame += self.length
+        if frame < 0 or frame >= self.length:
+            raise IndexError("frame " + str(frame) + " out of range")
+        return bisect.bisect_right(self.starts, frame) - 1
+
+    def codeAt(self, frame):
+        return self.codes[self._index(frame)]
+
+    def set(self, frame, code):
+        """
+            Changes the label of a single frame
+        """
+        i = self._index(frame)
+        if frame < 0:
+            frame += self.length
+        if self.codes[i] == code:
+            return
+        end = self.starts[i+1] if i+1 < len(self.starts) else self.length
+        #split the interval into [start, frame), [frame, frame+1), [frame+1, end)
+        starts = [frame]
+        codes = [code]
+        if frame+1 < end:
+            starts.append(frame+1)
+            codes.append(self.codes[i])
+        if self.starts[i] < frame:
+            self.starts[i+1:i+1] = starts
+            self.codes[i+1:i+1] = codes
+            i += 1
+        else:
+            self.starts[i:i+1] = starts
+            self.codes[i:i+1] = codes
+        #merge with neighbors that have the same label
+        if i+1 < len(self.codes) and self.codes[i+1] == code:
+            del self.starts[i+1]
+            del self.codes[i+1]
+        if i > 0 and self.codes[i-1] == code:
+            del self.starts[i]
+            del self.codes[i]
+
+    def eventsBetween(self, begin, end):
+        """
+            Returns all relabel events at frames begin <= frame <= end
+            as list of (frame, old label, new label)
+        """
+        first = max(bisect.bisect_left(self.starts, begin), 1)
+        last = bisect.bisect_right(self.starts, end)
+        return [(self.starts[i], self.codes[i-1], self.codes[i]) for i in range(first, last)]
+
+    def toArray(self):
+        """
+            Returns the intervals as (intervals x 3) int32 np.array of start frame,
+            end frame (exclusive) and label
+        """
+        array = np.empty((len(self.starts), 3), dtype=np.int32)
+        array[:, 0] = self.starts
+        array[:-1, 1] = self.starts[1:]
+        array[-1:, 1] = self.length
+        array[:, 2] = self.codes
+        return array
+
+    @staticmethod
+    def fromArray(array):
+        history = RelabelHistory()
+        array = np.asarray(array)
+        history.starts = array[:, 0].tolist()
+        history.codes = array[:, 2].tolist()
+        history.length = int(array[-1, 1]) if len(array) else 0
+        return history
+
+    def toCodes(self):
+        """
+            Returns the label of every frame as int32 np.array
+        """
+        array = self.toArray()
+        return np.repeat(array[:, 2], array[:, 1] - array[:, 0])
+
+
+class MoCapMarker(object):
     """
         Stores the data of one marker.
+        Positions are kept in a preallocated (frames x 3) np.array that grows if needed,
+        NaN for missing frames. The name the marker was labeled with at every frame is
+        kept as code into a MoCapLabelTable, run-length encoded in a RelabelHistory.
+        Missing frames are kept as boolean array (constant time lookup) and as sorted
+        list of gaps [start, end) of consecutive missing frames (logarithmic lookup).
+        For streaming, the frames before a given frame can be dropped from the arrays (see trim),
+        the names and gaps are kept for all frames.
     """
     MIN =  10000000.0
     MAX = -10000000.0
     ERROR = '-9999.99'
-    def __init__(self, identifier, firstFrame, lastFrame, currentName=None):
+    INITIAL_CAPACITY = 1024
+    def __init__(self, identifier, firstFrame, lastFrame, currentName=None, labelTable=None, dtype=np.float64):
         """
             Creates the marker. CurrentName is used when labeling the marker.
+            lastFrame-firstFrame is the number of frames for which space is allocated.
         """
-        self.markerRelabeledTo = {}
-        self.markerLabeledToAtFrame = [] #keeps track of current name for every frame
         #NOTE: assumes to have one parent and one child marker (not mroe)
         self.parentMarker = 0
         self.childMarker = 0
-        self.childVectorAtFrame0 = []
 
         self.name = identifier
-        self.data = [] # a list of lists of xyz values        
-        self.missingFrames = []
+        capacity = max(lastFrame - firstFrame, self.INITIAL_CAPACITY)
+        self._data = np.empty((capacity, 3), dtype=dtype)          # xyz values of every frame, NaN if missing
+        self._length = 0                                            # number of frames filled
+        self._offset = 0                                            # frame of the first row of _data and _missing
+        self.labelTable = labelTable if labelTable is not None else MoCapLabelTable()
+        self.relabelHistory = RelabelHistory()                      # keeps track of the name at every frame
+        self._missing = np.zeros(capacity, dtype=bool)             # True at every missing frame
+        self._gapStarts = []                                        # first frame of every gap, sorted
+        self._gapEnds = []                                          # frame after the last frame of every gap
+        self._gapsByLength = None                                   # (sorted lengths, gap indices), built when needed
         #self.disappearingFrame = -1 #tracks when is the first time that the marker is disappearing for rest of log
         if(currentName != None):
             self.currentName = currentName
         else:
             self.currentName = self.name
-        self.markerRelabeledTo[0] = self.currentName #keeps track of when this marker was relabeled to a new one
 
         self.isFingerMarker = "1" in self.name or "2" in self.name or "3" in self.name or "4" in self.name                
         self.firstFrame = firstFrame
@@ -65,111 +228,303 @@ class MoCapMarker:
         self.offset_keylog = 0
         self.offset_keylog_stdInFrames = 0
 
+    @property
+    def currentName(self):
+        return self._currentName
+
+    @currentName.setter
+    def currentName(self, name):
+        self._currentName = name
+        self._currentCode = self.labelTable.code(name)
+
+    @property
+    def data(self):
+        """
+            (frames x 3) view on the positions of the stored frames, NaN if missing
+        """
+        return self._data[0:self._length-self._offset]
+
+    @property
+    def missingFrames(self):
+        """
+            sorted list of the frames at which the marker is missing
+        """
+        return self.getMissingFrames()
+
+    @property
+    def markerLabeledToAtFrame(self):
+        """
+            the name of the marker at every frame
+        """
+        return [self.labelTable.names[code] for code in self.relabelHistory.toCodes()]
+
     def getname(self):
         return self.name
 
     def getNameAtFrame(self, frame):
-        return self.markerLabeledToAtFrame[frame]
+        return self.labelTable.names[self.relabelHistory.codeAt(frame)]
 
     def append(self, x,y=0,z=0):
         """
             Note: when calling this method, first rename (= call setCurrentName), then append!
         """
-        self.markerLabeledToAtFrame.append(self.currentName)
-        if type(x) == types.ListType:
-            self.data.append(x)
+        row = self._length - self._offset
+        if row == len(self._data):
+            self._grow()
+        self.relabelHistory.append(self._currentCode)
+        if type(x) == types.ListType or type(x) == np.ndarray:
+            if len(x) == 0:
+                self._data[row] = np.nan
+            else:
+                self._data[row] = x
         else:
             if (x == self.ERROR or
                 y == self.ERROR or
                 z == self.ERROR):
-                self.data.append([])
-                #if(self.disappearingFrame == -1):
-                    #marker disappears for the first time.
-                #    self.disappearingFrame = len(self.data)
-
+                self._data[row] = np.nan
             else:
-                self.data.append( [float(x),
-                                   float(y),
-                                   float(z)] )
-                #if(self.disappearingFrame >= 0):
-                    #reset disappearing frame, as the marker reappears.
-                #    self.disappearingFrame = -1
+                self._data[row] = [float(x),
+                                            float(y),
+                                            float(z)]
+        self._length += 1
+
+    def appendBlock(self, positions):
+        """
+            Appends the (frames x 3) np.array of positions (NaN if missing) with the current name
+        """
+        count = len(positions)
+        row = self._length - self._offset
+        while row + count > len(self._data):
+            self._grow()
+        self._data[row:row+count] = positions
+        self.relabelHistory.extend(self._currentCode, count)
+        self._length += count
+
+    def _grow(self):
+        capacity = 2*len(self._data)
+        data = np.empty((capacity, 3), dtype=self._data.dtype)
+        data[0:self._length-self._offset] = self._data[0:self._length-self._offset]
+        self._data = data
+        self._growMissing(capacity)
+
+    def _growMissing(self, capacity):
+        if capacity > len(self._missing):
+            missing = np.zeros(capacity, dtype=bool)
+            missing[0:len(self._missing)] = self._missing
+            self._missing = missing
+
+    def trim(self, frame):
+        """
+            Drops the positions and the missing flags of the frames before the given frame, e.g. after they
+            were written out. getdata returns [] for those frames, gaps and names are kept.
+        """
+        count = min(frame, self._length) - self._offset
+        if count <= 0:
+            return
+        rows = self._length - self._offset
+        self._data[0:rows-count] = self._data[count:rows]
+        self._missing[0:len(self._missing)-count] = self._missing[count:]
+        self._missing[len(self._missing)-count:] = False
+        self._offset += count
+
+    def getFirstStoredFrame(self):
+        """
+            Returns the first frame whose position is stored (0 unless trimmed)
+        """
+        return self._offset
 
     def deleteLastDataFrame(self):
-        if len(self.data) in self.markerRelabeledTo.keys():
-            #Reset name
-            self.markerRelabeledTo.pop(len(self.data))
-            self.currentName = self.markerLabeledToAtFrame[len(self.data)-1]
-        del self.data[-1]
-        del self.markerLabeledToAtFrame[-1]
+        if self.currentName != self.getNameAtFrame(self._length-1):
+            #Reset name that was set for the next frame
+            self.currentName = self.getNameAtFrame(self._length-1)
+        self.relabelHistory.pop()
+        self._length -= 1
 
 
     def getdata(self, frame):
-        if len(self.data) == 0:
+        """
+            returns the position at the given frame as list [x, y, z], or [] if there is no data
+        """
+        if frame >= self._length or frame < -self._length:
+            return []
+        if frame < 0:
+            frame += self._length
+        if frame < self._offset:
             return []
+        position = self._data[frame-self._offset].tolist()
+        if position[0] != position[0]:
+            #NaN
+            return []
+        return position
+
+    def setdata(self, frame, position):
+        """
+            overwrites the position at the given (already filled) frame, [] for no data
+        """
+        if frame >= 0:
+            frame -= self._offset
+        if len(position) == 0:
+            self.data[frame] = np.nan
         else:
-            try:
-                return self.data[frame]
-            except IndexError:
-                return []
+            self.data[frame] = position
 
     def getDataToString(self, frame, sep="\t"):
         """
             returns a string as needed for writing the data to file.
         """
-        if len(self.data) == 0:
+        if self._length == 0:
             return []
         else:
-            framedata = self.data[frame]
+            framedata = self.getdata(frame)
             if framedata == []:
                 return sep+sep+sep
             else:
                 return sep + "{:f}".format(framedata[0])+ sep +"{:f}".format(framedata[1] )+ sep + "{:f}".format(framedata[2])
 
 
+    def getDataArray(self):
+        """
+            returns the data of all frames as (frames x 3) np.array, NaN if missing (not a copy).
+            If the marker was trimmed, the array starts at getFirstStoredFrame()
+        """
+        return self.data
+
+    def getLabelCodes(self):
+        """
+            returns the codes (see labelTable) of the name at every frame as np.array
+        """
+        return self.relabelHistory.toCodes()
+
     def getBbox(self):
-        minx = miny = minz = MoCapMarker.MIN
-        maxx = maxy = maxz = MoCapMarker.MAX
-        if len(self.data) == 0:
+        if self._length == 0:
             return []
-        for coords in self.data:
-            if len(coords) == 0:
-                return []
-            minx = min(minx, coords[0])
-            miny = min(miny, coords[1])
-            minz = min(minz, coords[2])
-            maxx = max(maxx, coords[0])
-            maxy = max(maxy, coords[1])
-            maxz = max(maxz, coords[2])
-        return [minx,miny,minz,maxx,maxy,maxz]
+        if np.isnan(self.data).any():
+            return []
+        minimum = self.data.min(axis=0)
+        maximum = self.data.max(axis=0)
+        return [minimum[0], minimum[1], minimum[2], maximum[0], maximum[1], maximum[2]]
 
     def addMissingFrame(self, frame):
-        self.missingFrames.append(frame)
+        if self.isMissingFrame(frame):
+            return
+        if frame >= self._offset:
+            row = frame - self._offset
+            if row >= len(self._missing):
+                self._growMissing(max(2*len(self._missing), row+1))
+            self._missing[row] = True
+        self._gapsByLength = None
+
+        #extend the gap before and/or after the frame, or insert a new gap
+        i = bisect.bisect_right(self._gapStarts, frame)
+        joinsPrevious = i > 0 and self._gapEnds[i-1] == frame
+        joinsNext = i < len(self._gapStarts) and self._gapStarts[i] == frame+1
+        if joinsPrevious and joinsNext:
+            self._gapEnds[i-1] = self._gapEnds[i]
+            del self._gapStarts[i]
+            del self._gapEnds[i]
+        elif joinsPrevious:
+            self._gapEnds[i-1] = frame+1
+        elif joinsNext:
+            self._gapStarts[i] = frame
+        else:
+            self._gapStarts.insert(i, frame)
+            self._gapEnds.insert(i, frame+1)
+
+    def removeMissingFrames(self, frames):
+        """
+            Marks the given stored frames as not missing, e.g. after their positions were recovered
+        """
+        rows = np.asarray(frames, dtype=int) - self._offset
+        stored = self.getMissingArray()
+        stored[rows] = False
+        self._gapsByLength = None
+
+        #gaps of the stored frames from the flags, the dropped frames keep theirs
+        i = bisect.bisect_right(self._gapEnds, self._offset)
+        padded = np.concatenate([[False], stored, [False]])
+        changes = np.flatnonzero(padded[1:] != padded[:-1]) + self._offset
+        starts = changes[0::2].tolist()
+        ends = changes[1::2].tolist()
+        if i < len(self._gapStarts) and self._gapStarts[i] < self._offset:
+            #the gap continues before the stored frames
+            if starts and starts[0] == self._offset:
+                starts[0] = self._gapStarts[i]
+            else:
+                starts.insert(0, self._gapStarts[i])
+                ends.insert(0, self._offset)
+        self._gapStarts[i:] = starts
+        self._gapEnds[i:] = ends
 
     def getMissingFrames(self):
-        return self.missingFrames
+        return [frame for start, end in zip(self._gapStarts, self._gapEnds) for frame in range(start, end)]
+
+    def getMissingArray(self):
+        """
+            returns a boolean np.array that is True at every missing frame (not a copy).
+            If the marker was trimmed, the array starts at getFirstStoredFrame()
+        """
+        return self._missing[0:max(self._length, self._gapEnds[-1] if self._gapEnds else 0)-self._offset]
 
     def isMissingFrame(self, frame):
-        return frame in self.missingFrames
+        if frame < self._offset:
+            #dropped from the array, look up the gaps
+            i = bisect.bisect_right(self._gapStarts, frame) - 1
+            return i >= 0 and frame < self._gapEnds[i]
+        return frame - self._offset < len(self._missing) and bool(self._missing[frame-self._offset])
     
     def getMissingTimeUntilFrame(self,frame):
         """
             For a given frame returns for how many frames this marker was missing up to that frame            
         """
-        f = frame-1
-        #compute number of continuously missing frames
-        while self.isMissingFrame(f):
-            f-=1
-        return frame-(f+1)
+        #the gap containing the previous frame, if any
+        i = bisect.bisect_right(self._gapStarts, frame-1) - 1
+        if i < 0 or self._gapEnds[i] <= frame-1:
+            return 0
+        return frame - self._gapStarts[i]
+
+    def getGaps(self, minLength=1):
+        """
+            Returns all gaps of at least minLength consecutive missing frames
+            as list of (first frame, number of frames), ordered by frame.
+        """
+        if minLength <= 1:
+            return [(start, end-start) for start, end in zip(self._gapStarts, self._gapEnds)]
+        if self._gapsByLength is None:
+            lengths = np.array(self._gapEnds, dtype=np.int64) - np.array(self._gapStarts, dtype=np.int64)
+            order = np.argsort(lengths, kind="mergesort")
+            self._gapsByLength = (lengths[order], order)
+        lengths, order = self._gapsByLength
+        indices = np.sort(order[np.searchsorted(lengths, minLength):])
+        return [(self._gapStarts[i], self._gapEnds[i]-self._gapStarts[i]) for i in indices]
 
     def setCurrentName(self, name, frame):
+        """
+            Sets the name the marker is labeled with from the given frame on (see append)
+        """
         if self.currentName != name:
             self.currentName = name
-            self.markerRelabeledTo[frame] = name
 
+    def setNameAtFrame(self, frame, name):
+        """
+            Changes the name of a single (already filled) frame, the current name is not changed
+        """
+        self.relabelHistory.set(frame, self.labelTable.code(name))
 
     def getAllLabels(self):
-        return self.markerLabeledTo
+        """
+            Returns the names the marker was labeled with as list of (first frame, last frame, name)
+        """
+        return [(start, end-1, self.labelTable.names[code]) for start, end, code in self.relabelHistory.toArray()]
+
+    def getRelabelEvents(self, begin=0, end=-1):
+        """
+            Returns all relabel events at frames begin <= frame <= end (end=-1: until the last frame)
+            as list of (frame, old name, new name)
+        """
+        if end < 0:
+            end = self._length
+        names = self.labelTable.names
+        return [(frame, names[old], names[new]) for frame, old, new in self.relabelHistory.eventsBetween(begin, end)]
 
     def setChildMarker(self, marker):
         self.childMarker = marker
@@ -184,47 +539,19 @@ class MoCapMarker:
         return self.parentMarker
 
     def getMarkerRelabeledTo(self):
-        return self.markerRelabeledTo
+        """
+            Returns a dict from every frame at which the marker was relabeled (and 0) to the new name
+        """
+        return dict((start, self.labelTable.names[code]) for start, code in zip(self.relabelHistory.starts, self.relabelHistory.codes))
 
     def isMarkerRelabledAt(self, frame):
-        return self.markerLabeledToAtFrame[frame] != self.markerLabeledToAtFrame[frame-1]
+        return self.relabelHistory.codeAt(frame) != self.relabelHistory.codeAt(frame-1)
 
     def getMeanPosition(self):
         """
             Computes the average position over all frames.
         """
-        x_mean = np.mean(np.array([v[0] for v in self.data]))
-        y_mean = np.mean(np.array([v[1] for v in self.data]))
-        z_mean = np.mean(np.array([v[2] for v in self.data]))
-        return [x_mean, y_mean, z_mean]
-    
-    def getChildVector(self, frame):
-        """
-            Returns a (np.array) vector from child marker to this marker 
-            or [] if this marker has no child marker or the current position is missing
-        """
-        vector = []
-        if self.childVectorAtFrame0 != []:
-            return self.childVectorAtFrame0
-        else:
-            own_pos = np.array(self.getdata(frame))
-            if own_pos != [] and self.childMarker != 0:
-                vector = own_pos - np.array(self.childMarker.getdata(frame))
-                self.childVectorAtFrame = vector     #save to speed up later use.
-        return vector
-    
-    def getParentVector(self, frame):
-        """
-            Returns a (np.array) vector from parent marker to this marker
-            or [] if this marker has no parent marker or the current position is missing
-        """
-        vector = []
-        own_pos = self.getdata(frame)
-        if own_pos != [] and self.parentMarker != 0:
-            vector = own_pos - np.array(self.parentMarker.getdata(frame))            
-        return vector
-            
-        self.childMarker.getdata(frame)
+        return np.mean(self.data, axis=0).tolist()
     
     def plotAtFrame(self, ax, frame, logtext, debug=0):
         #remapped?
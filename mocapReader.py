@@ -0,0 +1,300 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+import os
+import json
+import numpy as np
+
+
+class MoCapRawData:
+    """
+        Stores the raw (unlabeled) data of a take as one array of shape
+        (frames x columns x 3). Missing positions are NaN.
+    """
+    def __init__(self, names, positions, frameNumbers, times, allNames=None,
+                 frameText=None, timeText=None, headerLine="", frameRate=None, offset=0):
+        self.names = names                                                      # String[]: marker name of every column in positions
+        self.allNames = allNames if allNames is not None else names             # String[]: all marker names in the logfile, including ignored ones
+        self.positions = positions                                              # np.array (frames x columns x 3)
+        self.frameNumbers = frameNumbers                                        # np.array (frames) with the frame number of every row
+        self.times = times                                                      # np.array (frames) with the time of every row
+        self.frames = positions.shape[0]
+        # Frame and Time columns as written in the logfile, reused when writing the labeled data
+        if frameText is None:
+            frameText = np.array([str(f) for f in frameNumbers])
+        if timeText is None:
+            timeText = np.array(["{:f}".format(t) for t in times])
+        self.frameText = frameText
+        self.timeText = timeText
+        self.headerLine = headerLine                                            # first line of the logfile, including the line break
+        self.frameRate = frameRate                                              # capture frame rate in Hz, None if unknown
+        self.offset = offset                                                    # frame (row of the take) of the first row, if only a block of the take is read
+
+    def getFrame(self, frame):
+        """
+            Output: {String:[array]}
+            Dictionary from marker name to position at given frame, [] if the marker has no data
+        """
+        rawdata = {}
+        for name, datapoint in zip(self.names, self.positions[frame-self.offset].tolist()):
+            if datapoint[0] != datapoint[0]:
+                #NaN, no data for this marker
+                datapoint = []
+            rawdata[name] = datapoint
+        return rawdata
+
+    def getColumnIndex(self, name):
+        return self.names.index(name)
+
+
+class LabeledData:
+    """
+        Labeled data of a take as written by MoCapLabeledDB.writeOutBinary
+    """
+    def __init__(self, markerNames, sourceNames, positions, missing, sources, frameNumbers, times):
+        self.markerNames = markerNames                                          # String[]: name of every marker
+        self.sourceNames = sourceNames                                          # String[]: marker names of the logfile
+        self.positions = positions                                              # np.array (frames x markers x 3), NaN if no data
+        self.missing = missing                                                  # np.array (frames x markers), True if the marker was missing
+        self.sources = sources                                                  # np.array (frames x markers), index into sourceNames
+        self.frameNumbers = frameNumbers
+        self.times = times
+        self.frames = positions.shape[0]
+
+    def getMarker(self, name):
+        """
+            Returns the (frames x 3) positions of the given marker
+        """
+        return self.positions[:, self.markerNames.index(name)]
+
+    def getSourceName(self, name, frame):
+        """
+            Returns the name of the logfile marker the given marker was labeled from at the given frame
+        """
+        return self.sourceNames[self.sources[frame, self.markerNames.index(name)]]
+
+
+def readLabeledBinary(filename, mmap=1):
+    """
+        Reads labeled data written with writeLabeledBinary (.npz file or directory of .npy files).
+        The arrays of the directory format are memory mapped (read-only) if mmap is set.
+    """
+    if os.path.isdir(filename):
+        f = open(os.path.join(filename, "header.json"), 'r')
+        header = json.load(f)
+        f.close()
+        arrays = {}
+        for name, description in header["arrays"].items():
+            arrays[str(name)] = np.load(os.path.join(filename, description["file"]),
+                                        mmap_mode='r' if mmap else None)
+        markerNames = [str(n) for n in header["markerNames"]]
+        sourceNames = [str(n) for n in header["sourceNames"]]
+    else:
+        npz = np.load(filename)
+        arrays = dict((name, npz[name]) for name in npz.files)
+        markerNames = arrays.pop("markerNames").tolist()
+        sourceNames = arrays.pop("sourceNames").tolist()
+    return LabeledData(markerNames, sourceNames,
+                       arrays["positions"], arrays["missing"], arrays["sources"],
+                       arrays["frameNumbers"], arrays["times"])
+
+
+#------------------------------------------------------------------------------
+# CSV logfiles
+#------------------------------------------------------------------------------
+
+HEADER_LINES = 7        # number of header lines before the first frame
+NAME_LINE = 3           # the 4th header line contains the marker names
+BLOCK_SIZE = 10000      # number of lines that are parsed at once
+
+
+def readMoCapCSV(datafile, mirrorX=1, ignoredMarkers=[]):
+    """
+        Reads the given logfile into a MoCapRawData object.
+        The delimiter and the header layout are determined once, then the numeric
+        data is parsed block by block into a preallocated array.
+        Empty cells are NaN, a position is missing if any of its coordinates is missing.
+        Mirrors x component if requested. Columns of ignored markers are dropped.
+    """
+    f = open(datafile, 'r')
+    text = f.read()
+    f.close()
+    data_in = text.splitlines()
+    headerLine = text[0:text.find('\n')+1] if '\n' in text else text
+    del text
+
+    allNames, frameRate = _parseHeader(data_in, headerLine)
+
+    lines = data_in[HEADER_LINES:]
+    while len(lines) > 0 and lines[-1].strip() == "":
+        del lines[-1]
+
+    return _toRawData(lines, _separator(lines), allNames, ignoredMarkers, mirrorX, headerLine, frameRate)
+
+
+class MoCapStreamReader:
+    """
+        Reads a logfile block by block, for labeling takes that do not fit into memory:
+            reader = MoCapStreamReader(datafile)
+            block = reader.readBlock()      # MoCapRawData of the next frames, None at the end
+        The frames of a block are numbered by their row in the whole take (see MoCapRawData.offset).
+    """
+    def __init__(self, datafile, mirrorX=1, ignoredMarkers=[], blockSize=BLOCK_SIZE):
+        self.mirrorX = mirrorX
+        self.ignoredMarkers = ignoredMarkers
+        self.blockSize = blockSize
+        self.file = open(datafile, 'r')
+        header = [self.file.readline() for _ in range(HEADER_LINES)]
+        self.headerLine = header[0]
+        self.allNames, self.frameRate = _parseHeader([line.rstrip('\r\n') for line in header], self.headerLine)
+        self.names = [n for n in self.allNames if not n in ignoredMarkers]
+
+        #count the frames without keeping them
+        start = self.file.tell()
+        self.frames = 0
+        for line in self.file:
+            if line.strip() != "":
+                self.frames += 1
+        self.file.seek(start)
+        self.framesRead = 0
+        self.sep = None
+
+    def readBlock(self):
+        """
+            Returns the MoCapRawData of the next blockSize frames, None if all frames were read
+        """
+        lines = []
+        while len(lines) < self.blockSize and self.framesRead + len(lines) < self.frames:
+            line = self.file.readline()
+            if line == "":
+                break
+            line = line.rstrip('\r\n')
+            if line.strip() != "":
+                lines.append(line)
+        if len(lines) == 0:
+            return None
+        if self.sep is None:
+            self.sep = _separator(lines)
+        block = _toRawData(lines, self.sep, self.allNames, self.ignoredMarkers, self.mirrorX,
+                           self.headerLine, self.frameRate, self.framesRead)
+        self.framesRead += len(lines)
+        return block
+
+    def close(self):
+        self.file.close()
+
+
+def _parseHeader(headerLines, headerLine):
+    """
+        Returns the marker names of all columns (from the fourth line) and the frame rate
+        (from the first line, None if not given)
+    """
+    items = headerLines[NAME_LINE].split(',')[2:]  #the first two columns are Frame and Time
+    allNames = items[0::3]
+
+    #the first line may contain the frame rate
+    frameRate = None
+    cells = headerLine.strip().split(',')
+    if "Capture Frame Rate" in cells[0:-1]:
+        try:
+            frameRate = float(cells[cells.index("Capture Frame Rate")+1])
+        except ValueError:
+            pass
+    return allNames, frameRate
+
+
+def _separator(lines):
+    if len(lines) > 0 and lines[0].count('\t') > lines[0].count(','):
+        return '\t'
+    return ','
+
+
+def _toRawData(lines, sep, allNames, ignoredMarkers, mirrorX, headerLine, frameRate, offset=0):
+    """
+        Parses the given data lines into a MoCapRawData object
+    """
+    ncols = 2 + 3*len(allNames)
+    data = np.empty((len(lines), ncols))
+    for start in range(0, len(lines), BLOCK_SIZE):
+        block = lines[start:start+BLOCK_SIZE]
+        data[start:start+len(block)] = _parseBlock(block, sep, ncols)
+
+    frameText = np.empty(len(lines), dtype=object)
+    timeText = np.empty(len(lines), dtype=object)
+    for i in range(len(lines)):
+        frameText[i], timeText[i] = lines[i].split(sep, 2)[0:2]
+
+    keep = [i for i in range(len(allNames)) if not allNames[i] in ignoredMarkers]
+    positions = data[:, 2:].reshape((len(lines), len(allNames), 3))
+    if len(keep) < len(allNames):
+        positions = positions[:, keep]
+    positions[np.isnan(positions).any(axis=2)] = np.nan
+    if mirrorX:
+        positions[:, :, 0] *= -1
+
+    return MoCapRawData([allNames[i] for i in keep],
+                        positions,
+                        data[:, 0].astype(int),
+                        data[:, 1].copy(),
+                        allNames,
+                        frameText.astype(str),
+                        timeText.astype(str),
+                        headerLine,
+                        frameRate,
+                        offset)
+
+
+def _parseBlock(lines, sep, ncols):
+    """
+        Parses the given lines into a (lines x ncols) array in one go.
+        Empty cells are filled with "nan" so that every line has the same number of values.
+    """
+    text = ','.join(lines)
+    if sep != ',':
+        text = text.replace(sep, ',')
+    #fill runs of empty cells (needs two passes as the replacements do not overlap)
+    text = text.replace(',,', ',nan,').replace(',,', ',nan,')
+    if text.endswith(','):
+        text = text + 'nan'
+    values = np.fromstring(text, sep=',')
+    if values.size != len(lines)*ncols:
+        #lines of different length, parse line by line
+        return _parseLines(lines, sep, ncols)
+    return values.reshape((len(lines), ncols))
+
+
+def _parseLines(lines, sep, ncols):
+    """
+        Slow fallback for irregular lines: cells are padded with NaN or cut off after ncols.
+    """
+    data = np.empty((len(lines), ncols))
+    data.fill(np.nan)
+    for i in range(len(lines)):
+        cells = lines[i].split(sep)[0:ncols]
+        data[i, 0:len(cells)] = [float(c) if c.strip() != "" else np.nan for c in cells]
+    return data
@@ -0,0 +1,268 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+import os
+import json
+import numpy as np
+
+BLOCK_SIZE = 5000           # number of rows that are formatted and written at once
+BUFFER_SIZE = 1 << 22       # file buffer, unit: bytes
+
+
+def writeLabeledCSV(filename, headerLine, names, frameText, timeText, markerData, blockSize=BLOCK_SIZE):
+    """
+        Writes the labeled data in the same format as the original logfile.
+        Input:
+            headerLine: first line of the original logfile (including line break)
+            names: marker names, one per entry of markerData
+            frameText, timeText: Frame and Time column as in the original logfile
+            markerData: list of (frames x 3) np.arrays, NaN if missing
+
+        Rows are formatted block by block with a single format operation,
+        coordinates as "{:f}" and missing markers as empty cells.
+    """
+    writer = LabeledCSVWriter(filename, headerLine, names)
+    frames = len(frameText)
+    for start in range(0, frames, blockSize):
+        end = min(frames, start + blockSize)
+        writer.writeRows(frameText[start:end], timeText[start:end],
+                         [data[start:end] for data in markerData])
+    writer.close()
+
+
+class LabeledCSVWriter:
+    """
+        Writes the labeled data row by row (see writeLabeledCSV), for takes that are labeled
+        while they are read:
+            writer = LabeledCSVWriter(filename, headerLine, names)
+            writer.writeRows(frameText, timeText, markerData)    # as often as needed
+            writer.close()
+    """
+    def __init__(self, filename, headerLine, names):
+        self.file = open(filename, 'w', BUFFER_SIZE)
+
+        #Header from original file and marker names
+        self.file.write(headerLine + "\n" + "\n")
+        markerline = "," + "".join(["," + n + "," + n + "," + n for n in names])
+        columnline = "Frame, Time" + ",X,Y,Z"*len(names)
+        self.file.write(markerline + "\n")
+        self.file.write("\n\n")
+        self.file.write(columnline + "\n")
+        self.rowformat = "%s,%s" + ",%f,%f,%f"*len(names) + "\n"
+
+    def writeRows(self, frameText, timeText, markerData):
+        """
+            Writes the given frames: Frame and Time column as in the logfile and
+            one (frames x 3) np.array per marker, NaN if missing
+        """
+        if len(frameText) > 0:
+            self.file.write(formatRows(self.rowformat, frameText, timeText, markerData))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def writeLabeledBinary(filename, names, positions, missing, sources, sourceNames, frameNumbers, times, fmt="npy"):
+    """
+        Writes the labeled data in a binary format that keeps the full float precision.
+        Input:
+            names: marker names
+            positions: (frames x markers x 3) np.array, NaN if missing
+            missing: (frames x markers) bool np.array, True if the marker was missing in the log
+            sources: (frames x markers) int np.array, index into sourceNames of the
+                     logfile marker each marker was labeled from at each frame
+            frameNumbers, times: (frames) np.array
+            fmt: "npz" writes a single (compressed) file,
+                 "npy" writes a directory with a header.json describing one .npy file per
+                 array, which readLabeledBinary memory maps without copying.
+    """
+    arrays = {"positions": np.asarray(positions),
+              "missing": np.asarray(missing, dtype=bool),
+              "sources": np.asarray(sources, dtype=np.int32),
+              "frameNumbers": np.asarray(frameNumbers),
+              "times": np.asarray(times)}
+    if fmt == "npz":
+        np.savez_compressed(filename,
+                            markerNames=np.array(names),
+                            sourceNames=np.array(sourceNames),
+                            **arrays)
+    elif fmt == "npy":
+        if not os.path.exists(filename):
+            os.makedirs(filename)
+        header = {"version": 1,
+                  "markerNames": list(names),
+                  "sourceNames": list(sourceNames),
+                  "arrays": {}}
+        for name, array in arrays.items():
+            np.save(os.path.join(filename, name + ".npy"), array)
+            header["arrays"][name] = {"file": name + ".npy",
+                                      "dtype": array.dtype.str,
+                                      "shape": list(array.shape)}
+        f = open(os.path.join(filename, "header.json"), 'w')
+        json.dump(header, f, indent=1)
+        f.close()
+    else:
+        raise ValueError("Unknown binary format: " + str(fmt))
+
+
+def writeGapTable(filename, gaps, frameNumbers, times):
+    """
+        Writes one line per gap of missing frames, for checking the labeling.
+        Input:
+            gaps: list of (marker name, first frame, number of frames), frames are indices
+                  into frameNumbers and times
+            frameNumbers, times: (frames) np.array as in the logfile
+    """
+    f = open(filename, 'w')
+    f.write("Marker,First Frame,Last Frame,Frames,Start Time,End Time\n")
+    for name, start, length in gaps:
+        end = start + length - 1
+        f.write("%s,%d,%d,%d,%f,%f\n" % (name, frameNumbers[start], frameNumbers[end], length,
+                                         times[start], times[end]))
+    f.close()
+
+
+def writeRelabelEvents(filename, events, frameNumbers, times):
+    """
+        Writes one line per relabel event, for checking the labeling.
+        Input:
+            events: list of (frame, marker name, old name, new name), frames are indices
+                    into frameNumbers and times
+            frameNumbers, times: (frames) np.array as in the logfile
+    """
+    f = open(filename, 'w')
+    f.write("Frame,Time,Marker,From,To\n")
+    for frame, name, old, new in events:
+        f.write("%d,%f,%s,%s,%s\n" % (frameNumbers[frame], times[frame], name, old, new))
+    f.close()
+
+
+def formatRows(rowformat, frameText, timeText, markerData):
+    """
+        Formats a block of rows. Missing coordinates (NaN) become empty cells.
+    """
+    rows = len(frameText)
+    values = np.concatenate(markerData, axis=1) if len(markerData) > 0 else np.empty((rows, 0))
+    fields = _formatFloats(values.ravel())
+    if fields is None:
+        #some values do not fit into the fixed width fields
+        return _formatRowsSlow(rowformat, frameText, timeText, markerData)
+
+    columns = values.shape[1]
+    cells = np.empty((rows, columns, 1 + FIELD_WORDS), dtype=np.uint32)
+    cells[:, :, 0] = _word(",")
+    cells[:, :, 1:] = fields.reshape((rows, columns, FIELD_WORDS))
+    line = np.concatenate([_toBytes(frameText),
+                           np.tile(np.uint8(ord(',')), (rows, 1)),
+                           _toBytes(timeText),
+                           cells.reshape((rows, -1)).view(np.uint8),
+                           np.tile(np.uint8(ord('\n')), (rows, 1))], axis=1).ravel()
+    #drop the padding of the fixed width fields
+    return line[line != 0].tostring()
+
+
+def _formatRowsSlow(rowformat, frameText, timeText, markerData):
+    rows = len(frameText)
+    cells = np.empty((rows, 2 + 3*len(markerData)), dtype=object)
+    cells[:, 0] = frameText
+    cells[:, 1] = timeText
+    for i in range(len(markerData)):
+        cells[:, 2+3*i:5+3*i] = markerData[i]
+    return ((rowformat*rows) % tuple(cells.ravel())).replace("nan", "")
+
+
+#------------------------------------------------------------------------------
+# Vectorized "{:f}" formatting. Every value is written into a field of 5 words of
+# 4 bytes: sign | thousands | units | point and first 3 decimals | last 3 decimals,
+# each looked up from a table of the 1000 possible 3 digit groups. Unused bytes
+# are 0 and removed once the whole block is assembled.
+#------------------------------------------------------------------------------
+
+FIELD_WORDS = 5
+MAX_VALUE = 999999.0        # larger values are formatted one by one
+
+
+def _word(text):
+    return np.frombuffer((text + "\0\0\0\0")[0:4], dtype=np.uint32)[0]
+
+def _table(form):
+    return np.array([_word(form(i)) for i in range(1000)], dtype=np.uint32)
+
+_DIGITS = _table(lambda i: "%03d" % i)                      # with leading zeros
+_DIGITS_NOLEAD = _table(lambda i: "%d" % i if i else "")    # without leading zeros, empty for 0
+_DIGITS_UNITS = _table(lambda i: "%d" % i)                  # without leading zeros, "0" for 0
+_DECIMALS = _table(lambda i: ".%03d" % i)
+
+
+def _formatFloats(values):
+    """
+        Formats a 1d array of floats as "{:f}" into an (n x FIELD_WORDS) uint32 array.
+        NaN gives an empty field. Returns None if a value does not fit into a field.
+    """
+    absvalues = np.abs(values)
+    scaled = absvalues * 1e6
+    rounded = np.rint(scaled)
+    #rounding scaled to 6 decimals is exact unless it is close to .5, NaN and inf are False
+    with np.errstate(invalid='ignore'):
+        exact = (absvalues < MAX_VALUE) & (np.abs(scaled - rounded) < 0.499)
+    rounded = np.where(exact, rounded, 0).astype(np.int64)
+    integer = (rounded // 1000000).astype(np.int32)
+    decimals = (rounded - integer.astype(np.int64)*1000000).astype(np.int32)
+    thousands = integer // 1000
+    units = integer - thousands*1000
+    decimals_high = decimals // 1000
+    decimals_low = decimals - decimals_high*1000
+
+    field = np.empty((FIELD_WORDS, len(values)), dtype=np.uint32)
+    field[0] = np.signbit(values) * _word("-")
+    field[1] = np.take(_DIGITS_NOLEAD, thousands)
+    field[2] = np.where(thousands > 0, np.take(_DIGITS, units), np.take(_DIGITS_UNITS, units))
+    field[3] = np.take(_DECIMALS, decimals_high)
+    field[4] = np.take(_DIGITS, decimals_low)
+    field *= exact
+    field = np.ascontiguousarray(field.T)
+
+    text_fields = field.view(np.uint8)
+    for i in np.flatnonzero(~np.isnan(values) & ~exact):
+        text = "{:f}".format(float(values[i]))
+        if len(text) > 4*FIELD_WORDS:
+            return None
+        text_fields[i, 0:len(text)] = np.fromstring(text, dtype=np.uint8)
+    return field
+
+
+def _toBytes(text):
+    """
+        (n) array of strings -> (n x length) uint8 array padded with zero bytes
+    """
+    text = np.asarray(text).astype(str)
+    return text.view(np.uint8).reshape((len(text), -1))
+
@@ -0,0 +1,223 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Nearest neighbor search between the labeled markers and the points of a frame.
+# All backends answer the same query as scipy.spatial.cKDTree.query:
+#     dist, indexes = search.query(points, k)
+# k=1 gives (points) arrays, k>1 (points x k) arrays. If there are less than k neighbors,
+# the remaining entries have distance inf and index len(neighbors).
+
+import numpy as np
+import scipy.spatial
+
+
+def _asPoints(points):
+    """
+        (n x dimensions) float np.array
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim == 2:
+        return points
+    if points.size == 0:
+        return points.reshape(0, 3)
+    return points.reshape(1, -1)
+
+
+class BruteForceSearch(object):
+    """
+        Computes all distances at once. Fastest for the few dozen points of a frame.
+    """
+    def __init__(self, neighbors):
+        self.neighbors = _asPoints(neighbors)
+
+    def query(self, points, k=1):
+        points = _asPoints(points)
+        diff = points[:, np.newaxis, :] - self.neighbors[np.newaxis, :, :]
+        dist = np.einsum('ijk,ijk->ij', diff, diff)
+        n = len(self.neighbors)
+        if k == 1 and n > 0:
+            indexes = dist.argmin(axis=1)
+            dist = np.sqrt(dist[np.arange(len(points)), indexes])
+        else:
+            order = np.argsort(dist, axis=1, kind="mergesort")[:, 0:k]
+            dist = np.sqrt(dist[np.arange(len(points))[:, np.newaxis], order])
+            indexes = order
+            if n < k:
+                dist = np.concatenate([dist, np.full((len(points), k - n), np.inf)], axis=1)
+                indexes = np.concatenate([indexes, np.full((len(points), k - n), n, dtype=indexes.dtype)], axis=1)
+            if k == 1:
+                dist = dist[:, 0]
+                indexes = indexes[:, 0]
+        #points with NaN coordinates have no neighbor
+        unknown = np.isnan(dist)
+        dist[unknown] = np.inf
+        indexes[unknown] = n
+        return dist, indexes
+
+
+class KDTreeSearch(object):
+    """
+        scipy.spatial.cKDTree. Building the tree only pays off for larger numbers of points.
+    """
+    def __init__(self, neighbors):
+        self.neighbors = _asPoints(neighbors)
+        self.tree = scipy.spatial.cKDTree(self.neighbors)
+
+    def query(self, points, k=1):
+        points = _asPoints(points)
+        return self.tree.query(points, k=k)
+
+
+class GridSearch(object):
+    """
+        Uniform grid (spatial hash) for 3d points: the neighbors are sorted by the cell they are in and a point
+        is compared with the neighbors in its own and the 26 surrounding cells. Points whose
+        k-th neighbor is not found within one cell size are searched again with a kd-tree.
+    """
+    OFFSETS = np.array([[x, y, z] for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)])
+    MAX_CELLS_PER_NEIGHBOR = 32     # larger grids are searched in the sorted cell keys instead of a table
+
+    def __init__(self, neighbors, cellSize=None):
+        self.neighbors = _asPoints(neighbors)
+        n = len(self.neighbors)
+        self.origin = self.neighbors.min(axis=0) if n > 0 else np.zeros(3)
+        if cellSize is None:
+            #about one neighbor per cell
+            extent = np.maximum(np.ptp(self.neighbors, axis=0), 1e-6) if n > 0 else np.ones(3)
+            cellSize = (np.prod(extent) / max(n, 1)) ** (1.0/3)
+        self.cellSize = cellSize
+        cells = self._cells(self.neighbors)
+        self.shape = cells.max(axis=0) + 3 if n > 0 else np.ones(3, dtype=np.int64)
+        keys = self._keys(cells)
+        self.order = np.argsort(keys, kind="mergesort")
+        self.keys = keys[self.order]
+        #first neighbor of every cell, as table if the grid is not too sparse
+        self.cellStarts = None
+        cellCount = int(np.prod(self.shape))
+        if cellCount <= self.MAX_CELLS_PER_NEIGHBOR * n + 1000:
+            self.cellStarts = np.zeros(cellCount + 1, dtype=np.intp)
+            np.cumsum(np.bincount(keys, minlength=cellCount), out=self.cellStarts[1:])
+
+    def _cells(self, points):
+        return np.floor((points - self.origin) / self.cellSize).astype(np.int64)
+
+    def _keys(self, cells):
+        cells = cells + 1   # room for the surrounding cells at index -1
+        return (cells[..., 0] * self.shape[1] + cells[..., 1]) * self.shape[2] + cells[..., 2]
+
+    def query(self, points, k=1):
+        points = _asPoints(points)
+        n = len(self.neighbors)
+        m = len(points)
+        dist = np.full((m, k), np.inf)
+        indexes = np.full((m, k), n, dtype=np.intp)
+        if m > 0 and n > 0:
+            #ranges of the neighbors in the 27 cells around every point (cells outside the grid are empty)
+            valid = ~np.isnan(points).any(axis=1)
+            cells = self._cells(np.where(valid[:, np.newaxis], points, self.origin))
+            cells = cells[:, np.newaxis, :] + self.OFFSETS[np.newaxis, :, :]
+            inside = np.all((cells >= -1) & (cells < self.shape - 2), axis=2) & valid[:, np.newaxis]
+            keys = self._keys(np.clip(cells, -1, self.shape - 2)).ravel()
+            if self.cellStarts is not None:
+                starts = self.cellStarts[keys]
+                ends = self.cellStarts[keys + 1]
+            else:
+                starts = np.searchsorted(self.keys, keys, side="left")
+                ends = np.searchsorted(self.keys, keys, side="right")
+            counts = np.where(inside.ravel(), ends - starts, 0)
+
+            #all (point, neighbor) pairs in those ranges, grouped by point
+            total = counts.sum()
+            pairPoints = np.repeat(np.arange(m), counts.reshape(m, -1).sum(axis=1))
+            first = np.cumsum(counts) - counts
+            pairNeighbors = self.order[np.repeat(starts - first, counts) + np.arange(total)]
+            diff = points[pairPoints] - self.neighbors[pairNeighbors]
+            pairDist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+            #the k closest pairs of every point: take the closest pair and remove it, k times
+            pointCounts = counts.reshape(m, -1).sum(axis=1)
+            found = np.flatnonzero(pointCounts)
+            segments = (np.cumsum(pointCounts) - pointCounts)[found]
+            for i in range(k):
+                if total == 0:
+                    break
+                closest = np.minimum.reduceat(pairDist, segments)
+                isClosest = np.flatnonzero(pairDist == np.repeat(closest, pointCounts[found]))
+                isClosest = isClosest[np.r_[True, pairPoints[isClosest[1:]] != pairPoints[isClosest[:-1]]]]
+                closest = np.isfinite(closest)
+                dist[found[closest], i] = pairDist[isClosest[closest]]
+                indexes[found[closest], i] = pairNeighbors[isClosest[closest]]
+                pairDist[isClosest] = np.inf
+
+            #everything within one cell size is in the surrounding cells, search the others again
+            redo = ~(dist[:, -1] <= self.cellSize) & valid
+            if redo.any():
+                redoDist, redoIndexes = KDTreeSearch(self.neighbors).query(points[redo], k)
+                dist[redo] = redoDist.reshape(-1, k)
+                indexes[redo] = redoIndexes.reshape(-1, k)
+        if k == 1:
+            return dist[:, 0], indexes[:, 0]
+        return dist, indexes
+
+
+BACKENDS = {"brute": BruteForceSearch,
+            "kdtree": KDTreeSearch,
+            "grid": GridSearch}
+
+# Limits for the automatic selection, see "python benchmark.py neighbors"
+BRUTE_FORCE_MAX_PAIRS = 2500        # brute force as long as points x neighbors is at most this
+BRUTE_FORCE_MAX_POINTS = 10         # or there are only that many points (building any structure costs more)
+GRID_MIN_NEIGHBORS = 10000          # uniform grid instead of kd-tree from this many neighbors on,
+GRID_MIN_RATIO = 10                 # if there are more than GRID_MIN_RATIO times as many neighbors as points
+
+
+def selectBackend(numNeighbors, numPoints):
+    """
+        Returns the name of the fastest backend for the given number of neighbors and query points
+    """
+    if numNeighbors * numPoints <= BRUTE_FORCE_MAX_PAIRS or numPoints <= BRUTE_FORCE_MAX_POINTS:
+        return "brute"
+    if numNeighbors >= GRID_MIN_NEIGHBORS and numNeighbors > GRID_MIN_RATIO * numPoints:
+        return "grid"
+    return "kdtree"
+
+
+def createNeighborSearch(neighbors, numPoints=None, backend="auto"):
+    """
+        Returns a search structure over the given (n x 3) neighbors. backend is "brute", "kdtree",
+        "grid" or "auto", which chooses from the number of neighbors and the number of points
+        that will be queried (default: as many as neighbors).
+    """
+    neighbors = _asPoints(neighbors)
+    if backend == "auto":
+        backend = selectBackend(len(neighbors), len(neighbors) if numPoints is None else numPoints)
+        if backend == "grid" and neighbors.shape[1] != 3:
+            backend = "kdtree"
+    if not backend in BACKENDS:
+        raise ValueError("Unknown neighbor search backend: " + str(backend))
+    return BACKENDS[backend](neighbors)
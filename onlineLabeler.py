@@ -0,0 +1,123 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Labels markers of a live capture frame by frame, with the same assignment, bounding box,
+# skeleton extrapolation and hand heuristics as MoCapLabeledDB:
+#     labeler = OnlineLabeler(firstFrame)         # {marker name: [x, y, z]} of a correctly labeled frame
+#     positions = labeler.push(framePoints)       # {point id: [x, y, z]} of the next frame
+# positions maps every marker name to its position, extrapolated if the marker is missing
+# (see labeler.missing). See replay.py for measuring the latency by replaying a logfile.
+
+import time
+import numpy as np
+
+from labelMoCapDB import MoCapLabeledDB
+
+
+class OnlineLabeler(MoCapLabeledDB):
+    """
+        MoCapLabeledDB that is filled by push() instead of reading a logfile.
+        Only the last WINDOW frames are kept.
+    """
+    LATENCY_BUDGET = 1.0/240    # seconds per frame, one frame at 240 Hz
+    HEURISTICS_SHARE = 0.5      # the hand heuristics are skipped if labeling a frame took more than this share of the budget
+    WINDOW = 100                # frames kept in memory
+
+    def __init__(self, firstFrame,
+                 marker_names=None,
+                 labeled_marker_names=[],
+                 check_hand_data=1,
+                 use_skeleton=1,
+                 skeleton_file=None,
+                 assignment_method="optimal",
+                 latency_budget=None,
+                 dtype=np.float64):
+        """
+            firstFrame: {marker name: [x, y, z]} of a correctly labeled frame
+            marker_names: the order of the markers (default: sorted names)
+            latency_budget: seconds per frame (default LATENCY_BUDGET)
+        """
+        self.fallback_frames = []
+        self.frame_marker_names = {}
+        self.specialFrames = []
+        self.ignoredMarkerNames = []
+        self.tracklets = None
+        self.stream_to = None
+        self.latencyBudget = latency_budget if latency_budget is not None else self.LATENCY_BUDGET
+        self.latency = 0.0                      # seconds of the last push
+        self.overBudget = 0                     # number of frames that took longer than the budget
+        self.skippedChecks = 0                  # number of frames without hand heuristics (not enough time left)
+        self.missing = []                       # names of the markers missing in the last frame
+
+        if marker_names is None:
+            marker_names = sorted(firstFrame.keys())
+        firstFrameData = dict((name, list(firstFrame.get(name, []))) for name in marker_names)
+        self._initLabelingState(marker_names, marker_names, 0, 2*self.WINDOW, firstFrameData,
+                                labeled_marker_names, check_hand_data, assignment_method, use_skeleton, skeleton_file, dtype)
+        self.frames = 1                         # frames labeled so far
+        self.handChecks = check_hand_data and "Hands_R_T4" in self.names
+
+    def push(self, framePoints):
+        """
+            Labels the next frame.
+            Input: {point id: [x, y, z]} with the points of the frame, or a (points x 3) array
+                   (the ids are the indexes then). Points without data are [] or NaN.
+            Output: {marker name: [x, y, z]}
+        """
+        start_time = time.time()
+        frame = self.frames
+        if isinstance(framePoints, dict):
+            items = framePoints.iteritems()
+        else:
+            items = enumerate(np.asarray(framePoints).tolist())
+        logdata = {}
+        for point, position in items:
+            position = list(position)
+            logdata[point] = position if len(position) > 0 and position[0] == position[0] else []
+
+        self.relabelAllMarkers(frame, logdata, output=0)
+        #the hand heuristics only if they may change anything and there is enough time left
+        if self.handChecks:
+            if not self.needsHandChecks(frame):
+                self.skippedHandChecks += 1
+            elif time.time() - start_time < self.HEURISTICS_SHARE * self.latencyBudget:
+                self.check_fingerCrossover(frame)
+                self.check_backwardsTip(frame)
+            else:
+                self.skippedChecks += 1
+        self.cacheBbox(frame)
+        self.frames += 1
+        if self.frames - self._bboxOffset >= len(self._bboxCached):
+            self.dropFrames(self.frames - self.WINDOW)
+
+        positions = dict((m.name, m.getdata(frame)) for m in self.markers)
+        self.missing = [m.name for m in self.markers if m.isMissingFrame(frame)]
+        self.latency = time.time() - start_time
+        if self.latency > self.latencyBudget:
+            self.overBudget += 1
+        return positions
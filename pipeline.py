@@ -0,0 +1,97 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Threads for running the stages of the streaming mode (reading, labeling, writing) at the same
+# time, connected by bounded queues. The labeling itself runs in the calling thread, reading and
+# writing are mostly parsing, formatting and I/O in numpy and the file system.
+
+import sys
+import time
+import threading
+
+
+class Stage(threading.Thread):
+    """
+        A pipeline stage running in its own thread.
+        A source stage (no inbox) calls work() until it returns None and puts every result into the outbox,
+        followed by None. A sink stage (no outbox) calls work(item) for every item of the inbox until it gets None.
+        busy is the time spent in work, errors are raised again by finish().
+    """
+    def __init__(self, name, work, inbox=None, outbox=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.busy = 0.0
+        self.error = None
+
+    def run(self):
+        try:
+            if self.inbox is None:
+                while True:
+                    start_time = time.time()
+                    item = self.work()
+                    self.busy += time.time() - start_time
+                    self.outbox.put(item)
+                    if item is None:
+                        break
+            else:
+                while True:
+                    item = self.inbox.get()
+                    if item is None:
+                        break
+                    start_time = time.time()
+                    self.work(item)
+                    self.busy += time.time() - start_time
+        except Exception:
+            self.error = sys.exc_info()
+            if self.outbox is not None:
+                self.outbox.put(None)
+            elif self.inbox is not None:
+                #keep taking items so that the producer does not block
+                while self.inbox.get() is not None:
+                    pass
+
+    def finish(self):
+        """
+            Waits for the stage to end and raises its error, if any
+        """
+        self.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+
+def printUtilization(busy, wallTime):
+    """
+        Prints the share of the wall time every stage was busy. busy is a list of (stage name, seconds).
+        The stage closest to 100% is the bottleneck.
+    """
+    print "Stage utilization (%.1f seconds):" % wallTime
+    for name, seconds in busy:
+        print "  %-10s %7.1f s %5.0f%%" % (name, seconds, 100.0 * seconds / max(wallTime, 1e-9))
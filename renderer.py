@@ -0,0 +1,165 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Renders snapshots of the labeled markers (one 3D plot per frame) to image files, in a pool of
+# processes and without a display (Agg canvas, independent of the pyplot backend):
+#     renderSnapshots(labeledDB, frames, filenames, processes=4)
+# The bones of the skeleton are drawn as one line collection and the markers as one scatter per frame,
+# and every figure is freed after it is saved. drawFrame draws a frame into any figure, e.g. for plt.show(),
+# see frameViewer.py for a plot that is updated from frame to frame.
+
+import multiprocessing
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from mpl_toolkits.mplot3d import Axes3D
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+
+
+FIGURE_SIZE = (18, 12)                          # inches
+LIMITS = ((-0.5, 0.5), (-0.5, 0.5), (-0.5, 0.5))   # x, y and z limits of the axes (the data is drawn with z and y swapped)
+VIEW = (70, 90)                                 # elevation and azimuth of the camera
+BONE_COLOR = '#FA4200'
+BONE_WIDTH = 1.5
+MARKER_COLOR = '#04B2E5'
+MARKER_EDGE_COLOR = 'b'
+
+_renderJob = None   # (labeled db, bones, relabel texts, limits) of the current renderSnapshots, shared with the workers
+
+
+def getBones(skeleton):
+    """
+        Returns the (bones x 2) parent and child indexes of the bones of a skeleton.CompiledSkeleton
+    """
+    children = np.flatnonzero(skeleton.parents >= 0)
+    return np.column_stack([skeleton.parents[children], children])
+
+
+def getRelabelTexts(db, frames=None):
+    """
+        Returns {frame: text} with the markers relabeled at each of the given frames
+        ("Remaps:" and a line "name : old name -> new name" per marker).
+        frames=None: all frames at which markers were relabeled.
+    """
+    if frames is None:
+        texts, begin, end = {}, 0, -1
+    else:
+        texts = dict((frame, "Remaps: \n") for frame in frames)
+        if len(texts) == 0:
+            return texts
+        begin, end = min(texts), max(texts)
+    for frame, name, old, new in db.getRelabelEvents(begin, end):
+        if frames is None or frame in texts:
+            texts[frame] = texts.get(frame, "Remaps: \n") + name + " : " + old + " -> " + new + " \n"
+    return texts
+
+
+def getFramePositions(db, frame):
+    """
+        Returns the (markers x 3) positions of the labeled markers at the frame, NaN if there is no data
+    """
+    return np.array([m.getdata(frame) or [np.nan]*3 for m in db.markers], dtype=float)
+
+
+def createAxes(fig, limits=LIMITS):
+    """
+        Adds the 3D axes of the plots to the figure, with the given limits, labels and view
+    """
+    ax = fig.add_subplot(111, projection='3d')
+    ax.set_xlim3d(limits[0])
+    ax.set_ylim3d(limits[1])
+    ax.set_zlim3d(limits[2])
+    ax.set_xlabel('X')
+    ax.set_ylabel('Z')
+    ax.set_zlabel('Y')
+    ax.view_init(elev=VIEW[0], azim=VIEW[1])
+    return ax
+
+
+def getPlotPoints(positions):
+    """
+        The (markers x 3) positions in the coordinates of the axes (y of the data is drawn upwards)
+    """
+    return positions[:, [0, 2, 1]]
+
+
+def drawFrame(fig, positions, bones, frame, text=None, limits=LIMITS):
+    """
+        Draws the (markers x 3) positions and the (bones x 2) bones between them into a new 3D axes of the
+        figure, with the frame number and the given text (e.g. from getRelabelTexts). Returns the axes.
+    """
+    ax = createAxes(fig, limits)
+    points = getPlotPoints(positions)
+    visible = ~np.isnan(points[:, 0])
+    bones = bones[visible[bones].all(axis=1)]
+    if len(bones) > 0:
+        ax.add_collection3d(Line3DCollection(points[bones], colors=BONE_COLOR, linewidths=BONE_WIDTH))
+    if visible.any():
+        ax.scatter(points[visible, 0], points[visible, 1], points[visible, 2],
+                   edgecolor=MARKER_EDGE_COLOR, c=MARKER_COLOR, marker='o', depthshade=False)
+    if text is not None:
+        ax.text2D(-0.1, 0.8, text, transform=ax.transAxes, va='top')
+    ax.text2D(-0.1, 0.95, "Frame: " + str(frame), transform=ax.transAxes)
+    return ax
+
+
+def renderSnapshots(db, frames, filenames, limits=LIMITS, debug=1, processes=1):
+    """
+        Saves a plot of each of the given frames of the MoCapLabeledDB to the corresponding file,
+        with the relabeled markers if debug is set. Renders in the given number of processes
+        (None: one per cpu), forked after the relabel texts are collected.
+    """
+    global _renderJob
+    jobs = zip(frames, filenames)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(jobs)))
+    _renderJob = (db, getBones(db.compiledSkeleton), getRelabelTexts(db, frames) if debug else {}, limits)
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        pool.map(_renderSnapshot, jobs, 1)
+        pool.close()
+        pool.join()
+    else:
+        for job in jobs:
+            _renderSnapshot(job)
+    _renderJob = None
+
+
+def _renderSnapshot(job):
+    """
+        Renders one frame of _renderJob to its file
+    """
+    frame, filename = job
+    db, bones, texts, limits = _renderJob
+    #not managed by pyplot, so it is freed as soon as it is saved
+    fig = Figure(figsize=FIGURE_SIZE)
+    FigureCanvasAgg(fig)
+    drawFrame(fig, getFramePositions(db, frame), bones, frame, texts.get(frame), limits)
+    fig.savefig(filename, bbox_inches='tight')
+    fig.clf()
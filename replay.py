@@ -0,0 +1,157 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Replays a logfile as live capture stream over UDP on this machine and labels it with an
+# OnlineLabeler, to measure the latency without capture hardware. Run as
+#     python replay.py <logfile.csv> [speed] [port]
+# speed 1 sends the frames at the capture rate of the logfile, 2 twice as fast.
+# Every packet holds the send time, the frame and the id (logfile column) and position of every
+# point with data. The first frame is used as labeled frame for the markers not named "Marker*".
+
+import sys
+import time
+import socket
+import struct
+import threading
+import numpy as np
+
+from mocapReader import MoCapStreamReader
+from onlineLabeler import OnlineLabeler
+
+
+HEADER = struct.Struct("<dii")     # send time, frame, number of points
+DEFAULT_PORT = 9763
+DEFAULT_FRAME_RATE = 240.0          # if the logfile does not give one
+STREAM_TIMEOUT = 3.0                # seconds without a packet after which the stream counts as ended (the empty packet may be lost)
+
+
+def encodeFrame(sendTime, frame, positions):
+    """
+        Packs the points with data of a (columns x 3) array of positions (NaN if missing)
+    """
+    ids = np.flatnonzero(~np.isnan(positions[:, 0])).astype(np.int32)
+    return HEADER.pack(sendTime, frame, len(ids)) + ids.tostring() + positions[ids].astype(np.float64).tostring()
+
+
+def decodeFrame(packet):
+    """
+        Returns send time, frame, ids and (points x 3) positions of a packet
+    """
+    sendTime, frame, count = HEADER.unpack_from(packet)
+    start = HEADER.size
+    ids = np.fromstring(packet[start:start+4*count], dtype=np.int32)
+    positions = np.fromstring(packet[start+4*count:start+4*count+24*count], dtype=np.float64).reshape(count, 3)
+    return sendTime, frame, ids, positions
+
+
+def sendFrames(datafile, port, speed=1.0):
+    """
+        Sends the frames of the logfile to localhost at the capture rate times speed, then an empty packet
+    """
+    reader = MoCapStreamReader(datafile)
+    frameTime = 1.0 / ((reader.frameRate or DEFAULT_FRAME_RATE) * speed)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start_time = time.time()
+    block = reader.readBlock()
+    while block is not None:
+        for row in range(block.frames):
+            frame = block.offset + row
+            wait = start_time + frame*frameTime - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            sock.sendto(encodeFrame(time.time(), frame, block.positions[row]), ("127.0.0.1", port))
+        block = reader.readBlock()
+    sock.sendto("", ("127.0.0.1", port))
+    reader.close()
+
+
+def replay(datafile, speed=1.0, port=DEFAULT_PORT, check_hand_data=1, timeout=STREAM_TIMEOUT):
+    """
+        Replays the logfile over UDP, labels every received frame and prints the latency percentiles.
+        The replay ends with the empty packet after the last frame, or if no packet arrived for timeout seconds.
+        Returns the latencies (send to labeled, in seconds) and the OnlineLabeler.
+    """
+    reader = MoCapStreamReader(datafile)
+    names = reader.names
+    markerNames = [n for n in names if not n.startswith("Marker")]
+    frameRate = reader.frameRate or DEFAULT_FRAME_RATE
+    reader.close()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sock.bind(("127.0.0.1", port))
+    sock.settimeout(timeout)
+    sender = threading.Thread(target=sendFrames, args=(datafile, port, speed))
+    sender.daemon = True
+    sender.start()
+
+    labeler = None
+    latencies = []
+    pushTimes = []
+    lastFrame = -1
+    dropped = 0
+    while True:
+        try:
+            packet = sock.recv(65536)
+        except socket.timeout:
+            break
+        if len(packet) == 0:
+            break
+        sendTime, frame, ids, positions = decodeFrame(packet)
+        dropped += frame - lastFrame - 1
+        lastFrame = frame
+        points = dict((names[i], p) for i, p in zip(ids.tolist(), positions.tolist()))
+        if labeler is None:
+            labeler = OnlineLabeler(dict((n, p) for n, p in points.items() if n in markerNames), markerNames,
+                                    check_hand_data=check_hand_data, latency_budget=1.0/frameRate)
+            continue
+        labeler.push(points)
+        latencies.append(time.time() - sendTime)
+        pushTimes.append(labeler.latency)
+    sender.join()
+    sock.close()
+
+    latencies = np.array(latencies)
+    print "Replayed", lastFrame + 1, "frames at %.0f Hz," % (frameRate*speed), dropped, "dropped"
+    print "%-24s %8s %8s %8s %8s" % ("milliseconds", "50%", "95%", "99%", "max")
+    for name, values in [("labeling (push)", np.array(pushTimes)), ("send to labeled", latencies)]:
+        if len(values) > 0:
+            print "%-24s %8.2f %8.2f %8.2f %8.2f" % ((name,) + tuple(1e3*np.percentile(values, [50, 95, 99, 100])))
+    if labeler is not None:
+        print "Frames over the budget of %.2f ms:" % (1e3*labeler.latencyBudget), labeler.overBudget, \
+              "- without hand heuristics:", labeler.skippedChecks
+    return latencies, labeler
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: python replay.py <logfile.csv> [speed] [port]"
+        sys.exit(1)
+    replay(sys.argv[1],
+           float(sys.argv[2]) if len(sys.argv) > 2 else 1.0,
+           int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_PORT)
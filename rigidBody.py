@@ -0,0 +1,116 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Rigid marker clusters, e.g. the markers on the back of the hand and the wrist, which move (almost)
+# rigidly. The shape of a cluster is estimated from the frames in which all its markers are visible,
+# then the pose of the cluster is fitted to the visible markers of every frame in which some are missing
+# (weighted Kabsch, one batched SVD over all those frames), and the missing markers are placed there:
+#     recovered = fitRigidClusters(positions, missing, [[0, 1, 2, 3], ...])
+# with the (frames x markers x 3) labeled positions (recovered in place), the (frames x markers) missing
+# flags and the marker indexes of every cluster. Returns the (frames x markers) flags of the recovered positions.
+
+import numpy as np
+
+
+HAND_CLUSTERS = [["Hands_%s_%s" % (hand, marker) for marker in ("Cin", "Cout", "Ain", "Aout", "Win", "Wout")]
+                 for hand in ("R", "L")]    # back of the hand and wrist of both hands
+MIN_VISIBLE = 3                 # visible markers of a cluster needed to fit its pose
+MAX_RESIDUAL = 0.003            # meters, a frame is not recovered if its visible markers are further from the fitted shape (RMS), e.g. because one is mislabeled
+REFERENCE_ITERATIONS = 3        # alignments of the complete frames for estimating the shape
+REFERENCE_FRAMES = 10000        # at most that many complete frames are used for estimating the shape
+
+
+def kabsch(reference, observed, weights):
+    """
+        Batched weighted Kabsch algorithm: the rotations (frames x 3 x 3) and translations (frames x 3)
+        that move the (markers x 3) reference best onto the (frames x markers x 3) observed positions,
+        observed ~ reference.dot(rotation.T) + translation, weighting the markers with the (frames x markers)
+        weights (0 for markers without data, NaN is ignored there).
+    """
+    w = weights[:, :, np.newaxis]
+    observed = np.where(w > 0, observed, 0.0)
+    total = w.sum(axis=1)
+    referenceCentroid = (w * reference).sum(axis=1) / total
+    observedCentroid = (w * observed).sum(axis=1) / total
+    a = w * (reference - referenceCentroid[:, np.newaxis])
+    b = observed - observedCentroid[:, np.newaxis]
+    u, s, vt = np.linalg.svd(np.matmul(a.transpose(0, 2, 1), b))
+    #no reflections
+    v = vt.transpose(0, 2, 1)
+    ut = u.transpose(0, 2, 1)
+    v[:, :, 2] *= np.where(np.linalg.det(np.matmul(v, ut)) < 0, -1.0, 1.0)[:, np.newaxis]
+    rotations = np.matmul(v, ut)
+    translations = observedCentroid - np.matmul(rotations, referenceCentroid[:, :, np.newaxis])[:, :, 0]
+    return rotations, translations
+
+
+def estimateReference(observed, iterations=REFERENCE_ITERATIONS):
+    """
+        Shape of a cluster (markers x 3, centered) from the (frames x markers x 3) positions of frames
+        in which all its markers are visible: the frames are aligned onto the shape, starting with the
+        first frame, and the median is taken, which ignores single mislabeled frames.
+    """
+    if len(observed) > REFERENCE_FRAMES:
+        observed = observed[np.linspace(0, len(observed) - 1, REFERENCE_FRAMES).astype(int)]
+    reference = observed[0] - observed[0].mean(axis=0)
+    weights = np.ones(observed.shape[0:2])
+    for _ in range(iterations):
+        rotations, translations = kabsch(reference, observed, weights)
+        aligned = np.matmul(observed - translations[:, np.newaxis], rotations)
+        reference = np.median(aligned, axis=0)
+        reference -= reference.mean(axis=0)
+    return reference
+
+
+def fitRigidClusters(positions, missing, clusters, minVisible=MIN_VISIBLE, maxResidual=MAX_RESIDUAL):
+    """
+        Recovers the missing markers of the clusters (lists of marker indexes) in place, see above.
+        Clusters without a frame in which all markers are visible are skipped.
+    """
+    recovered = np.zeros(missing.shape, dtype=bool)
+    for cluster in clusters:
+        cluster = np.asarray(cluster, dtype=int)
+        observed = positions[:, cluster]
+        visible = ~missing[:, cluster] & ~np.isnan(observed[:, :, 0])
+        count = visible.sum(axis=1)
+        complete = count == len(cluster)
+        partial = np.flatnonzero(~complete & (count >= minVisible))
+        if not complete.any() or len(partial) == 0:
+            continue
+        reference = estimateReference(observed[complete])
+
+        weights = visible[partial].astype(float)
+        rotations, translations = kabsch(reference, observed[partial], weights)
+        fitted = np.matmul(reference, rotations.transpose(0, 2, 1)) + translations[:, np.newaxis]
+        errors = np.where(visible[partial], ((fitted - observed[partial])**2).sum(axis=2), 0.0)
+        good = np.sqrt(errors.sum(axis=1) / count[partial]) <= maxResidual
+
+        frames, columns = np.nonzero(~visible[partial[good]])
+        positions[partial[good][frames], cluster[columns]] = fitted[good][frames, columns]
+        recovered[partial[good][frames], cluster[columns]] = True
+    return recovered
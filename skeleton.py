@@ -26,86 +26,87 @@
  OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
  """
  
-# A lookup table with the parent-child relation for the markers. 
-# Each marker can have only 1 child and 1 parent. 
-          
+# The parent-child relations (bones) of the markers, loaded from a json file:
+#     {"name": "hands", "bones": [["Hands_L_L1", "Hands_L_L2"], ...]}
+# with [parent, child] marker names. Each marker can have only 1 child and 1 parent.
+# The hand skeleton of skeleton.json is used by default, adapt it (or pass another
+# file as skeleton_file) if the markers are named differently.
+
+import os
+import json
+import numpy as np
+
+
+SKELETON_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "skeleton.json")
+
+
+class Skeleton:
+    """
+        Parent and child of every marker name of a skeleton
+    """
+    def __init__(self, bones, name=""):
+        self.name = name
+        self.parents = {}       # {child name: parent name}
+        self.children = {}      # {parent name: child name}
+        for parent, child in bones:
+            if child in self.parents or parent in self.children:
+                raise ValueError("Marker with more than one parent or child in skeleton " + name + ": " + parent + " - " + child)
+            self.parents[child] = parent
+            self.children[parent] = child
+
+    def compile(self, markerNames):
+        """
+            Returns the skeleton as index arrays over the given marker names, see CompiledSkeleton
+        """
+        return CompiledSkeleton(self, markerNames)
+
+
+class CompiledSkeleton:
+    """
+        A skeleton compiled for a list of marker names: parents[i] and children[i] are the indexes of the
+        parent and child of marker i, -1 if it has none or it is not in the list. depth[i] is the number of
+        ancestors of marker i, order lists all markers parents before children.
+    """
+    def __init__(self, skeleton, markerNames):
+        index = dict((name, i) for i, name in enumerate(markerNames))
+        self.names = list(markerNames)
+        self.index = index      # {marker name: index}
+        self.parents = np.array([index.get(skeleton.parents.get(name), -1) for name in markerNames], dtype=int)
+        self.children = np.array([index.get(skeleton.children.get(name), -1) for name in markerNames], dtype=int)
+        self.depth = np.zeros(len(markerNames), dtype=int)
+        for i in range(len(markerNames)):
+            parent = self.parents[i]
+            while parent >= 0:
+                self.depth[i] += 1
+                if self.depth[i] > len(markerNames):
+                    raise ValueError("Cycle in skeleton " + repr(skeleton.name) + " at marker " + markerNames[i])
+                parent = self.parents[parent]
+        self.order = np.argsort(self.depth, kind="mergesort")
+
+    def levels(self, indexes):
+        """
+            Splits the given marker indexes into the levels of the skeleton, roots first. Returns a list with
+            the positions in indexes of the markers of every level, which are neither parents nor children of each other.
+        """
+        depth = self.depth[indexes]
+        return [np.flatnonzero(depth == d) for d in sorted(set(depth.tolist()))]
+
+
+def loadSkeleton(filename=SKELETON_FILE):
+    """
+        Reads a skeleton from a json file with a list of [parent, child] "bones" and an optional "name"
+    """
+    with open(filename) as f:
+        definition = json.load(f)
+    return Skeleton([(str(parent), str(child)) for parent, child in definition["bones"]], str(definition.get("name", "")))
+
+
+# the hand skeleton, used by default
+HAND_SKELETON = loadSkeleton()
+
+
 def parentLookup(x):
-    return {
-        'Hands_R_L2':'Hands_R_L1',
-        'Hands_L_L2':'Hands_L_L1',
-        'Hands_L_L3':'Hands_L_L2',
-        'Hands_L_L4':'Hands_L_L3',
-        'Hands_L_R2':'Hands_L_R1',
-        'Hands_L_R3':'Hands_L_R2',
-        'Hands_L_R4':'Hands_L_R3',
-        'Hands_L_M2':'Hands_L_M1',
-        'Hands_L_M3':'Hands_L_M2',
-        'Hands_L_M4':'Hands_L_M3',
-        'Hands_L_I2':'Hands_L_I1',
-        'Hands_L_I3':'Hands_L_I2',
-        'Hands_L_I4':'Hands_L_I3',
-        'Hands_L_T2':'Hands_L_T1',
-        'Hands_L_T3':'Hands_L_T2',
-        'Hands_L_T4':'Hands_L_T3',
-        'Hands_L_Cin':'Hands_L_Cout',
-        'Hands_L_Ain':'Hands_L_Aout',
-        'Hands_L_Win':'Hands_L_Wout',
-        'Hands_R_L3':'Hands_R_L2',
-        'Hands_R_L4':'Hands_R_L3',
-        'Hands_R_R2':'Hands_R_R1',
-        'Hands_R_R3':'Hands_R_R2',
-        'Hands_R_R4':'Hands_R_R3',
-        'Hands_R_M2':'Hands_R_M1',
-        'Hands_R_M3':'Hands_R_M2',
-        'Hands_R_M4':'Hands_R_M3',
-        'Hands_R_I2':'Hands_R_I1',
-        'Hands_R_I3':'Hands_R_I2',
-        'Hands_R_I4':'Hands_R_I3',
-        'Hands_R_T2':'Hands_R_T1',
-        'Hands_R_T3':'Hands_R_T2',
-        'Hands_R_T4':'Hands_R_T3',
-        'Hands_R_Cin':'Hands_R_Cout',
-        'Hands_R_Ain':'Hands_R_Aout',
-        'Hands_R_Win':'Hands_R_Wout',
-    }.get(x,-1)
+    return HAND_SKELETON.parents.get(x, -1)
     
 def childLookup(x):
-    return {
-        'Hands_L_L1': 'Hands_L_L2',
-        'Hands_L_L2': 'Hands_L_L3',
-        'Hands_L_L3': 'Hands_L_L4',
-        'Hands_L_R1': 'Hands_L_R2',
-        'Hands_L_R2': 'Hands_L_R3',
-        'Hands_L_R3': 'Hands_L_R4',
-        'Hands_L_M1': 'Hands_L_M2',
-        'Hands_L_M2': 'Hands_L_M3',
-        'Hands_L_M3': 'Hands_L_M4',
-        'Hands_L_I1': 'Hands_L_I2',
-        'Hands_L_I2': 'Hands_L_I3',
-        'Hands_L_I3': 'Hands_L_I4',
-        'Hands_L_T1': 'Hands_L_T2',
-        'Hands_L_T2': 'Hands_L_T3',
-        'Hands_L_T3': 'Hands_L_T4',
-        'Hands_L_Cout': 'Hands_L_Cin',
-        'Hands_L_Aout': 'Hands_L_Ain',
-        'Hands_L_Wout': 'Hands_L_Win',
-        'Hands_R_L1': 'Hands_R_L2',
-        'Hands_R_L2': 'Hands_R_L3',
-        'Hands_R_L3': 'Hands_R_L4',
-        'Hands_R_R1': 'Hands_R_R2',
-        'Hands_R_R2': 'Hands_R_R3',
-        'Hands_R_R3': 'Hands_R_R4',
-        'Hands_R_M1': 'Hands_R_M2',
-        'Hands_R_M2': 'Hands_R_M3',
-        'Hands_R_M3': 'Hands_R_M4',
-        'Hands_R_I1': 'Hands_R_I2',
-        'Hands_R_I2': 'Hands_R_I3',
-        'Hands_R_I3': 'Hands_R_I4',
-        'Hands_R_T1': 'Hands_R_T2',
-        'Hands_R_T2': 'Hands_R_T3',
-        'Hands_R_T3': 'Hands_R_T4',
-        'Hands_R_Cout': 'Hands_R_Cin',
-        'Hands_R_Aout': 'Hands_R_Ain',
-        'Hands_R_Wout': 'Hands_R_Win',
-    }.get(x,-1)
-    
\ No newline at end of file
+    return HAND_SKELETON.children.get(x, -1)
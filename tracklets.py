@@ -0,0 +1,115 @@
+""" Automatic Labeling of Motion Capture Markers
+ motion-capture-labeling
+ Version: 1.0
+ 
+ If you use this code for your research then please remember to cite our paper:
+ 
+ Anna Maria Feit, Daryl Weir, and Antti Oulasvirta. 2016. 
+ How We Type: Movement Strategies and Performance in Everyday Typing. 
+ In Proceedings of the 2016 CHI Conference on Human Factors in Computing Systems (CHI '16). 
+ ACM, New York, NY, USA, 4262-4273. 
+ DOI: http://dx.doi.org/10.1145/2858036.2858233
+ 
+ Copyright (C) 2016 by Anna Maria Feit, Aalto University, FI.
+ 
+ Permission is hereby granted, free of charge, to any person obtaining a copy of this
+ software and associated documentation files (the "Software"), to deal in the Software
+ without restriction, including without limitation the rights to use, copy, modify,
+ merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+ permit persons to whom the Software is furnished to do so, subject to the following
+ conditions: The above copyright notice and this permission notice shall be included in
+ all copies or substantial portions of the Software. THE SOFTWARE IS PROVIDED "AS IS",
+ WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+ WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN 
+ NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+ OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+ OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ """
+
+# Splits the columns of the logfile into tracklets: runs of consecutive frames in which a
+# column has data and does not jump further than a threshold from one frame to the next.
+# The optical system usually keeps a column on the same physical marker for hundreds of
+# frames, so between the frames at which any tracklet starts or ends (events), the labeled
+# markers can simply follow their columns (see MoCapLabeledDB.getdata).
+
+import numpy as np
+import multiprocessing
+
+
+class Tracklets:
+    """
+        The tracklets of a take: tracklet i covers the frames [starts[i], ends[i]) of column columns[i].
+    """
+    def __init__(self, columns, starts, ends, frames):
+        self.columns = columns          # np.array: column of every tracklet
+        self.starts = starts            # np.array: first frame of every tracklet
+        self.ends = ends                # np.array: frame after the last frame of every tracklet
+        self.frames = frames
+        #frames at which the set of tracklets changes, sorted
+        self.eventFrames = np.union1d(starts, ends)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def isEvent(self, frame):
+        i = np.searchsorted(self.eventFrames, frame)
+        return i < len(self.eventFrames) and self.eventFrames[i] == frame
+
+    def nextEvent(self, frame):
+        """
+            Returns the first event frame after the given frame, or the number of frames
+        """
+        i = np.searchsorted(self.eventFrames, frame, side="right")
+        if i < len(self.eventFrames):
+            return min(int(self.eventFrames[i]), self.frames)
+        return self.frames
+
+    def getLengths(self):
+        return self.ends - self.starts
+
+
+def _splitColumns(args):
+    """
+        Returns (columns, starts, ends) of the tracklets in the given (frames x columns x 3) block
+    """
+    positions, maxJump, firstColumn = args
+    present = ~np.isnan(positions[:, :, 0])
+    #a tracklet starts where a column appears or jumps, and ends before it disappears or jumps
+    jump = np.zeros(present.shape, dtype=bool)
+    step = positions[1:] - positions[:-1]
+    with np.errstate(invalid='ignore'):
+        jump[1:] = np.einsum('ijk,ijk->ij', step, step) > maxJump*maxJump
+    begins = present.copy()
+    begins[1:] &= ~present[:-1] | jump[1:]
+    finishes = present.copy()
+    finishes[:-1] &= ~present[1:] | jump[1:]
+    #column-wise order, so that the i-th start and the i-th end belong to the same tracklet
+    startColumns, starts = np.nonzero(begins.T)
+    endColumns, ends = np.nonzero(finishes.T)
+    return startColumns + firstColumn, starts, ends + 1
+
+
+def findTracklets(positions, maxJump, processes=1, blockColumns=64):
+    """
+        Input:
+            positions: (frames x columns x 3) np.array, NaN if no data
+            maxJump: a tracklet is split where its column moves further than this from one frame to the next
+            processes: if > 1, blocks of blockColumns columns are split in parallel
+        Output: Tracklets
+    """
+    frames, columns = positions.shape[0:2]
+    blocks = [(positions[:, c:c+blockColumns], maxJump, c) for c in range(0, columns, blockColumns)]
+    if processes > 1 and len(blocks) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(_splitColumns, blocks)
+        pool.close()
+        pool.join()
+    else:
+        results = [_splitColumns(block) for block in blocks]
+    if len(results) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return Tracklets(empty, empty, empty, frames)
+    return Tracklets(np.concatenate([r[0] for r in results]),
+                     np.concatenate([r[1] for r in results]),
+                     np.concatenate([r[2] for r in results]),
+                     frames)